@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import contextlib
+import importlib
+import os
+
+from abc import ABC, abstractmethod
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterator, Optional
+
+from hdx_stable_schema.metadata_archive import MetadataArchive
+from hdx_stable_schema.metadata_processor import (
+    metadata_archive_paths,
+    metadata_file_paths,
+    read_datasets_from_file,
+    reformat_metadata_keys,
+    resource_records,
+    schema_records,
+    summarise_resource_changes,
+)
+
+# Work units (a loose file or an archive block) per shard, shards are handed to workers as they
+# become free so a few slow shards do not hold up the rest
+SHARD_SIZE = 8
+COLUMN_COUNT_BINS = [1, 2, 5, 10, 20, 50, 100]
+
+
+class Report(ABC):
+    """Base class for analytics reports
+
+    A report counts features of one dataset at a time into a Counter. Counters from each shard
+    are added together, so count() must only ever add to the counter. Plugins subclass this,
+    set name and title and are passed to hdx-schema analyse as --report module:ClassName.
+    """
+
+    name = ""
+    title = ""
+
+    @abstractmethod
+    def count(self, metadata: dict, counter: Counter):
+        pass
+
+    def rows(self, counter: Counter) -> list[dict]:
+        return [{"Key": str(k), "Count": str(v)} for k, v in sorted(counter.items())]
+
+
+class FormatsReport(Report):
+    name = "formats"
+    title = "Resources by format"
+
+    def count(self, metadata: dict, counter: Counter):
+        for resource in metadata["result"]["resources"]:
+            counter[resource["format"].upper()] += 1
+
+    def rows(self, counter: Counter) -> list[dict]:
+        return [{"Format": k, "Resources": str(v)} for k, v in counter.most_common()]
+
+
+class ColumnCountsReport(Report):
+    name = "column_counts"
+    title = "Distribution of column counts over schemas"
+
+    def count(self, metadata: dict, counter: Counter):
+        for schema in schema_records(resource_records(metadata)).values():
+            counter[column_count_bin(len(schema.headers))] += 1
+
+    def rows(self, counter: Counter) -> list[dict]:
+        labels = [column_count_label(i) for i in range(len(COLUMN_COUNT_BINS) + 1)]
+        total = max(sum(counter.values()), 1)
+        return [
+            {
+                "Columns": label,
+                "Schemas": str(counter[i]),
+                "Share": f"{100 * counter[i] / total:.1f}%",
+            }
+            for i, label in enumerate(labels)
+        ]
+
+
+class SchemaChangesReport(Report):
+    name = "schema_changes"
+    title = "Resources with schema changes by quarter and format"
+
+    def count(self, metadata: dict, counter: Counter):
+        formats = {x["name"]: x["format"].upper() for x in metadata["result"]["resources"]}
+        for resource_name, changes in summarise_resource_changes(metadata).items():
+            # Changes are flagged with a * after the date of the check
+            quarters = Counter(quarter(x[0:10]) for x in changes["checks"] if "*" in x)
+            for resource_quarter, n_changes in quarters.items():
+                counter[(resource_quarter, formats[resource_name], "resources")] += 1
+                counter[(resource_quarter, formats[resource_name], "changes")] += n_changes
+
+    def rows(self, counter: Counter) -> list[dict]:
+        keys = sorted({(x[0], x[1]) for x in counter}, reverse=True)
+        return [
+            {
+                "Quarter": resource_quarter,
+                "Format": resource_format,
+                "Resources changed": str(counter[(resource_quarter, resource_format, "resources")]),
+                "Changes": str(counter[(resource_quarter, resource_format, "changes")]),
+            }
+            for resource_quarter, resource_format in keys
+        ]
+
+
+REPORTS: dict[str, Report] = {}
+
+
+def register_report(report: Report):
+    REPORTS[report.name] = report
+
+
+for builtin_report in [FormatsReport(), ColumnCountsReport(), SchemaChangesReport()]:
+    register_report(builtin_report)
+
+
+def load_report(report_name: str) -> Report:
+    # Either a registered name or module:attribute, where the attribute is a Report subclass or
+    # instance. A plugin module may also register its own reports when it is imported
+    if report_name in REPORTS:
+        return REPORTS[report_name]
+    module_name, _, attribute = report_name.partition(":")
+    if attribute == "":
+        raise ValueError(f"Unknown report '{report_name}', choose from {sorted(REPORTS)}")
+    report = getattr(importlib.import_module(module_name), attribute)
+    return report() if isinstance(report, type) else report
+
+
+def work_units(source: str | Path) -> list[tuple]:
+    # A directory of loose metadata files and archives, or a single archive
+    source = Path(source)
+    if source.is_dir():
+        units = [("file", str(x)) for x in metadata_file_paths(source)]
+        archive_paths = metadata_archive_paths(source)
+    else:
+        units = []
+        archive_paths = [source]
+    for archive_path in archive_paths:
+        for offset, length in MetadataArchive(archive_path).blocks():
+            units.append(("block", str(archive_path), offset, length))
+    return units
+
+
+def read_work_unit(unit: tuple) -> Iterator[dict]:
+    if unit[0] == "file":
+        yield from read_datasets_from_file(unit[1])
+    else:
+        _, archive_path, offset, length = unit
+        for metadata in MetadataArchive(archive_path).read_block(offset, length):
+            reformat_metadata_keys(metadata)
+            yield metadata
+
+
+def analyse_shard(shard: list[tuple], reports: list[Report]) -> tuple[int, dict[str, Counter]]:
+    counters = {x.name: Counter() for x in reports}
+    n_datasets = 0
+    # The summarisers print a line for each resource without a complete check
+    with open(os.devnull, "w", encoding="utf-8") as devnull, contextlib.redirect_stdout(devnull):
+        for unit in shard:
+            for metadata in read_work_unit(unit):
+                n_datasets += 1
+                for report in reports:
+                    report.count(metadata, counters[report.name])
+    return n_datasets, counters
+
+
+def run_analytics(
+    source: str | Path,
+    reports: list[Report],
+    n_workers: Optional[int] = None,
+    shard_size: int = SHARD_SIZE,
+) -> tuple[int, dict[str, Counter]]:
+    # Returns the number of datasets analysed and the merged counter for each report
+    units = work_units(source)
+    shards = []
+    for start in range(0, len(units), shard_size):
+        stop = start + shard_size
+        shards.append(units[start:stop])
+
+    totals = {x.name: Counter() for x in reports}
+    if n_workers == 1:
+        return merge_partials((analyse_shard(x, reports) for x in shards), totals)
+
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        return merge_partials(pool.map(analyse_shard, shards, [reports] * len(shards)), totals)
+
+
+def merge_partials(
+    partials: Iterator[tuple[int, dict[str, Counter]]], totals: dict[str, Counter]
+) -> tuple[int, dict[str, Counter]]:
+    n_datasets = 0
+    for n_shard_datasets, counters in partials:
+        n_datasets += n_shard_datasets
+        for name, counter in counters.items():
+            totals[name].update(counter)
+    return n_datasets, totals
+
+
+def column_count_bin(n_columns: int) -> int:
+    for i, upper in enumerate(COLUMN_COUNT_BINS):
+        if n_columns <= upper:
+            return i
+    return len(COLUMN_COUNT_BINS)
+
+
+def column_count_label(i: int) -> str:
+    if i == len(COLUMN_COUNT_BINS):
+        return f">{COLUMN_COUNT_BINS[-1]}"
+    lower = 0 if i == 0 else COLUMN_COUNT_BINS[i - 1] + 1
+    if lower >= COLUMN_COUNT_BINS[i]:
+        return str(COLUMN_COUNT_BINS[i])
+    return f"{lower}-{COLUMN_COUNT_BINS[i]}"
+
+
+def quarter(date: str) -> str:
+    return f"{date[0:4]}-Q{(int(date[5:7]) - 1) // 3 + 1}"
@@ -1,28 +1,57 @@
 #!/usr/bin/env python
 # encoding: utf-8
 
+import json
 import sys
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 
 import click
 import requests
 
 from hdx_stable_schema.metadata_processor import (
     read_metadata_from_hdx,
+    read_metadata_from_directory,
     search_by_lucky_dip,
+    iter_search_datasets,
+    resource_records,
+    sample_datasets,
+    schema_records,
     summarise_resource_changes,
     summarise_schema,
     summarise_resource,
     print_schema,
 )
 
-from hdx_stable_schema.utilities import print_list, print_banner
+from hdx_stable_schema.utilities import (
+    print_list,
+    print_banner,
+    print_table_from_list_of_dicts,
+    print_dictionary,
+    parse_memory_size,
+    quiet_downloads,
+)
+
+from hdx_stable_schema.daemon import (
+    forward_to_daemon,
+    get_daemon_status,
+    make_daemon_server,
+    DAEMON_HOST,
+    DAEMON_PORT,
+)
 
-from hdx_stable_schema.data_preview import (
-    get_data_from_hdx,
-    print_data_preview,
-    field_types_from_rows,
+from hdx_stable_schema.schema_similarity import (
+    build_schema_index,
+    group_similar_schemas,
+    SIMILARITY_THRESHOLD,
 )
 
+from hdx_stable_schema.metadata_archive import MetadataArchiveWriter, ARCHIVE_BLOCK_SIZE
+from hdx_stable_schema.schema_watcher import new_watch_state, poll_watched_datasets, WATCH_INTERVAL
+from hdx_stable_schema.header_probe import probe_resources, PROBE_FORMATS, PROBE_WORKERS
+
 
 @click.group()
 @click.version_option()
@@ -41,8 +70,16 @@ def hdx_schema() -> None:
     default=None,
     help="a dataset name or pattern on which to filter list",
 )
-def show_schema(dataset_name: str):
+@click.option(
+    "--group_similar",
+    is_flag=True,
+    default=False,
+    help="mark schemas which are near-duplicates of each other",
+)
+def show_schema(dataset_name: str, group_similar: bool):
     """Show a resource view with a Data Dictionary and a data preview"""
+    if forward_command_to_daemon():
+        return
 
     # Get some metadata some how
     if dataset_name is not None:
@@ -86,6 +123,11 @@ def show_schema(dataset_name: str):
     else:
         print(f"\nFound {len(schemas)} common schemas")
 
+    similar_schemas = {}
+    if group_similar:
+        similar_schemas = group_similar_schemas(schemas)
+    schema_numbers = {str(k): i for i, k in enumerate(schemas.keys(), start=1)}
+
     for i, schema in enumerate(schemas.items(), start=1):
         print(
             f"\nSchema {i}, shared by the following {len(schema[1]['shared_with'])} "
@@ -93,11 +135,531 @@ def show_schema(dataset_name: str):
             flush=True,
         )
         print_list(schema[1]["shared_with"])
+        if len(similar_schemas.get(str(schema[0]), [])) != 0:
+            near_duplicates = ", ".join(
+                f"{schema_numbers[k]} (~{similarity:.2f})"
+                for k, similarity in similar_schemas[str(schema[0])]
+            )
+            print(f"\nNear-duplicate of schema(s): {near_duplicates}", flush=True)
 
         print("\nData Dictionary", flush=True)
         print_schema(schema[1])
 
 
+@hdx_schema.command(name="similar_schemas")
+@click.option(
+    "--dataset_name",
+    is_flag=False,
+    required=True,
+    help="a dataset name",
+)
+@click.option(
+    "--resource_name",
+    is_flag=False,
+    default=None,
+    help="a resource name, all schemas in the dataset are queried if omitted",
+)
+@click.option(
+    "--metadata_directory",
+    is_flag=False,
+    default=None,
+    help="a directory of package_show JSON files to search, "
+    "defaults to datasets from the same organization on HDX",
+)
+@click.option(
+    "--threshold",
+    is_flag=False,
+    default=SIMILARITY_THRESHOLD,
+    type=float,
+    help=f"minimum estimated Jaccard similarity of headers (default: {SIMILARITY_THRESHOLD})",
+)
+def similar_schemas(
+    dataset_name: str, resource_name: str, metadata_directory: str, threshold: float
+):
+    """Show schemas which are near-duplicates of those in a resource"""
+    try:
+        metadata = read_metadata_from_hdx(dataset_name)
+    except requests.exceptions.HTTPError as exception_:
+        if exception_.args[0].startswith("404"):
+            print(f"Dataset '{dataset_name}' was not found", flush=True)
+            sys.exit()
+        else:
+            raise
+
+    if metadata_directory is not None:
+        corpus = read_metadata_from_directory(metadata_directory)
+    else:
+        organization_name = metadata["result"]["organization"]["name"]
+        corpus = iter_search_datasets(f"organization:{organization_name}")
+    schema_index = build_schema_index(corpus, threshold=threshold)
+
+    dataset_name = metadata["result"]["name"]
+    print_banner([f"Dataset name: {dataset_name}", "Similar schemas"])
+    print(f"Indexed {len(schema_index.signatures)} schemas", flush=True)
+
+    for header_hash, schema in schema_records(resource_records(metadata)).items():
+        if resource_name is not None and resource_name not in schema.shared_with:
+            continue
+        rows = []
+        for key, similarity in schema_index.query(schema, threshold=threshold):
+            entry = schema_index.entries[key]
+            if entry["dataset_name"] == dataset_name and entry["header_hash"] == header_hash:
+                continue
+            rows.append(
+                {
+                    "Similarity": f"{similarity:.2f}",
+                    "Dataset": entry["dataset_name"],
+                    "Sheet": entry["sheet"],
+                    "Resources": ", ".join(entry["shared_with"]),
+                }
+            )
+        print(
+            f"\nSchema shared by {', '.join(schema.shared_with)} "
+            f"on sheet '{schema.sheet}' has {len(rows)} similar schemas",
+            flush=True,
+        )
+        print_table_from_list_of_dicts(rows)
+
+
+@hdx_schema.command(name="sample_datasets")
+@click.option(
+    "--n_samples",
+    is_flag=False,
+    default=10,
+    type=int,
+    help="the number of random datasets to draw",
+)
+@click.option(
+    "--seed",
+    is_flag=False,
+    default=None,
+    type=int,
+    help="a random seed for reproducible samples",
+)
+@click.option(
+    "--output_path",
+    is_flag=False,
+    default=None,
+    help="write the sample as a package_search style JSON file, or an archive if the path "
+    "ends .ndjson.gz",
+)
+def sample(n_samples: int, seed: int, output_path: str):
+    """Draw a batch of random datasets for schema surveys"""
+    datasets, n_requests = sample_datasets(n_samples, seed=seed)
+
+    print_banner([f"Random sample of {len(datasets)} datasets"])
+    print(f"Drew {len(datasets)} datasets in {n_requests} package_search requests", flush=True)
+    rows = [
+        {
+            "Dataset name": x["result"]["name"],
+            "Resources": str(len(x["result"]["resources"])),
+            "Formats": ", ".join(sorted({y["format"] for y in x["result"]["resources"]})),
+        }
+        for x in datasets
+    ]
+    print_table_from_list_of_dicts(rows)
+
+    if output_path is not None and output_path.endswith(".ndjson.gz"):
+        with MetadataArchiveWriter(output_path) as archive_writer:
+            for metadata in datasets:
+                archive_writer.add(metadata)
+        print(f"Wrote sample to {output_path}", flush=True)
+    elif output_path is not None:
+        with open(output_path, "w", encoding="utf-8") as output_file:
+            json.dump(
+                {
+                    "success": True,
+                    "result": {"count": len(datasets), "results": [x["result"] for x in datasets]},
+                },
+                output_file,
+            )
+        print(f"Wrote sample to {output_path}", flush=True)
+
+
+@hdx_schema.command(name="archive_metadata")
+@click.option(
+    "--metadata_directory",
+    is_flag=False,
+    required=True,
+    help="a directory of package_show and package_search JSON files",
+)
+@click.option(
+    "--archive_path",
+    is_flag=False,
+    required=True,
+    help="the archive to write, conventionally ending .ndjson.gz",
+)
+@click.option(
+    "--append",
+    is_flag=True,
+    default=False,
+    help="add to an existing archive, skipping snapshots it already holds",
+)
+@click.option(
+    "--block_size",
+    is_flag=False,
+    default=ARCHIVE_BLOCK_SIZE,
+    type=int,
+    help=f"datasets per compressed block (default: {ARCHIVE_BLOCK_SIZE})",
+)
+def archive_metadata(metadata_directory: str, archive_path: str, append: bool, block_size: int):
+    """Pack saved dataset metadata into a compressed archive with an offset index"""
+    if Path(archive_path).resolve().parent == Path(metadata_directory).resolve():
+        print("The archive must be written outside the metadata directory", flush=True)
+        sys.exit()
+
+    n_archived = 0
+    with MetadataArchiveWriter(archive_path, block_size=block_size, append=append) as writer:
+        archived = {(x["name"], x["metadata_modified"]) for x in writer.entries}
+        for metadata in read_metadata_from_directory(metadata_directory):
+            key = (metadata["result"]["name"], metadata["result"].get("metadata_modified", ""))
+            if key in archived:
+                continue
+            archived.add(key)
+            writer.add(metadata)
+            n_archived += 1
+
+    print(
+        f"Archived {n_archived} datasets to {archive_path} "
+        f"({Path(archive_path).stat().st_size} bytes, {len(writer.entries)} in total)",
+        flush=True,
+    )
+
+
+@hdx_schema.command(name="analyse")
+@click.option(
+    "--source",
+    is_flag=False,
+    required=True,
+    help="a directory of saved metadata files and archives, or a single archive",
+)
+@click.option(
+    "--report",
+    "report_names",
+    is_flag=False,
+    multiple=True,
+    help="a built-in report (formats, column_counts, schema_changes) or a plugin as "
+    "module:ClassName, may be repeated, all built-in reports by default",
+)
+@click.option(
+    "--n_workers",
+    is_flag=False,
+    default=None,
+    type=int,
+    help="worker processes, defaults to the number of CPUs",
+)
+def analyse(source: str, report_names: tuple[str], n_workers: int):
+    """Run aggregate reports over saved metadata in parallel"""
+    # pylint: disable=import-outside-toplevel
+    from hdx_stable_schema.analytics import load_report, run_analytics, REPORTS
+
+    reports = [load_report(x) for x in report_names] if report_names else list(REPORTS.values())
+
+    print_banner([f"Analytics over {source}"])
+    start_time = time.time()
+    n_datasets, totals = run_analytics(source, reports, n_workers=n_workers)
+    print(f"Analysed {n_datasets} datasets in {time.time() - start_time:.1f}s", flush=True)
+
+    for report in reports:
+        print(f"\n{report.title}", flush=True)
+        print_table_from_list_of_dicts(report.rows(totals[report.name]))
+
+
+@hdx_schema.command(name="stability")
+@click.option(
+    "--source",
+    is_flag=False,
+    required=True,
+    help="a directory of saved metadata files and archives, or a single archive",
+)
+@click.option(
+    "--state_path",
+    is_flag=False,
+    default=None,
+    help="a JSON file of aggregates to update, only checks newer than those it holds are added",
+)
+@click.option(
+    "--by",
+    "groupings",
+    is_flag=False,
+    multiple=True,
+    type=click.Choice(["all", "format", "organization"]),
+    help="groupings to report, may be repeated (default: all, format and organization)",
+)
+def stability(source: str, state_path: str, groupings: tuple[str]):
+    """Report schema stability by format and organization"""
+    # pylint: disable=import-outside-toplevel
+    from hdx_stable_schema.analytics import work_units, read_work_unit
+    from hdx_stable_schema.schema_stability import (
+        new_stability_state,
+        update_stability,
+        stability_rows,
+    )
+
+    if state_path is not None and Path(state_path).exists():
+        with open(state_path, encoding="utf-8") as state_file:
+            stability_state = json.load(state_file)
+    else:
+        stability_state = new_stability_state()
+
+    n_datasets = 0
+    n_new_checks = 0
+    for unit in work_units(source):
+        for metadata in read_work_unit(unit):
+            n_datasets += 1
+            n_new_checks += update_stability(stability_state, metadata)
+
+    if state_path is not None:
+        with open(state_path, "w", encoding="utf-8") as state_file:
+            json.dump(stability_state, state_file)
+
+    print_banner([f"Schema stability from {source}"])
+    print(
+        f"Read {n_datasets} datasets, {n_new_checks} new checks added to "
+        f"{len(stability_state['resources'])} resources",
+        flush=True,
+    )
+    for grouping in groupings or ["all", "format", "organization"]:
+        print(f"\nBy {grouping}", flush=True)
+        print_table_from_list_of_dicts(stability_rows(stability_state, grouping))
+
+
+@hdx_schema.command(name="export_tables")
+@click.option(
+    "--source",
+    is_flag=False,
+    required=True,
+    help="a directory of saved metadata files and archives, or a single archive",
+)
+@click.option(
+    "--output_directory",
+    is_flag=False,
+    required=True,
+    help="an empty or new directory for the resources, sheets, columns, checks and previews tables",
+)
+@click.option(
+    "--format",
+    "file_format",
+    is_flag=False,
+    default="parquet",
+    type=click.Choice(["parquet", "arrow"]),
+    help="Parquet or Arrow IPC files (default: parquet)",
+)
+@click.option(
+    "--batch_rows",
+    is_flag=False,
+    default=50000,
+    type=int,
+    help="rows buffered per table before a batch is written (default: 50000)",
+)
+@click.option(
+    "--preview_rows",
+    is_flag=False,
+    default=0,
+    type=int,
+    help="rows of each CSV and XLSX resource to fetch into the previews table (default: 0)",
+)
+def export_tables(
+    source: str, output_directory: str, file_format: str, batch_rows: int, preview_rows: int
+):
+    """Export schemas, check histories and previews as partitioned columnar tables"""
+    # pylint: disable=import-outside-toplevel
+    from hdx_stable_schema.analytics import work_units, read_work_unit
+    from hdx_stable_schema.parquet_export import export_tables as export_datasets
+
+    if Path(output_directory).exists() and any(Path(output_directory).iterdir()):
+        print(f"Output directory {output_directory} is not empty", flush=True)
+        sys.exit()
+
+    print_banner([f"Exporting {source} to {output_directory}"])
+    start_time = time.time()
+    datasets = (x for unit in work_units(source) for x in read_work_unit(unit))
+    n_datasets, n_rows = export_datasets(
+        datasets,
+        output_directory,
+        file_format=file_format,
+        batch_rows=batch_rows,
+        preview_rows=preview_rows,
+    )
+    print(f"Exported {n_datasets} datasets in {time.time() - start_time:.1f}s", flush=True)
+    print_table_from_list_of_dicts([{"Table": k, "Rows": str(v)} for k, v in n_rows.items()])
+
+
+@hdx_schema.command(name="probe_headers")
+@click.option(
+    "--dataset_name",
+    is_flag=False,
+    default=None,
+    help="a dataset whose CSV and XLSX resources are probed on HDX",
+)
+@click.option(
+    "--source",
+    is_flag=False,
+    default=None,
+    help="a directory of saved metadata files and archives, or a single archive, to probe",
+)
+@click.option(
+    "--n_workers",
+    is_flag=False,
+    default=PROBE_WORKERS,
+    type=int,
+    help=f"concurrent probes (default: {PROBE_WORKERS})",
+)
+def probe_headers(dataset_name: str, source: str, n_workers: int):
+    """Compare the live header row of CSV and XLSX files with their recorded header_hash"""
+    # pylint: disable=import-outside-toplevel
+    from hdx_stable_schema.analytics import work_units, read_work_unit
+
+    if (dataset_name is None) == (source is None):
+        print("Provide one of --dataset_name or --source", flush=True)
+        sys.exit()
+
+    if dataset_name is not None:
+        datasets = [read_metadata_from_hdx(dataset_name)]
+    else:
+        datasets = (x for unit in work_units(source) for x in read_work_unit(unit))
+
+    resources = []
+    dataset_names = []
+    for metadata in datasets:
+        for resource in metadata["result"]["resources"]:
+            if resource["format"].lower() in PROBE_FORMATS and "fs_check_info" in resource.keys():
+                resources.append(resource)
+                dataset_names.append(metadata["result"]["name"])
+
+    print_banner([f"Header probe of {dataset_name or source}"])
+    start_time = time.time()
+    results = probe_resources(resources, n_workers=n_workers)
+    n_changed = sum(1 for x in results if x["status"] == "changed")
+    n_errors = sum(1 for x in results if x["status"] == "error")
+    print(
+        f"Probed {len(results)} resources in {time.time() - start_time:.1f}s, "
+        f"{n_changed} changed, {n_errors} could not be read",
+        flush=True,
+    )
+    print_table_from_list_of_dicts(
+        [
+            {
+                "Dataset": name,
+                "Resource": x["resource"],
+                "Sheet": x["sheet"],
+                "Status": x["status"],
+                "Detail": x["detail"],
+            }
+            for name, x in zip(dataset_names, results)
+        ]
+    )
+
+
+@hdx_schema.command(name="watch")
+@click.option(
+    "--dataset_names",
+    is_flag=False,
+    default=None,
+    help="a comma separated list of dataset names or ids to watch",
+)
+@click.option(
+    "--watch_file",
+    is_flag=False,
+    default=None,
+    help="a file of dataset names or ids to watch, one per line",
+)
+@click.option(
+    "--interval",
+    is_flag=False,
+    default=WATCH_INTERVAL,
+    type=int,
+    help=f"seconds between polls (default: {WATCH_INTERVAL})",
+)
+@click.option(
+    "--n_cycles",
+    is_flag=False,
+    default=0,
+    type=int,
+    help="stop after this many polls, 0 to run until interrupted",
+)
+@click.option(
+    "--state_path",
+    is_flag=False,
+    default=None,
+    help="a JSON file to resume the watch from and save it to after each poll",
+)
+def watch(dataset_names: str, watch_file: str, interval: int, n_cycles: int, state_path: str):
+    """Poll datasets for schema changes with one package_search per cycle"""
+    watched = []
+    if dataset_names is not None:
+        watched.extend(x.strip() for x in dataset_names.split(",") if x.strip() != "")
+    if watch_file is not None:
+        with open(watch_file, encoding="utf-8") as names_file:
+            watched.extend(x.strip() for x in names_file if x.strip() != "")
+    if len(watched) == 0:
+        print("Provide datasets to watch with --dataset_names or --watch_file", flush=True)
+        sys.exit()
+
+    if state_path is not None and Path(state_path).exists():
+        with open(state_path, encoding="utf-8") as state_file:
+            watch_state = json.load(state_file)
+    else:
+        watch_state = new_watch_state()
+
+    print_banner([f"Watching {len(watched)} datasets for schema changes"])
+    cycle = 0
+    try:
+        while True:
+            cycle += 1
+            events, n_requests = poll_watched_datasets(watched, watch_state)
+            print(
+                f"{time.strftime('%Y-%m-%dT%H:%M:%S')} poll {cycle}: {len(events)} changes "
+                f"from {n_requests} package_search request(s), "
+                f"{len(watch_state['datasets'])} of {len(watched)} datasets seen",
+                flush=True,
+            )
+            if len(events) != 0:
+                print_table_from_list_of_dicts(events)
+            if state_path is not None:
+                with open(state_path, "w", encoding="utf-8") as state_file:
+                    json.dump(watch_state, state_file)
+            if cycle == n_cycles:
+                break
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+
+
+@hdx_schema.command(name="daemon")
+@click.option(
+    "--port",
+    is_flag=False,
+    default=DAEMON_PORT,
+    type=int,
+    help=f"the localhost port to listen on (default: {DAEMON_PORT})",
+)
+@click.option(
+    "--status",
+    is_flag=True,
+    default=False,
+    help="report on a running daemon rather than starting one",
+)
+def daemon(port: int, status: bool):
+    """Run a warm server which show_schema and preview_resource forward to"""
+    if status:
+        daemon_status = get_daemon_status(port=port)
+        if daemon_status is None:
+            print(f"No daemon found on {DAEMON_HOST}:{port}", flush=True)
+        else:
+            print_dictionary({k: str(v) for k, v in daemon_status.items()})
+        return
+
+    server = make_daemon_server(port=port)
+    print(f"hdx-schema daemon serving on http://{DAEMON_HOST}:{port}, Ctrl+C to stop", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
 @hdx_schema.command(name="preview_resource")
 @click.option(
     "--dataset_name",
@@ -111,8 +673,36 @@ def show_schema(dataset_name: str):
     default=None,
     help="a resource name",
 )
-def preview_resource(dataset_name: str, resource_name: str):
+@click.option(
+    "--profile",
+    is_flag=True,
+    default=False,
+    help="add column statistics from a streaming pass over the resource",
+)
+@click.option(
+    "--max_memory",
+    is_flag=False,
+    default=None,
+    help="a memory budget for the preview such as 512M, fewer rows are read to stay within it",
+)
+def preview_resource(dataset_name: str, resource_name: str, profile: bool, max_memory: str):
     """Show a dataset with schema markup"""
+    if forward_command_to_daemon():
+        return
+
+    if max_memory is not None:
+        try:
+            max_memory = parse_memory_size(max_memory)
+        except ValueError as exception_:
+            print(exception_, flush=True)
+            sys.exit()
+
+    # The data readers pull in pandas and geopandas (and through them fiona and GDAL) which
+    # dominate startup time, so only the commands which read data import them
+    # pylint: disable=import-outside-toplevel
+    from hdx_stable_schema.data_preview import print_data_preview
+    from hdx_stable_schema.hxl_preview import add_hxl_labels_to_schema
+    from hdx_stable_schema.column_profiler import add_statistics_to_schema
 
     # Get some metadata some how
     if dataset_name is not None:
@@ -135,24 +725,7 @@ def preview_resource(dataset_name: str, resource_name: str):
                 resource_name = resource["name"]
                 break
 
-    # Print Resource Overview
     dataset_name = metadata["result"]["name"]
-    print_banner(
-        [f"Dataset name: {dataset_name}", f"Resource name: {resource_name}", "Resource Overview"]
-    )
-
-    # Rerun command
-    print(
-        "Rerun command: \nhdx-schema preview_resource "
-        f"--dataset_name='{dataset_name}' "
-        f"--resource_name='{resource_name}'"
-    )
-    # Derive summaries
-    print("\nCollecting metadata...", flush=True)
-    resource_summary = summarise_resource(metadata)
-    resource_changes = summarise_resource_changes(metadata)
-    schemas = summarise_schema(metadata)
-
     resource_metadata = None
     for resource in metadata["result"]["resources"]:
         if resource["name"] == resource_name:
@@ -163,22 +736,61 @@ def preview_resource(dataset_name: str, resource_name: str):
         f"Resource '{resource_name}' not " f"found in dataset '{dataset_name}'"
     )
 
-    print("\nDownloading data preview...", flush=True)
-    preview_data, error_message = get_data_from_hdx(resource_metadata, None)
-    if error_message != "Success":
-        print(error_message, flush=True)
-        sys.exit()
-
-    # Decorate Data Dictionary with data types
-    add_data_types = False
-    if resource_metadata["format"].lower() in ["csv", "xlsx", "xls"]:
-        field_types = field_types_from_rows(preview_data)
-        add_data_types = True
+    # The download and parse run in the background while the metadata is summarised and the
+    # overview printed, so the wait is the longer of the two stages rather than their sum
+    with quiet_downloads(), ThreadPoolExecutor(max_workers=1) as pool:
+        start_time = time.perf_counter()
+        preview_future = pool.submit(read_resource_preview, resource_metadata, max_memory, profile)
+
+        # Print Resource Overview
+        print_banner(
+            [
+                f"Dataset name: {dataset_name}",
+                f"Resource name: {resource_name}",
+                "Resource Overview",
+            ]
+        )
 
+        # Rerun command
+        print(
+            "Rerun command: \nhdx-schema preview_resource "
+            f"--dataset_name='{dataset_name}' "
+            f"--resource_name='{resource_name}'"
+        )
+        # Derive summaries
+        print("\nCollecting metadata...", flush=True)
+        resource_summary = summarise_resource(metadata)
+        resource_changes = summarise_resource_changes(metadata)
+        schemas = summarise_schema(metadata)
+        metadata_finished_at = time.perf_counter()
+
+        print("\nDownloading data preview...", flush=True)
+        preview = preview_future.result()
+
+    for note in preview["notes"]:
+        print(note, flush=True)
+    if preview["error_message"] != "Success":
+        print(preview["error_message"], flush=True)
+        sys.exit()
+    # Profiling follows the preview in the worker, it is timed on its own rather than counted as
+    # part of the overlap
+    metadata_seconds = metadata_finished_at - start_time
+    elapsed_seconds = max(metadata_finished_at, preview["finished_at"]) - start_time
+
+    field_types = preview["field_types"]
+    add_data_types = resource_metadata["format"].lower() in ["csv", "xlsx", "xls"] and (
+        len(field_types) != 0
+    )
     for _, schema in schemas.items():
         if resource_name in schema["shared_with"]:
-            if add_data_types:
+            # The recorded check can disagree with the file as it is now
+            if add_data_types and len(field_types) == len(schema["headers"]):
                 schema["data_types"] = [v for k, v in field_types.items()]
+                schema["date_formats"] = [preview["date_formats"].get(k) for k in field_types]
+            if preview["hxl_preview"] is not None:
+                add_hxl_labels_to_schema(schema, preview["hxl_preview"])
+            if preview["profiles"] is not None:
+                add_statistics_to_schema(schema, preview["profiles"])
             break
 
     print("\nResource summary:", flush=True)
@@ -195,7 +807,155 @@ def preview_resource(dataset_name: str, resource_name: str):
     print_schema(schema)
     # Print data preview
     print("\nData Preview (first 10 lines)", flush=True)
-    print_data_preview(preview_data[0:10])
+    print_data_preview(preview["preview_data"][0:10])
+
+    print(pipeline_timing_note(metadata_seconds, preview["seconds"], elapsed_seconds), flush=True)
+    if preview["profiles"] is not None:
+        print(f"Column profiling took {preview['profile_seconds']:.2f}s", flush=True)
+
+
+def read_resource_preview(resource_metadata: dict, max_memory: int, profile: bool) -> dict:
+    # The download and parse stage of preview_resource, run off the main thread. Messages are
+    # collected in notes rather than printed so they do not interleave with the overview
+    # pylint: disable=import-outside-toplevel
+    from hdx_stable_schema.data_preview import (
+        get_preview_from_hdx,
+        date_formats_from_dataframe,
+        date_formats_from_rows,
+        field_types_from_rows,
+        rows_from_dataframe,
+        is_hxlated_resource,
+        BUDGET_CHUNKS,
+    )
+    from hdx_stable_schema.hxl_preview import get_hxl_preview_from_hdx, HXL_PREVIEW_ROWS
+    from hdx_stable_schema.column_profiler import profile_resource
+
+    start_time = time.perf_counter()
+    preview = {
+        "notes": [],
+        "error_message": "Success",
+        "hxl_preview": None,
+        "preview_data": [],
+        "field_types": {},
+        "date_formats": {},
+        "profiles": None,
+        "seconds": 0.0,
+        "finished_at": None,
+        "profile_seconds": 0.0,
+    }
+    # HXLated spreadsheets are streamed through libhxl which reads just the rows we need and
+    # gives us the hashtags from the data itself
+    file_format = resource_metadata["format"].lower()
+    use_hxl_preview = file_format in ["csv", "xlsx", "xls"] and is_hxlated_resource(
+        resource_metadata
+    )
+    n_hxl_rows = HXL_PREVIEW_ROWS
+    dataframe = None
+    budget = None
+    if max_memory is not None:
+        dataframe, dataframe_field_types, error_message = get_preview_from_hdx(
+            resource_metadata, None, max_memory=max_memory
+        )
+        if error_message != "Success":
+            preview["error_message"] = error_message
+            preview["seconds"] = time.perf_counter() - start_time
+            return preview
+        budget = dataframe.attrs["memory_budget"]
+        preview["notes"].append(memory_budget_note(budget))
+        # libhxl loads workbooks whole, but reads CSV only as far as the rows it is asked for
+        use_hxl_preview = use_hxl_preview and file_format == "csv"
+        n_hxl_rows = min(n_hxl_rows, budget["row_limit"])
+
+    hxl_preview = None
+    if use_hxl_preview:
+        hxl_preview, error_message = get_hxl_preview_from_hdx(resource_metadata, n_rows=n_hxl_rows)
+        if error_message != "Success":
+            preview["notes"].append(f"{error_message}, falling back to pandas")
+            hxl_preview = None
+
+    if hxl_preview is not None:
+        preview["hxl_preview"] = hxl_preview
+        preview["preview_data"] = hxl_preview["rows"][0:10]
+        if preview["preview_data"]:
+            preview["field_types"] = field_types_from_rows(hxl_preview["rows"])
+            preview["date_formats"] = date_formats_from_rows(
+                hxl_preview["rows"], preview["field_types"]
+            )
+    else:
+        if dataframe is None:
+            dataframe, dataframe_field_types, error_message = get_preview_from_hdx(
+                resource_metadata, None
+            )
+            if error_message != "Success":
+                preview["error_message"] = error_message
+                preview["seconds"] = time.perf_counter() - start_time
+                return preview
+        preview["preview_data"] = rows_from_dataframe(dataframe, n_rows=10)
+        preview["field_types"] = dataframe_field_types
+        preview["date_formats"] = date_formats_from_dataframe(dataframe, dataframe_field_types)
+
+    preview["finished_at"] = time.perf_counter()
+    preview["seconds"] = preview["finished_at"] - start_time
+    if profile:
+        # Under a budget the file is profiled in the same size chunks the preview was read in
+        chunksize = 10000 if budget is None else max(budget["row_limit"] // BUDGET_CHUNKS, 1)
+        profiles, error_message = profile_resource(
+            resource_metadata, chunksize=chunksize, max_memory=max_memory
+        )
+        if error_message == "Success":
+            preview["profiles"] = profiles
+        else:
+            preview["notes"].append(error_message)
+        preview["profile_seconds"] = time.perf_counter() - preview["finished_at"]
+
+    return preview
+
+
+def pipeline_timing_note(
+    metadata_seconds: float, preview_seconds: float, elapsed_seconds: float
+) -> str:
+    saved_seconds = max(metadata_seconds + preview_seconds - elapsed_seconds, 0.0)
+    return (
+        f"\nTimings: metadata {metadata_seconds:.2f}s and data preview {preview_seconds:.2f}s "
+        f"overlapped in {elapsed_seconds:.2f}s, saving {saved_seconds:.2f}s over running them "
+        "in turn"
+    )
+
+
+def memory_budget_note(budget: dict) -> str:
+    note = (
+        f"Read {budget['rows']} rows at about {budget['row_bytes']} bytes per row within a "
+        f"{budget['max_memory']} byte budget"
+    )
+    if budget["truncated"]:
+        note += f", the preview stops at {budget['row_limit']} rows"
+    if budget["geometry_skipped"]:
+        note += ", geometry was skipped to fit more rows"
+    return note
+
+
+def forward_command_to_daemon() -> bool:
+    # Rebuild the command line from the parsed parameters and hand it to a running daemon,
+    # returning False so the caller runs in-process if there is no daemon
+    context = click.get_current_context()
+    args = [context.info_name]
+    for parameter in context.command.params:
+        value = context.params[parameter.name]
+        if getattr(parameter, "is_flag", False):
+            if value:
+                args.append(parameter.opts[0])
+        elif value is not None:
+            args.extend([parameter.opts[0], str(value)])
+
+    forwarded = forward_to_daemon(args)
+    if forwarded is None:
+        return False
+
+    output, exit_code = forwarded
+    print(output, end="", flush=True)
+    if exit_code != 0:
+        sys.exit(exit_code)
+    return True
 
 
 def print_resource_summary(resource_summary, resource_changes, target_resource_name=None):
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import math
+
+from typing import Any, Optional
+
+import numpy
+import pandas
+import geopandas
+import requests
+
+from hdx_stable_schema.data_preview import iter_dataframe_chunks_from_hdx
+
+HLL_PRECISION = 14
+TOP_K = 5
+
+
+class HyperLogLog:
+    """An approximate distinct counter with a fixed memory footprint of 2**precision bytes
+
+    Values are hashed in bulk with pandas.util.hash_pandas_object, the top precision bits of the
+    64-bit hash select a register and the rank is taken from the bottom 32 bits.
+    """
+
+    def __init__(self, precision: int = HLL_PRECISION):
+        self.precision = precision
+        self.n_registers = 1 << precision
+        self.registers = numpy.zeros(self.n_registers, dtype=numpy.uint8)
+
+    def update(self, series: pandas.Series) -> None:
+        if len(series) == 0:
+            return
+        hashes = pandas.util.hash_pandas_object(series, index=False).to_numpy(dtype=numpy.uint64)
+        indices = (hashes >> numpy.uint64(64 - self.precision)).astype(numpy.int64)
+        low_bits = (hashes & numpy.uint64(0xFFFFFFFF)).astype(numpy.float64)
+        # frexp gives the bit length exactly for 32-bit integers, zero maps to a bit length of 0
+        _, bit_lengths = numpy.frexp(low_bits)
+        ranks = (33 - bit_lengths).astype(numpy.uint8)
+        numpy.maximum.at(self.registers, indices, ranks)
+
+    def merge(self, other: "HyperLogLog") -> None:
+        assert self.precision == other.precision, "Cannot merge HyperLogLogs of differing precision"
+        numpy.maximum(self.registers, other.registers, out=self.registers)
+
+    def estimate(self) -> int:
+        n_registers = self.n_registers
+        alpha = 0.7213 / (1 + 1.079 / n_registers)
+        raw_estimate = (
+            alpha * n_registers**2 / numpy.sum(numpy.power(2.0, -self.registers.astype(float)))
+        )
+        n_zero_registers = int(numpy.count_nonzero(self.registers == 0))
+        if raw_estimate <= 2.5 * n_registers and n_zero_registers > 0:
+            return round(n_registers * math.log(n_registers / n_zero_registers))
+        return round(raw_estimate)
+
+
+class FrequentValues:
+    """A Misra-Gries frequent items summary holding at most capacity counters
+
+    Counts are lower bounds on the true frequency, any value occurring more than
+    n / (capacity + 1) times is guaranteed to be retained.
+    """
+
+    def __init__(self, capacity: int = 10 * TOP_K):
+        self.capacity = capacity
+        self.counts = pandas.Series(dtype="int64")
+
+    def update(self, series: pandas.Series) -> None:
+        if len(series) == 0:
+            return
+        chunk_counts = series.astype(str).value_counts()
+        counts = chunk_counts.add(self.counts, fill_value=0)
+        if len(counts) > self.capacity:
+            threshold = counts.nlargest(self.capacity + 1).iloc[-1]
+            counts = counts[counts > threshold] - threshold
+        self.counts = counts.astype("int64")
+
+    def top(self, k: int = TOP_K) -> list[tuple[str, int]]:
+        return list(self.counts.nlargest(k).items())
+
+
+class ColumnProfile:
+    def __init__(self, column_name: str):
+        self.column_name = column_name
+        self.n_values = 0
+        self.n_nulls = 0
+        self.minimum: Optional[Any] = None
+        self.maximum: Optional[Any] = None
+        self.distinct = HyperLogLog()
+        self.frequent = FrequentValues()
+
+    def update(self, series: pandas.Series) -> None:
+        self.n_values += len(series)
+        non_null = series.dropna()
+        self.n_nulls += len(series) - len(non_null)
+        if len(non_null) == 0:
+            return
+        if isinstance(series.dtype, geopandas.array.GeometryDtype):
+            non_null = non_null.to_wkt()
+        self.distinct.update(non_null)
+        self.frequent.update(non_null)
+        self.update_range(non_null)
+
+    def update_range(self, non_null: pandas.Series) -> None:
+        # read_csv infers dtypes per chunk so a column can be numeric in one chunk and object in
+        # the next, in which case we fall back to comparing string representations
+        try:
+            chunk_minimum, chunk_maximum = non_null.min(), non_null.max()
+        except TypeError:
+            chunk_minimum, chunk_maximum = non_null.astype(str).min(), non_null.astype(str).max()
+        try:
+            self.minimum = (
+                chunk_minimum if self.minimum is None else min(self.minimum, chunk_minimum)
+            )
+            self.maximum = (
+                chunk_maximum if self.maximum is None else max(self.maximum, chunk_maximum)
+            )
+        except TypeError:
+            self.minimum = min(str(self.minimum), str(chunk_minimum))
+            self.maximum = max(str(self.maximum), str(chunk_maximum))
+
+    def as_statistics(self) -> dict[str, str]:
+        return {
+            "Nulls": str(self.n_nulls),
+            "Distinct": f"~{self.distinct.estimate()}" if self.n_values > self.n_nulls else "0",
+            "Min": "" if self.minimum is None else str(self.minimum),
+            "Max": "" if self.maximum is None else str(self.maximum),
+            "Top values": ", ".join(value for value, _ in self.frequent.top(3)),
+        }
+
+
+def profile_resource(
+    resource_metadata: dict,
+    sheet_name: Optional[str] = None,
+    chunksize: int = 10000,
+    max_memory: Optional[int] = None,
+) -> tuple[dict[str, ColumnProfile], str]:
+    # Only CSV files are read a chunk at a time, the other readers load the whole file, so with a
+    # memory budget (in bytes) other formats are not profiled
+    profiles = {}
+    error_message = "Success"
+    if max_memory is not None and resource_metadata["format"] != "CSV":
+        error_message = (
+            f"Profiling skipped for resource_name '{resource_metadata['name']}', only CSV files "
+            f"can be profiled within a memory budget"
+        )
+        return profiles, error_message
+    try:
+        for chunk in iter_dataframe_chunks_from_hdx(resource_metadata, sheet_name, chunksize):
+            update_profiles(profiles, chunk)
+    except (
+        FileNotFoundError,
+        requests.exceptions.HTTPError,
+        pandas.errors.ParserError,
+        UnicodeDecodeError,
+        ValueError,
+    ) as error:
+        error_message = (
+            f"Profiling failed for resource_name '{resource_metadata['name']}' "
+            f"with download_url {resource_metadata['download_url']}: {error}"
+        )
+
+    return profiles, error_message
+
+
+def update_profiles(profiles: dict[str, ColumnProfile], chunk: pandas.DataFrame) -> None:
+    for column_name in chunk.columns:
+        if column_name not in profiles:
+            profiles[column_name] = ColumnProfile(column_name)
+        profiles[column_name].update(chunk[column_name])
+
+
+def add_statistics_to_schema(schema: dict, profiles: dict[str, ColumnProfile]) -> dict:
+    # Profiles are keyed on the column names pandas found, which may not match the headers
+    # recorded in the metadata (e.g. HXLated resources have null headers), so we align on position
+    if len(profiles) == len(schema["headers"]):
+        schema["statistics"] = [profile.as_statistics() for profile in profiles.values()]
+    return schema
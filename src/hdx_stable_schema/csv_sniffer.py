@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import codecs
+import csv
+
+from collections import Counter
+
+SNIFF_PREFIX_BYTES = 64 * 1024
+SNIFF_MAX_LINES = 50
+CANDIDATE_DELIMITERS = ",;\t|"
+CANDIDATE_ENCODINGS = ["utf-8", "cp1252"]
+
+# UTF-32 goes first because its little-endian BOM starts with the UTF-16 one
+BYTE_ORDER_MARKS = [
+    (codecs.BOM_UTF32_LE, "utf-32"),
+    (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+]
+
+
+def sniff_csv(prefix: bytes, is_complete: bool = False) -> dict:
+    """Detect the parameters needed to parse a CSV file from the first bytes of it
+
+    Arguments:
+        prefix {bytes} -- the start of the file
+
+    Keyword Arguments:
+        is_complete {bool} -- True if prefix is the whole file, otherwise the final line and any
+                              trailing partial character are ignored (default: {False})
+
+    Returns:
+        dict -- with keys encoding, bom, delimiter, quotechar and header_row
+    """
+    encoding, bom = detect_encoding(prefix, is_complete=is_complete)
+    lines = prefix.decode(encoding, errors="ignore").splitlines()
+    if not is_complete:
+        lines = lines[:-1]
+    lines = lines[0:SNIFF_MAX_LINES]
+
+    delimiter, quotechar = detect_dialect(lines)
+    header_row = detect_header_row(lines, delimiter, quotechar)
+
+    return {
+        "encoding": encoding,
+        "bom": bom,
+        "delimiter": delimiter,
+        "quotechar": quotechar,
+        "header_row": header_row,
+    }
+
+
+def detect_encoding(prefix: bytes, is_complete: bool = False) -> tuple[str, bool]:
+    for bom, encoding in BYTE_ORDER_MARKS:
+        if prefix.startswith(bom):
+            return encoding, True
+
+    for encoding in CANDIDATE_ENCODINGS:
+        # An incremental decoder tolerates a multi-byte character cut off by the prefix
+        decoder = codecs.getincrementaldecoder(encoding)()
+        try:
+            decoder.decode(prefix, final=is_complete)
+            return encoding, False
+        except UnicodeDecodeError:
+            continue
+
+    # Every byte is valid latin-1, so this is the last resort
+    return "latin-1", False
+
+
+def detect_dialect(lines: list[str]) -> tuple[str, str]:
+    try:
+        dialect = csv.Sniffer().sniff("\n".join(lines), delimiters=CANDIDATE_DELIMITERS)
+        return dialect.delimiter, dialect.quotechar
+    except csv.Error:
+        return ",", '"'
+
+
+def detect_header_row(lines: list[str], delimiter: str, quotechar: str) -> int:
+    # Title and notes rows above the header are usually narrower than the table, and the HXL
+    # hashtag row sits below it, so neither can be the header. Titles padded out to the full
+    # width with delimiters are only passed over when the next row looks like a header, so a
+    # sparse header such as id,,, above rows of data is still found
+    rows = list(csv.reader(lines, delimiter=delimiter, quotechar=quotechar))
+    widths = [len(x) for x in rows if any(y.strip() for y in x)]
+    if len(widths) == 0:
+        return 0
+    modal_width = Counter(widths).most_common(1)[0][0]
+    candidates = [
+        i
+        for i, row in enumerate(rows)
+        if len(row) >= modal_width and populated_cells(row) and not is_hashtag_row(row)
+    ]
+    for position, i in enumerate(candidates):
+        if len(populated_cells(rows[i])) >= modal_width / 2:
+            return i
+        if position + 1 == len(candidates) or not is_text_row(rows[candidates[position + 1]]):
+            return i
+
+    return candidates[0] if len(candidates) != 0 else 0
+
+
+def populated_cells(row: list[str]) -> list[str]:
+    return [x.strip() for x in row if x.strip() != ""]
+
+
+def is_hashtag_row(row: list[str]) -> bool:
+    return all(x.startswith("#") for x in populated_cells(row))
+
+
+def is_text_row(row: list[str]) -> bool:
+    # Headers are text, a row of data usually has at least one number in it
+    for cell in populated_cells(row):
+        try:
+            float(cell.replace(",", ""))
+            return False
+        except ValueError:
+            continue
+    return True
@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import contextlib
+import hmac
+import importlib
+import io
+import json
+import os
+import secrets
+import sys
+import time
+import traceback
+import urllib.error
+import urllib.request
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from pathlib import Path
+from typing import Optional
+
+DAEMON_HOST = "127.0.0.1"
+DAEMON_PORT = int(os.environ.get("HDX_SCHEMA_DAEMON_PORT", "8765"))
+# The client waits this long to discover a daemon before running the command itself
+DAEMON_CONNECT_TIMEOUT = 0.2
+# Requests to the daemon never go via a proxy configured in the environment
+LOCAL_OPENER = urllib.request.build_opener(urllib.request.ProxyHandler({}))
+
+# Only these commands are run by the daemon, the others can write files and stay in-process
+DAEMON_COMMANDS = ["show_schema", "preview_resource"]
+# Each daemon writes a random token to a file only the user can read, and requests to /run must
+# carry it, so other local users and web pages posting to localhost cannot run commands
+DAEMON_TOKEN_DIRECTORY = Path(
+    os.environ.get("HDX_SCHEMA_DAEMON_DIRECTORY", Path.home() / ".hdx_schema")
+)
+DAEMON_TOKEN_HEADER = "X-HDX-Schema-Token"
+
+# Set in the daemon process so commands it runs do not try to forward to themselves
+RUNNING_IN_DAEMON = False
+
+DAEMON_STATUS = {"started_at": 0.0, "requests_served": 0}
+
+
+class DaemonRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):  # pylint: disable=invalid-name
+        if self.path != "/status":
+            self.send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+        self.send_json(200, daemon_status())
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        if self.path != "/run":
+            self.send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+        if self.headers.get_content_type() != "application/json":
+            self.send_json(415, {"error": "Expected a JSON request body"})
+            return
+        token = self.headers.get(DAEMON_TOKEN_HEADER, "")
+        if not hmac.compare_digest(token.encode("utf-8"), self.server.token.encode("utf-8")):
+            self.send_json(403, {"error": "Missing or wrong daemon token"})
+            return
+        try:
+            content_length = int(self.headers.get("Content-Length", 0))
+            args = json.loads(self.rfile.read(content_length))["args"]
+            if not isinstance(args, list) or not all(isinstance(x, str) for x in args):
+                raise TypeError("args must be a list of strings")
+        except (ValueError, KeyError, TypeError) as exception_:
+            self.send_json(400, {"error": f"Malformed request: {exception_}"})
+            return
+        if len(args) == 0 or args[0] not in DAEMON_COMMANDS:
+            self.send_json(403, {"error": f"The daemon only runs {', '.join(DAEMON_COMMANDS)}"})
+            return
+
+        output, exit_code = run_command(args)
+        DAEMON_STATUS["requests_served"] += 1
+        self.send_json(200, {"output": output, "exit_code": exit_code})
+
+    def send_json(self, status_code: int, payload: dict):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+
+class DaemonServer(HTTPServer):
+    """An HTTPServer holding the token for this session, the token file is removed on close"""
+
+    def __init__(self, server_address: tuple[str, int]):
+        super().__init__(server_address, DaemonRequestHandler)
+        self.token = write_daemon_token(self.server_address[1])
+
+    def server_close(self):
+        super().server_close()
+        daemon_token_path(self.server_address[1]).unlink(missing_ok=True)
+
+
+def daemon_token_path(port: int) -> Path:
+    return DAEMON_TOKEN_DIRECTORY / f"daemon-{port}.token"
+
+
+def write_daemon_token(port: int) -> str:
+    token = secrets.token_urlsafe(32)
+    token_path = daemon_token_path(port)
+    token_path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+    file_descriptor = os.open(token_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(file_descriptor, "w", encoding="utf-8") as token_file:
+        token_file.write(token)
+    # O_CREAT only sets the mode of a new file
+    os.chmod(token_path, 0o600)
+    return token
+
+
+def read_daemon_token(port: int) -> Optional[str]:
+    try:
+        return daemon_token_path(port).read_text(encoding="utf-8").strip()
+    except OSError:
+        return None
+
+
+def run_command(args: list[str]) -> tuple[str, int]:
+    # Imported here so the daemon pays for pandas and geopandas once, at startup, rather than
+    # the client paying on every invocation
+    from hdx_stable_schema.cli import (  # pylint: disable=import-outside-toplevel
+        hdx_schema,
+    )
+
+    exit_code = 0
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        try:
+            hdx_schema.main(args, prog_name="hdx-schema", standalone_mode=False)
+        except SystemExit as exit_:
+            exit_code = exit_.code if isinstance(exit_.code, int) else 0
+        except Exception:  # pylint: disable=broad-exception-caught
+            traceback.print_exc(file=output)
+            exit_code = 1
+
+    return output.getvalue(), exit_code
+
+
+def daemon_status() -> dict:
+    # pylint: disable=import-outside-toplevel
+    from hdx_stable_schema.metadata_processor import METADATA_CACHE
+    from hdx_stable_schema.utilities import (
+        download_cache_size,
+        IN_FLIGHT_DOWNLOADS,
+        REQUEST_SCHEDULER,
+    )
+
+    status = {
+        "pid": os.getpid(),
+        "uptime": round(time.monotonic() - DAEMON_STATUS["started_at"], 1),
+        "requests_served": DAEMON_STATUS["requests_served"],
+        "metadata_cache_entries": len(METADATA_CACHE),
+        "download_cache_bytes": download_cache_size(),
+    }
+    for lane_name, metrics in REQUEST_SCHEDULER.metrics().items():
+        for key, value in metrics.items():
+            status[f"{lane_name}_{key}"] = value
+    for key, value in IN_FLIGHT_DOWNLOADS.metrics().items():
+        status[f"downloads_{key}"] = value
+    # Previews are only cached once a preview command has loaded the data readers
+    data_preview = sys.modules.get("hdx_stable_schema.data_preview")
+    if data_preview is not None:
+        status["preview_cache_entries"] = len(data_preview.PREVIEW_CACHE)
+        for key, value in data_preview.IN_FLIGHT_PREVIEWS.metrics().items():
+            status[f"previews_{key}"] = value
+    return status
+
+
+def make_daemon_server(host: str = DAEMON_HOST, port: int = DAEMON_PORT) -> DaemonServer:
+    global RUNNING_IN_DAEMON  # pylint: disable=global-statement
+    RUNNING_IN_DAEMON = True
+    # Warm the heavy imports before accepting requests. The CLI only imports the data readers
+    # (and with them pandas, geopandas and libhxl) when a command needs them, so they are
+    # imported here by name
+    for module_name in [
+        "hdx_stable_schema.cli",
+        "hdx_stable_schema.data_preview",
+        "hdx_stable_schema.hxl_preview",
+        "hdx_stable_schema.column_profiler",
+    ]:
+        importlib.import_module(module_name)
+    # Later commands often ask for the same files, so the daemon keeps whole downloads
+    importlib.import_module("hdx_stable_schema.utilities").CACHE_DOWNLOADS = True
+
+    DAEMON_STATUS["started_at"] = time.monotonic()
+    DAEMON_STATUS["requests_served"] = 0
+    # A single-threaded server, commands redirect the process-wide stdout so must not overlap
+    return DaemonServer((host, port))
+
+
+def forward_to_daemon(
+    args: list[str], host: str = DAEMON_HOST, port: int = DAEMON_PORT
+) -> Optional[tuple[str, int]]:
+    if RUNNING_IN_DAEMON or os.environ.get("HDX_SCHEMA_NO_DAEMON", "") != "":
+        return None
+    if len(args) == 0 or args[0] not in DAEMON_COMMANDS:
+        return None
+    token = read_daemon_token(port)
+    if token is None:
+        return None
+
+    # Probe first with a short timeout so a missing daemon costs little, the command itself may
+    # take as long as it needs
+    try:
+        with LOCAL_OPENER.open(
+            f"http://{host}:{port}/status", timeout=DAEMON_CONNECT_TIMEOUT
+        ) as response:
+            response.read()
+    except (urllib.error.URLError, OSError):
+        return None
+
+    request = urllib.request.Request(
+        f"http://{host}:{port}/run",
+        data=json.dumps({"args": args}).encode("utf-8"),
+        headers={"Content-Type": "application/json", DAEMON_TOKEN_HEADER: token},
+        method="POST",
+    )
+    try:
+        with LOCAL_OPENER.open(request) as response:
+            payload = json.loads(response.read())
+    except (urllib.error.URLError, OSError):
+        return None
+
+    return payload["output"], payload["exit_code"]
+
+
+def get_daemon_status(host: str = DAEMON_HOST, port: int = DAEMON_PORT) -> Optional[dict]:
+    try:
+        with LOCAL_OPENER.open(
+            f"http://{host}:{port}/status", timeout=DAEMON_CONNECT_TIMEOUT
+        ) as response:
+            return json.loads(response.read())
+    except (urllib.error.URLError, OSError):
+        return None
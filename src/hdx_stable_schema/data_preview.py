@@ -3,62 +3,172 @@
 
 import ast
 import datetime
+import functools
 import glob
+import io
 import shutil
-import sys
+import threading
 import zipfile
 
 import pandas
 import geopandas
+import requests
 
 from pathlib import Path
 
 
-from collections import Counter
-from typing import Optional
-from hdx_stable_schema.utilities import print_table_from_list_of_dicts, download_from_url
-from hdx_stable_schema.metadata_processor import get_last_complete_check
+from collections import Counter, OrderedDict
+from typing import BinaryIO, Iterator, Optional
+from hdx_stable_schema.utilities import (
+    print_table_from_list_of_dicts,
+    download_from_url,
+    fetch_bytes,
+    fetch_prefix,
+    fetch_size,
+    open_url_stream,
+)
+from hdx_stable_schema.csv_sniffer import sniff_csv, SNIFF_PREFIX_BYTES
+from hdx_stable_schema.date_detection import (
+    date_field_type,
+    detect_date_format,
+    is_excel_serial_column,
+    is_memoised,
+    DATE_MEMO_SIZE,
+    EXCEL_SERIAL_FORMAT,
+)
+from hdx_stable_schema.header_probe import hashtag_row_index, xlsx_first_rows
+from hdx_stable_schema.metadata_processor import content_fingerprint, get_last_complete_check
+from hdx_stable_schema.request_scheduler import InFlightRequests
 
+# With a memory budget a first chunk is read to measure bytes per row, then as many rows as the
+# budget allows. The raw file and the parsed rows each get a share of the budget, leaving the
+# rest for the readers' own buffers and the copies made when the preview is printed
+BUDGET_FIRST_CHUNK_ROWS = 100
+BUDGET_RAW_SHARE = 0.25
+BUDGET_FRAME_SHARE = 0.2
+# Rows are read in this many chunks so an estimate that was too low is caught part way through
+BUDGET_CHUNKS = 8
+# Geometry is dropped if it would leave fewer rows than this
+BUDGET_MIN_ROWS = 10
+# Parsed previews and their field types, keyed by content fingerprint so resources holding the
+# same file are read and typed once. Concurrent requests for the same preview share one parse,
+# and previews are read from worker threads so the cache is only touched under its lock
+PREVIEW_CACHE: OrderedDict[tuple, tuple] = OrderedDict()
+PREVIEW_CACHE_LOCK = threading.Lock()
+PREVIEW_CACHE_MAX_BYTES = 256 * 1024 * 1024
+IN_FLIGHT_PREVIEWS = InFlightRequests()
+# Spreadsheet XML, and openpyxl's cells parsed from it, take several times the space of the
+# values they hold
+BUDGET_XML_FACTOR = 8
 
-def get_data_from_hdx(resource_metadata: dict, sheet_name: Optional[str]) -> tuple[list[dict], str]:
+
+def get_data_from_hdx(
+    resource_metadata: dict, sheet_name: Optional[str], max_memory: Optional[int] = None
+) -> tuple[list[dict], str]:
+    results = []
+    dataframe, error_message = get_dataframe_from_hdx(
+        resource_metadata, sheet_name, drop_hxl_row=False, max_memory=max_memory
+    )
+    if dataframe is None:
+        return results, error_message
+
+    dataframe = dataframe.astype(str)
+    results = dataframe.to_dict("records")
+    if is_hxlated_resource(resource_metadata, sheet_name):
+        results = results[1:]
+
+    return results, error_message
+
+
+def get_preview_from_hdx(
+    resource_metadata: dict, sheet_name: Optional[str] = None, max_memory: Optional[int] = None
+) -> tuple[Optional[pandas.DataFrame], dict, str]:
+    # The dataframe, its field types and an error message. The dataframe may be shared with other
+    # resources so it should not be modified
+    key = (preview_key(resource_metadata), sheet_name, max_memory)
+    with PREVIEW_CACHE_LOCK:
+        if key in PREVIEW_CACHE:
+            PREVIEW_CACHE.move_to_end(key)
+            return PREVIEW_CACHE[key][0:3]
+    return IN_FLIGHT_PREVIEWS.run(
+        key, parse_preview, resource_metadata, sheet_name, max_memory, key
+    )
+
+
+def parse_preview(
+    resource_metadata: dict, sheet_name: Optional[str], max_memory: Optional[int], key: tuple
+) -> tuple[Optional[pandas.DataFrame], dict, str]:
+    dataframe, error_message = get_dataframe_from_hdx(
+        resource_metadata, sheet_name, max_memory=max_memory
+    )
+    if dataframe is None:
+        return dataframe, {}, error_message
+
+    field_types = field_types_from_dataframe(dataframe)
+    # Previews read within a memory budget are not kept, the budget is for this one preview
+    n_bytes = int(dataframe.memory_usage(deep=True).sum())
+    if max_memory is None and n_bytes <= PREVIEW_CACHE_MAX_BYTES:
+        with PREVIEW_CACHE_LOCK:
+            PREVIEW_CACHE[key] = (dataframe, field_types, error_message, n_bytes)
+            while sum(x[3] for x in PREVIEW_CACHE.values()) > PREVIEW_CACHE_MAX_BYTES:
+                PREVIEW_CACHE.popitem(last=False)
+    return dataframe, field_types, error_message
+
+
+def preview_key(resource_metadata: dict) -> str:
+    fingerprint = content_fingerprint(resource_metadata)
+    return fingerprint if fingerprint is not None else resource_metadata["download_url"]
+
+
+def get_dataframe_from_hdx(
+    resource_metadata: dict,
+    sheet_name: Optional[str],
+    drop_hxl_row: bool = True,
+    max_memory: Optional[int] = None,
+) -> tuple[Optional[pandas.DataFrame], str]:
+    # With max_memory (in bytes) only as many rows as fit the budget are read, and what was left
+    # out is described in dataframe.attrs["memory_budget"]
     download_url = resource_metadata["download_url"]
     file_format = resource_metadata["format"]
-    results = []
+    dataframe = None
     error_message = "Success"
-    metadata_key = "fs_check_info"
+
+    # The HXL tag row sits directly under the header row, if we leave it in place every column
+    # is read as object dtype and the reader's type inference is lost
+    skiprows = None
+    if drop_hxl_row and is_hxlated_resource(resource_metadata, sheet_name):
+        skiprows = [1]
     try:
-        if file_format.upper() in ["XLS", "XLSX"]:
+        if max_memory is not None and file_format.upper() in ["XLS", "XLSX"]:
+            dataframe = read_excel_within_budget(download_url, sheet_name, skiprows, max_memory)
+        elif file_format.upper() in ["XLS", "XLSX"]:
             if sheet_name is None:
-                dataframe = pandas.read_excel(download_url)
+                dataframe = pandas.read_excel(open_resource(download_url), skiprows=skiprows)
             else:
-                dataframe = pandas.read_excel(download_url, sheet_name=sheet_name)
+                dataframe = pandas.read_excel(
+                    open_resource(download_url), sheet_name=sheet_name, skiprows=skiprows
+                )
         elif file_format == "CSV":
-            dataframe = pandas.read_csv(download_url)
+            csv_parameters = csv_read_parameters(download_url, drop_hxl_row=skiprows is not None)
+            if max_memory is not None:
+                dataframe = read_csv_within_budget(download_url, csv_parameters, max_memory)
+            else:
+                with open_resource(download_url, stream=True) as source:
+                    dataframe = pandas.read_csv(source, **csv_parameters)
         elif file_format in ["GeoJSON", "SHP"]:
-            metadata_key = "shape_info"
             local_file_path, error_message = download_from_url(download_url)
-            if error_message == "Success":
+            if error_message == "Success" and max_memory is not None:
+                geo_file_path, error_message = extract_geo_file(str(local_file_path), file_format)
+                if error_message == "Success":
+                    dataframe = read_geo_within_budget(geo_file_path, file_format, max_memory)
+            elif error_message == "Success":
                 dataframe, error_message = load_dataframe_from_local_path(
                     str(local_file_path), file_format
                 )
             shutil.rmtree(Path(local_file_path).parent)
         else:
             error_message = f"Data in file format {file_format} not supported"
-        dataframe = dataframe.astype(str)
-        results = dataframe.to_dict("records")
-        is_hxlated = False
-        check, error_message = get_last_complete_check(resource_metadata, metadata_key)
-        if "hxl_proxy_response" in check:
-            if len(check["hxl_proxy_response"]["sheets"]) == 1:
-                is_hxlated = check["hxl_proxy_response"]["sheets"][0]["is_hxlated"]
-            else:
-                print("More than 1 sheet, not implemented scanning for the right sheet", flush=True)
-                sys.exit()
-
-        if is_hxlated:
-            results = results[1:]
-
-    except FileNotFoundError:
+    except (FileNotFoundError, requests.exceptions.HTTPError):
         error_message = (
             f"Resource not found for URL {download_url}"
             if error_message == "Success"
@@ -84,7 +194,239 @@ def get_data_from_hdx(resource_metadata: dict, sheet_name: Optional[str]) -> tup
             else error_message
         )
 
-    return results, error_message
+    if error_message != "Success":
+        dataframe = None
+
+    return dataframe, error_message
+
+
+def iter_dataframe_chunks_from_hdx(
+    resource_metadata: dict, sheet_name: Optional[str], chunksize: int = 10000
+) -> Iterator[pandas.DataFrame]:
+    # Only the CSV reader can genuinely stream, the other readers need the whole file in memory
+    # so we read it once and hand it out in slices to keep downstream consumers uniform
+    if resource_metadata["format"] == "CSV":
+        download_url = resource_metadata["download_url"]
+        csv_parameters = csv_read_parameters(
+            download_url, drop_hxl_row=is_hxlated_resource(resource_metadata, sheet_name)
+        )
+        with open_resource(download_url, stream=True) as source, pandas.read_csv(
+            source, chunksize=chunksize, **csv_parameters
+        ) as reader:
+            yield from reader
+        return
+
+    dataframe, error_message = get_dataframe_from_hdx(resource_metadata, sheet_name)
+    if dataframe is None:
+        raise ValueError(error_message)
+    for start in range(0, len(dataframe), chunksize):
+        stop = start + chunksize
+        yield dataframe.iloc[start:stop]
+
+
+def read_csv_within_budget(
+    download_url: str, csv_parameters: dict, max_memory: int
+) -> pandas.DataFrame:
+    # Only a prefix of the file is fetched, cut back to the last complete line. It is not cached,
+    # or each preview would leave its share of the budget behind
+    prefix, is_complete = fetch_prefix(
+        download_url, int(max_memory * BUDGET_RAW_SHARE), cache=False
+    )
+    if not is_complete:
+        stop = prefix.rfind(b"\n") + 1
+        prefix = prefix[0:stop]
+
+    chunks = []
+    is_finished = False
+    with pandas.read_csv(io.BytesIO(prefix), iterator=True, **csv_parameters) as reader:
+        del prefix
+        chunks.append(reader.get_chunk(BUDGET_FIRST_CHUNK_ROWS))
+        row_bytes = frame_row_bytes(chunks[0])
+        row_limit = budget_row_limit(row_bytes, max_memory)
+        chunks[0] = chunks[0].head(row_limit)
+        n_rows = len(chunks[0])
+        frame_bytes = row_bytes * n_rows
+        chunk_rows = max(row_limit // BUDGET_CHUNKS, 1)
+        while n_rows < row_limit and frame_bytes < max_memory * BUDGET_FRAME_SHARE:
+            try:
+                chunk = reader.get_chunk(min(chunk_rows, row_limit - n_rows))
+            except StopIteration:
+                is_finished = is_complete
+                break
+            chunks.append(chunk)
+            n_rows += len(chunk)
+            frame_bytes += chunk.memory_usage(deep=True).sum()
+
+    dataframe = pandas.concat(chunks) if len(chunks) > 1 else chunks[0]
+    return with_budget_notes(dataframe, max_memory, row_bytes, row_limit, not is_finished)
+
+
+def read_excel_within_budget(
+    download_url: str, sheet_name: Optional[str], skiprows: Optional[list], max_memory: int
+) -> pandas.DataFrame:
+    if fetch_size(download_url) <= max_memory * BUDGET_RAW_SHARE:
+        source = open_resource(download_url)
+        sheet = 0 if sheet_name is None else sheet_name
+        first_chunk = pandas.read_excel(
+            source, sheet_name=sheet, skiprows=skiprows, nrows=BUDGET_FIRST_CHUNK_ROWS
+        )
+        row_bytes = BUDGET_XML_FACTOR * frame_row_bytes(first_chunk)
+        row_limit = budget_row_limit(row_bytes, max_memory)
+        if len(first_chunk) < BUDGET_FIRST_CHUNK_ROWS:
+            return with_budget_notes(first_chunk.head(row_limit), max_memory, row_bytes, row_limit)
+        if hasattr(source, "seek"):
+            source.seek(0)
+        dataframe = pandas.read_excel(source, sheet_name=sheet, skiprows=skiprows, nrows=row_limit)
+        return with_budget_notes(
+            dataframe, max_memory, row_bytes, row_limit, len(dataframe) == row_limit
+        )
+
+    # Too large to hold, so the start of the first sheet is read from the zip with Range requests
+    if not download_url.lower().endswith(".xlsx") or sheet_name is not None:
+        raise ValueError(f"{download_url} is too large to preview within {max_memory} bytes")
+    first_chunk = dataframe_from_rows(
+        xlsx_first_rows(download_url, BUDGET_FIRST_CHUNK_ROWS + 2), skiprows is not None
+    )
+    row_bytes = BUDGET_XML_FACTOR * frame_row_bytes(first_chunk)
+    row_limit = budget_row_limit(row_bytes, max_memory)
+    if len(first_chunk) < BUDGET_FIRST_CHUNK_ROWS:
+        return with_budget_notes(first_chunk.head(row_limit), max_memory, row_bytes, row_limit)
+    dataframe = dataframe_from_rows(
+        xlsx_first_rows(download_url, row_limit + 2), skiprows is not None
+    ).head(row_limit)
+    return with_budget_notes(dataframe, max_memory, row_bytes, row_limit, True)
+
+
+def read_geo_within_budget(
+    local_file_path: str, file_format: str, max_memory: int
+) -> geopandas.GeoDataFrame:
+    # local_file_path is the file itself, a zip is unpacked by extract_geo_file first
+    geo_file_path = local_file_path
+    # A single boundary can run to megabytes, so the first feature decides whether there is room
+    # for geometry. Coordinates are usually the bulk of a feature, so without them many more fit
+    first_feature = geopandas.read_file(geo_file_path, rows=1)
+    row_limit = budget_row_limit(frame_row_bytes(first_feature), max_memory)
+    skip_geometry = row_limit < BUDGET_MIN_ROWS
+    n_first_rows = (
+        BUDGET_FIRST_CHUNK_ROWS if skip_geometry else min(BUDGET_FIRST_CHUNK_ROWS, row_limit)
+    )
+    first_chunk = geopandas.read_file(
+        geo_file_path, rows=n_first_rows, ignore_geometry=skip_geometry
+    )
+    row_bytes = frame_row_bytes(first_chunk)
+    row_limit = budget_row_limit(row_bytes, max_memory)
+    if len(first_chunk) < n_first_rows or row_limit <= n_first_rows:
+        dataframe = first_chunk.head(row_limit)
+    else:
+        dataframe = geopandas.read_file(
+            geo_file_path, rows=row_limit, ignore_geometry=skip_geometry
+        )
+    dataframe = with_budget_notes(
+        dataframe, max_memory, row_bytes, row_limit, len(dataframe) == row_limit
+    )
+    dataframe.attrs["memory_budget"]["geometry_skipped"] = skip_geometry
+    return dataframe
+
+
+def frame_row_bytes(dataframe: pandas.DataFrame) -> float:
+    n_bytes = dataframe.memory_usage(deep=True).sum()
+    if isinstance(dataframe, geopandas.GeoDataFrame) and "geometry" in dataframe.columns:
+        # memory_usage only counts the pointers to the geometries, each coordinate is 16 bytes
+        n_bytes += 16 * dataframe.geometry.count_coordinates().sum()
+    return max(n_bytes / max(len(dataframe), 1), 1.0)
+
+
+def budget_row_limit(row_bytes: float, max_memory: int) -> int:
+    return max(int(max_memory * BUDGET_FRAME_SHARE / row_bytes), 1)
+
+
+def with_budget_notes(
+    dataframe: pandas.DataFrame,
+    max_memory: int,
+    row_bytes: float,
+    row_limit: int,
+    is_truncated: bool = False,
+) -> pandas.DataFrame:
+    dataframe.attrs["memory_budget"] = {
+        "max_memory": max_memory,
+        "row_bytes": int(row_bytes),
+        "row_limit": row_limit,
+        "rows": len(dataframe),
+        "truncated": bool(is_truncated),
+        "geometry_skipped": False,
+    }
+    return dataframe
+
+
+def dataframe_from_rows(rows: list[list], drop_hxl_row: bool = False) -> pandas.DataFrame:
+    # Rows as read by xlsx_first_rows, with the header above the hashtag row if there is one
+    if len(rows) == 0:
+        return pandas.DataFrame()
+    i = hashtag_row_index(rows)
+    header_index = i - 1 if i is not None and i > 0 else 0
+    start = header_index + 1
+    if drop_hxl_row and i == header_index + 1:
+        start += 1
+    headers = rows[header_index]
+    n_columns = len(headers)
+    data = [row[0:n_columns] + [None] * (n_columns - len(row)) for row in rows[start:]]
+    return pandas.DataFrame(data, columns=headers)
+
+
+def csv_read_parameters(download_url: str, drop_hxl_row: bool = False) -> dict:
+    # Sniffing a prefix means the one full parse gets the encoding, delimiter and header row right
+    # first time, and for remote files the prefix is reused when the rest of the file is fetched
+    prefix, is_complete = fetch_prefix(download_url, SNIFF_PREFIX_BYTES)
+    dialect = sniff_csv(prefix, is_complete=is_complete)
+
+    skiprows = list(range(0, dialect["header_row"]))
+    if drop_hxl_row:
+        skiprows.append(dialect["header_row"] + 1)
+
+    return {
+        "encoding": dialect["encoding"],
+        "sep": dialect["delimiter"],
+        "quotechar": dialect["quotechar"],
+        "skiprows": skiprows if len(skiprows) != 0 else None,
+    }
+
+
+def open_resource(download_url: str, stream: bool = False) -> str | BinaryIO:
+    # Remote files go through the shared session, local paths (as used in the tests) are handed
+    # straight to the reader. With stream=True a file object is always returned, and a remote
+    # file is read from the response as it arrives rather than held whole
+    if download_url.startswith(("http://", "https://")):
+        if stream:
+            return open_url_stream(download_url)
+        return io.BytesIO(fetch_bytes(download_url))
+    if stream:
+        return open(download_url, "rb")
+    return download_url
+
+
+def is_hxlated_resource(resource_metadata: dict, sheet_name: Optional[str] = None) -> bool:
+    is_hxlated = False
+    check, _ = get_last_complete_check(resource_metadata, "fs_check_info")
+    if "hxl_proxy_response" in check:
+        sheets = check["hxl_proxy_response"]["sheets"]
+        if len(sheets) == 1:
+            is_hxlated = sheets[0]["is_hxlated"]
+        elif sheet_name is None:
+            # pandas.read_excel reads the first sheet by default
+            is_hxlated = sheets[0]["is_hxlated"]
+        else:
+            for sheet in sheets:
+                if sheet["name"] == sheet_name:
+                    is_hxlated = sheet["is_hxlated"]
+                    break
+
+    return is_hxlated
+
+
+def rows_from_dataframe(dataframe: pandas.DataFrame, n_rows: Optional[int] = None) -> list[dict]:
+    if n_rows is not None:
+        dataframe = dataframe.head(n_rows)
+    return dataframe.astype(str).to_dict("records")
 
 
 def print_data_preview(rows: list[dict]) -> dict:
@@ -103,6 +445,80 @@ def field_types_from_rows(rows: list[dict], null_equivalents: Optional[list] = N
     return field_types
 
 
+def field_types_from_dataframe(
+    dataframe: pandas.DataFrame, null_equivalents: Optional[list] = None
+) -> dict:
+    field_types = {}
+    for column_name in dataframe.columns:
+        field_types[column_name] = field_type_from_series(
+            dataframe[column_name], null_equivalents=null_equivalents
+        )
+
+    return field_types
+
+
+def field_type_from_series(series: pandas.Series, null_equivalents: Optional[list] = None) -> str:
+    # The reader has already done the type inference for everything except object columns,
+    # so we only fall back to inspecting values when pandas could not settle on a dtype
+    dtype = series.dtype
+    if isinstance(dtype, geopandas.array.GeometryDtype):
+        return "user-defined"
+
+    non_null = series.dropna()
+    if len(non_null) == 0:
+        field_type = "string"
+    elif pandas.api.types.is_bool_dtype(dtype):
+        field_type = "bool"
+    elif pandas.api.types.is_integer_dtype(dtype):
+        field_type = "integer"
+    elif pandas.api.types.is_float_dtype(dtype):
+        field_type = "float"
+    elif pandas.api.types.is_datetime64_any_dtype(dtype):
+        field_type = "datetime"
+    else:
+        field_type = field_type_from_column(non_null.tolist(), null_equivalents=null_equivalents)
+
+    # Object columns can mix numbers with text, so only columns pandas read as numbers are
+    # compared with the serial range
+    is_numeric = pandas.api.types.is_numeric_dtype(dtype) and field_type in ["integer", "float"]
+    if is_numeric and is_excel_serial_column(series.name, non_null.min(), non_null.max()):
+        field_type = "date" if field_type == "integer" else "datetime"
+
+    return field_type
+
+
+def date_formats_from_dataframe(dataframe: pandas.DataFrame, field_types: dict) -> dict:
+    # The format found in each date column. The values were classified when the field types were
+    # inferred so this is answered from the memo
+    date_formats = {}
+    for column_name, field_type in field_types.items():
+        if field_type not in ["date", "datetime"] or column_name not in dataframe.columns:
+            continue
+        non_null = dataframe[column_name].dropna()
+        if pandas.api.types.is_numeric_dtype(non_null.dtype):
+            date_formats[column_name] = EXCEL_SERIAL_FORMAT
+        elif pandas.api.types.is_object_dtype(non_null.dtype):
+            date_format, _ = detect_date_format([x for x in non_null if isinstance(x, str)])
+            if date_format is not None:
+                date_formats[column_name] = date_format
+
+    return date_formats
+
+
+def date_formats_from_rows(rows: list[dict], field_types: dict) -> dict:
+    date_formats = {}
+    for column_name, field_type in field_types.items():
+        if field_type not in ["date", "datetime"]:
+            continue
+        date_format, _ = detect_date_format(
+            [x[column_name] for x in rows if isinstance(x.get(column_name), str)]
+        )
+        if date_format is not None:
+            date_formats[column_name] = date_format
+
+    return date_formats
+
+
 def field_type_from_column(
     column: list, null_equivalents: Optional[list] = None, strict: bool = False
 ) -> str:
@@ -120,30 +536,25 @@ def field_type_from_column(
 
     field_type = "TEXT"
     type_counter = Counter()
+    strings = []
     for string in column:
         if string in null_equivalents:
             continue
-        try:
-            value = ast.literal_eval(f"{string}")
-            type_ = type(value).__name__
-        except (ValueError, SyntaxError):
-            type_ = "str"
-
-        if type_ == "str":
-            try:
-                datetime.datetime.strptime(string, "%Y-%m-%d")
-                type_ = "DATE"
-            except (ValueError, TypeError):
-                pass
-        if type_ == "str":
-            try:
-                datetime.datetime.fromisoformat(string)
-                type_ = "DATETIME"
-            except (ValueError, TypeError):
-                pass
         if isinstance(string, datetime.datetime):
-            type_ = "DATETIME"
-        type_counter[type_] += 1
+            type_counter["DATETIME"] += 1
+            continue
+        type_ = literal_type(f"{string}")
+        if type_ == "str" and isinstance(string, str):
+            strings.append(string)
+        else:
+            type_counter[type_] += 1
+
+    # Dates are recognised for the column as a whole, in the format most of its strings fit
+    date_format, n_dates = detect_date_format(strings)
+    if n_dates != 0:
+        type_counter[date_field_type(date_format).upper()] += n_dates
+    if len(strings) > n_dates:
+        type_counter["str"] += len(strings) - n_dates
 
     if set(type_counter.keys()) == set(["float", "int"]):
         field_type = "float"
@@ -155,19 +566,47 @@ def field_type_from_column(
     return field_type
 
 
+def literal_type(string: str) -> str:
+    if is_memoised(string):
+        return memoised_literal_type(string)
+    return find_literal_type(string)
+
+
+def find_literal_type(string: str) -> str:
+    try:
+        return type(ast.literal_eval(string)).__name__
+    except (ValueError, SyntaxError):
+        return "str"
+
+
+memoised_literal_type = functools.lru_cache(maxsize=DATE_MEMO_SIZE)(find_literal_type)
+
+
 def load_dataframe_from_local_path(
     local_file_path: str, file_format: str
 ) -> tuple[geopandas.GeoDataFrame, str]:
-    error_message = "Success"
-    if str(local_file_path).lower().endswith(".zip"):
-        unzip_directory = Path(local_file_path).parent
-        with zipfile.ZipFile(local_file_path, "r") as zip_file:
-            zip_file.extractall(unzip_directory)
-        glob_path = str(Path(unzip_directory) / "**" / f"*.{file_format.lower()}")
-        geo_files = sorted(glob.glob(glob_path))
-        error_message = "Got more than one file of the right format from a zip"
-        local_file_path = str(geo_files[0])
+    local_file_path, error_message = extract_geo_file(local_file_path, file_format)
+    if local_file_path is None:
+        return None, error_message
 
     dataframe = geopandas.read_file(local_file_path)
 
     return dataframe, error_message
+
+
+def extract_geo_file(local_file_path: str, file_format: str) -> tuple[Optional[str], str]:
+    # Zipped downloads are unpacked into a directory of their own next to the zip, and the first
+    # file of the format is used
+    if not str(local_file_path).lower().endswith(".zip"):
+        return local_file_path, "Success"
+    unzip_directory = Path(local_file_path).with_suffix("")
+    with zipfile.ZipFile(local_file_path, "r") as zip_file:
+        zip_file.extractall(unzip_directory)
+    glob_path = str(Path(unzip_directory) / "**" / f"*.{file_format.lower()}")
+    geo_files = sorted(glob.glob(glob_path, recursive=True))
+    if len(geo_files) == 0:
+        return None, f"No {file_format} file found in zip"
+    error_message = "Success"
+    if len(geo_files) > 1:
+        error_message = "Got more than one file of the right format from a zip"
+    return str(geo_files[0]), error_message
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import datetime
+import functools
+import re
+
+from typing import Optional
+
+# Values already classified, columns of dates repeat the same few hundred values many times over.
+# Only short values starting with a digit are memoised, which covers every date and number, so
+# free text is never kept
+DATE_MEMO_SIZE = 65536
+MEMO_MAX_LENGTH = 32
+ISO_DATETIME_FORMAT = "ISO 8601"
+# Each format has a recogniser and the field type it gives. Day first is listed before month
+# first, as the more common order in HDX data, and wins when a column fits both
+DATE_FORMATS = {
+    ISO_DATETIME_FORMAT: (
+        re.compile(
+            r"\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}(:\d{2}(\.\d{1,6})?)?(Z|[+-]\d{2}(:?\d{2})?)?"
+        ),
+        "datetime",
+    ),
+    "%Y-%m-%d": (
+        re.compile(r"(?P<year>\d{4})-(?P<month>\d{1,2})-(?P<day>\d{1,2})"),
+        "date",
+    ),
+    "%d/%m/%Y": (
+        re.compile(r"(?P<day>\d{1,2})/(?P<month>\d{1,2})/(?P<year>\d{4})"),
+        "date",
+    ),
+    "%m/%d/%Y": (
+        re.compile(r"(?P<month>\d{1,2})/(?P<day>\d{1,2})/(?P<year>\d{4})"),
+        "date",
+    ),
+    "%Y-%m": (re.compile(r"(?P<year>\d{4})-(?P<month>\d{2})"), "date"),
+}
+# Spreadsheet dates which arrive as day numbers. Any number column could hold them, so they are
+# only recognised in columns named like dates and between 1950 and 2100
+EXCEL_SERIAL_FORMAT = "Excel serial"
+EXCEL_SERIAL_RANGE = (18264, 73051)
+DATE_COLUMN_NAME_PATTERN = re.compile(r"date|time|period", re.IGNORECASE)
+
+
+def is_memoised(value: str) -> bool:
+    return len(value) <= MEMO_MAX_LENGTH and value[0:1].isdigit()
+
+
+def date_formats_of(value: str) -> tuple[str, ...]:
+    # The formats a value is a valid date in, most text fails on the first character
+    if not value[0:1].isdigit():
+        return ()
+    if is_memoised(value):
+        return memoised_date_formats_of(value)
+    return find_date_formats(value)
+
+
+def find_date_formats(value: str) -> tuple[str, ...]:
+    return tuple(x for x in DATE_FORMATS if is_date_in_format(value, x))
+
+
+memoised_date_formats_of = functools.lru_cache(maxsize=DATE_MEMO_SIZE)(find_date_formats)
+
+
+def is_date_in_format(value: str, date_format: str) -> bool:
+    match = DATE_FORMATS[date_format][0].fullmatch(value)
+    if match is None:
+        return False
+    try:
+        if date_format == ISO_DATETIME_FORMAT:
+            datetime.datetime.fromisoformat(value)
+        else:
+            parts = match.groupdict()
+            datetime.date(int(parts["year"]), int(parts["month"]), int(parts.get("day") or 1))
+    except ValueError:
+        return False
+    return True
+
+
+def detect_date_format(values: list[str]) -> tuple[Optional[str], int]:
+    # The candidate formats come from the first value which is a date at all, then the whole
+    # column is checked against each and the one most values fit is returned with their count
+    candidates = next((x for x in map(date_formats_of, values) if x), ())
+    date_format, n_dates = None, 0
+    for candidate in candidates:
+        n_matches = sum(1 for x in values if candidate in date_formats_of(x))
+        if n_matches > n_dates:
+            date_format, n_dates = candidate, n_matches
+    return date_format, n_dates
+
+
+def date_field_type(date_format: str) -> str:
+    return DATE_FORMATS[date_format][1]
+
+
+def is_excel_serial_column(column_name, minimum: float, maximum: float) -> bool:
+    if not isinstance(column_name, str) or DATE_COLUMN_NAME_PATTERN.search(column_name) is None:
+        return False
+    return EXCEL_SERIAL_RANGE[0] <= minimum and maximum <= EXCEL_SERIAL_RANGE[1]
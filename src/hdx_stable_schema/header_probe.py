@@ -0,0 +1,332 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import csv
+import html
+import re
+import struct
+import zlib
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+import requests
+
+from hdx_stable_schema.csv_sniffer import sniff_csv
+from hdx_stable_schema.metadata_processor import get_last_complete_check
+from hdx_stable_schema.utilities import fetch_prefix, fetch_range, hash_row
+
+# The prefix is doubled until it holds the header, libhxl looks for a hashtag row in the first
+# 25 rows so we read up to that many
+PROBE_PREFIX_BYTES = 16 * 1024
+PROBE_MAX_PREFIX_BYTES = 256 * 1024
+PROBE_MAX_ROWS = 25
+PROBE_WORKERS = 8
+PROBE_FORMATS = ["csv", "xlsx"]
+
+# The end of central directory record is 22 bytes plus a comment of up to 64KB, comments are
+# rare so a short tail is read first
+ZIP_TAIL_BYTES = 4096
+ZIP_MAX_TAIL_BYTES = 65536 + 22
+ZIP_CHUNK_BYTES = 64 * 1024
+# Compressed bytes inflated at a time, XML expands many times over so this bounds the text read
+# past the point where enough has been found
+ZIP_INFLATE_BYTES = 4096
+ZIP_END_SIGNATURE = b"PK\x05\x06"
+ZIP_ENTRY_SIGNATURE = b"PK\x01\x02"
+
+HASHTAG_PATTERN = re.compile(r"^\s*#[A-Za-z][A-Za-z0-9_]*(\s*\+\s*[A-Za-z][A-Za-z0-9_]*)*\s*$")
+XML_ROW_END_PATTERN = re.compile(rb"</(?:\w+:)?row>")
+XML_SHARED_STRING_END_PATTERN = re.compile(rb"</(?:\w+:)?si>")
+XML_ROW_PATTERN = re.compile(r"<(?:\w+:)?row\b[^>]*?(?:/>|>(.*?)</(?:\w+:)?row>)", re.DOTALL)
+XML_CELL_PATTERN = re.compile(r"<(?:\w+:)?c\b([^>]*?)(?:/>|>(.*?)</(?:\w+:)?c>)", re.DOTALL)
+XML_VALUE_PATTERN = re.compile(r"<(?:\w+:)?v>(.*?)</(?:\w+:)?v>", re.DOTALL)
+XML_TEXT_PATTERN = re.compile(r"<(?:\w+:)?t(?:\s[^>]*)?>(.*?)</(?:\w+:)?t>", re.DOTALL)
+XML_PHONETIC_PATTERN = re.compile(r"<(?:\w+:)?rPh\b.*?</(?:\w+:)?rPh>", re.DOTALL)
+XML_SHARED_STRING_PATTERN = re.compile(r"<(?:\w+:)?si>(.*?)</(?:\w+:)?si>", re.DOTALL)
+
+
+def probe_dataset_headers(metadata: dict, n_workers: int = PROBE_WORKERS) -> list[dict]:
+    resources = [
+        x
+        for x in metadata["result"]["resources"]
+        if x["format"].lower() in PROBE_FORMATS and "fs_check_info" in x.keys()
+    ]
+    return probe_resources(resources, n_workers=n_workers)
+
+
+def probe_resources(resources: list[dict], n_workers: int = PROBE_WORKERS) -> list[dict]:
+    # The probes spend their time waiting on the network, so threads are enough. The download
+    # lane of the request scheduler keeps them from flooding the server
+    with ThreadPoolExecutor(max_workers=n_workers) as pool:
+        return list(pool.map(probe_resource_header, resources))
+
+
+def probe_resource_header(resource_metadata: dict) -> dict:
+    result = {
+        "resource": resource_metadata["name"],
+        "format": resource_metadata["format"],
+        "sheet": "",
+        "recorded_hash": "",
+        "live_hash": "",
+        "status": "error",
+        "detail": "",
+    }
+    check, error_message = get_last_complete_check(resource_metadata, "fs_check_info")
+    if error_message != "Success":
+        result["detail"] = "No complete file structure check to compare with"
+        return result
+    recorded_sheets = check.get("hxl_proxy_response", {}).get("sheets") or []
+    if len(recorded_sheets) == 0:
+        result["detail"] = "No sheets recorded in the file structure check"
+        return result
+    recorded_sheet = recorded_sheets[0]
+    result["sheet"] = recorded_sheet["name"]
+    result["recorded_hash"] = recorded_sheet["header_hash"]
+
+    download_url = resource_metadata["download_url"]
+    try:
+        if resource_metadata["format"].lower() == "xlsx":
+            rows = xlsx_first_rows(download_url)
+        else:
+            rows, error_message = csv_first_rows(download_url)
+            if error_message != "Success":
+                result["detail"] = error_message
+                return result
+    except (
+        requests.exceptions.RequestException,
+        ValueError,
+        IndexError,
+        struct.error,
+        zlib.error,
+        OSError,
+    ) as exception_:
+        result["detail"] = f"Could not read the header of {download_url}: {exception_}"
+        return result
+
+    headers = header_row(rows)
+    if headers is None:
+        result["detail"] = "No header row found"
+        return result
+
+    result["live_hash"] = hash_row(headers)
+    if result["live_hash"] == result["recorded_hash"]:
+        result["status"] = "match"
+    else:
+        result["status"] = "changed"
+        recorded_headers = recorded_sheet["headers"] or []
+        added = [x for x in headers if x not in recorded_headers]
+        removed = [x for x in recorded_headers if x not in headers]
+        result["detail"] = (
+            f"added: {added}, removed: {removed}" if added or removed else "reordered"
+        )
+    return result
+
+
+def header_row(rows: list[list]) -> Optional[list]:
+    # As libhxl does, the header is the row above the hashtag row if there is one, otherwise the
+    # first row
+    i = hashtag_row_index(rows)
+    if i is not None:
+        return rows[i - 1] if i > 0 else [""] * len(rows[i])
+    return rows[0] if len(rows) != 0 else None
+
+
+def hashtag_row_index(rows: list[list]) -> Optional[int]:
+    for i, row in enumerate(rows):
+        values = [str(x) for x in row if x is not None and str(x).strip() != ""]
+        if len(values) != 0 and all(HASHTAG_PATTERN.match(x) for x in values):
+            return i
+    return None
+
+
+def csv_first_rows(download_url: str, n_rows: int = PROBE_MAX_ROWS) -> tuple[list[list], str]:
+    n_bytes = PROBE_PREFIX_BYTES
+    while True:
+        prefix, is_complete = fetch_prefix(download_url, n_bytes)
+        dialect = sniff_csv(prefix, is_complete=is_complete)
+        lines = prefix.decode(dialect["encoding"], errors="ignore").splitlines()
+        if not is_complete:
+            # The last line may be cut short
+            lines = lines[:-1]
+        rows = list(
+            csv.reader(lines, delimiter=dialect["delimiter"], quotechar=dialect["quotechar"])
+        )
+        if is_complete or len(rows) >= n_rows or n_bytes >= PROBE_MAX_PREFIX_BYTES:
+            break
+        n_bytes = 2 * n_bytes
+
+    if len(rows) == 0:
+        return [], f"No complete row in the first {n_bytes} bytes of {download_url}"
+    return rows[0:n_rows], "Success"
+
+
+def xlsx_first_rows(download_url: str, n_rows: int = PROBE_MAX_ROWS) -> list[list]:
+    # An xlsx file is a zip archive, with its directory at the end. We read the directory, then
+    # the workbook to find the first sheet, then decompress the start of that sheet and as much
+    # of the shared strings table as its first rows need. Each read is a Range request
+    tail, total_length = fetch_range(download_url, -ZIP_TAIL_BYTES)
+    if tail.rfind(ZIP_END_SIGNATURE) == -1 and total_length > len(tail):
+        tail, total_length = fetch_range(download_url, -ZIP_MAX_TAIL_BYTES)
+    entries = zip_directory(download_url, tail, total_length)
+
+    workbook = read_zip_member(download_url, entries, "xl/workbook.xml").decode("utf-8")
+    relationships = read_zip_member(download_url, entries, "xl/_rels/workbook.xml.rels")
+    sheet_path = first_sheet_path(workbook, relationships.decode("utf-8"))
+
+    sheet_xml = read_zip_member(
+        download_url, entries, sheet_path, stop=has_matches(XML_ROW_END_PATTERN, n_rows)
+    )
+    rows = []
+    for row_match in XML_ROW_PATTERN.finditer(sheet_xml.decode("utf-8", errors="ignore")):
+        rows.append(xml_row_cells(row_match.group(1) or ""))
+        if len(rows) == n_rows:
+            break
+
+    shared_indices = [x[1] for row in rows for x in row if x[0] == "s"]
+    shared_strings = []
+    if len(shared_indices) != 0:
+        shared_xml = read_zip_member(
+            download_url,
+            entries,
+            "xl/sharedStrings.xml",
+            stop=has_matches(XML_SHARED_STRING_END_PATTERN, max(shared_indices) + 1),
+        ).decode("utf-8", errors="ignore")
+        shared_strings = [
+            html.unescape("".join(XML_TEXT_PATTERN.findall(XML_PHONETIC_PATTERN.sub("", x))))
+            for x in XML_SHARED_STRING_PATTERN.findall(shared_xml)
+        ]
+
+    return [
+        [shared_strings[x[1]] if x[0] == "s" else x[1] for x in row_cells] for row_cells in rows
+    ]
+
+
+def xml_row_cells(row_xml: str) -> list[tuple[str, object]]:
+    # (type, value) for each cell, placed by its column reference so empty cells keep their place
+    cells = []
+    for cell_match in XML_CELL_PATTERN.finditer(row_xml):
+        attributes, content = cell_match.group(1), cell_match.group(2) or ""
+        reference = re.search(r'\br="([A-Z]+)\d*"', attributes)
+        cell_type = re.search(r'\bt="(\w+)"', attributes)
+        cell_type = cell_type.group(1) if cell_type is not None else "n"
+        if reference is not None:
+            column = column_index(reference.group(1))
+            cells.extend([("n", None)] * (column - len(cells)))
+
+        if cell_type == "inlineStr":
+            value = html.unescape("".join(XML_TEXT_PATTERN.findall(content)))
+        else:
+            value_match = XML_VALUE_PATTERN.search(content)
+            value = html.unescape(value_match.group(1)) if value_match is not None else None
+        if cell_type == "s" and value is not None:
+            cells.append(("s", int(value)))
+        else:
+            cells.append(("n", value))
+    return cells
+
+
+def column_index(letters: str) -> int:
+    index = 0
+    for letter in letters:
+        index = 26 * index + ord(letter) - ord("A") + 1
+    return index - 1
+
+
+def first_sheet_path(workbook_xml: str, relationships_xml: str) -> str:
+    sheet = re.search(r"<(?:\w+:)?sheet\b[^>]*?\br:id=\"(\w+)\"", workbook_xml)
+    if sheet is None:
+        raise ValueError("No sheets found in workbook")
+    for relationship in re.finditer(r"<(?:\w+:)?Relationship\b[^>]*>", relationships_xml):
+        if f'Id="{sheet.group(1)}"' in relationship.group(0):
+            target = re.search(r'Target="([^"]+)"', relationship.group(0)).group(1)
+            return target.lstrip("/") if target.startswith("/") else f"xl/{target}"
+    raise ValueError(f"No relationship found for sheet {sheet.group(1)}")
+
+
+def zip_directory(url: str, tail: bytes, total_length: int) -> dict[str, tuple[int, int, int]]:
+    # Maps member names to (compression method, compressed size, local header offset)
+    end_offset = tail.rfind(ZIP_END_SIGNATURE)
+    if end_offset == -1:
+        raise ValueError("Not a zip file")
+    directory_size, directory_offset = struct.unpack_from("<II", tail, end_offset + 12)
+    tail_start = total_length - len(tail)
+    if directory_offset >= tail_start:
+        start = directory_offset - tail_start
+        stop = start + directory_size
+        directory = tail[start:stop]
+    else:
+        directory, _ = fetch_range(url, directory_offset, directory_offset + directory_size)
+
+    entries = {}
+    position = 0
+    while directory.startswith(ZIP_ENTRY_SIGNATURE, position):
+        fields = struct.unpack_from("<4s6H3I5H2I", directory, position)
+        method, compressed_size = fields[4], fields[8]
+        name_length, extra_length, comment_length = fields[10], fields[11], fields[12]
+        local_offset = fields[16]
+        start = position + 46
+        stop = start + name_length
+        name = directory[start:stop].decode("utf-8")
+        entries[name] = (method, compressed_size, local_offset)
+        position = stop + extra_length + comment_length
+    return entries
+
+
+def has_matches(pattern: re.Pattern, n_matches: int) -> Callable[[bytearray], bool]:
+    # A stop test for read_zip_member, which only scans the content added since it last matched
+    position = 0
+    count = 0
+
+    def stop(content: bytearray) -> bool:
+        nonlocal position, count
+        for match in pattern.finditer(content, position):
+            count += 1
+            position = match.end()
+        return count >= n_matches
+
+    return stop
+
+
+def read_zip_member(
+    url: str,
+    entries: dict[str, tuple[int, int, int]],
+    name: str,
+    stop: Optional[Callable[[bytearray], bool]] = None,
+) -> bytes:
+    # Decompresses a member a slice at a time, stopping early once stop() is satisfied by the
+    # content so far
+    if name not in entries:
+        raise ValueError(f"{name} not found in zip file")
+    method, compressed_size, local_offset = entries[name]
+    if method not in (0, 8):
+        raise ValueError(f"Unsupported compression method {method} for {name}")
+
+    # The local header has the same name but its extra field can differ from the directory's
+    header_length = 30 + len(name.encode("utf-8"))
+    first_stop = local_offset + header_length + 1024 + min(compressed_size, ZIP_CHUNK_BYTES)
+    chunk, _ = fetch_range(url, local_offset, first_stop)
+    (extra_length,) = struct.unpack_from("<H", chunk, 28)
+    data_start = local_offset + header_length + extra_length
+    data_stop = data_start + compressed_size
+    start = header_length + extra_length
+    chunk = chunk[start:]
+
+    decompressor = zlib.decompressobj(-15) if method == 8 else None
+    content = bytearray()
+    position = data_start
+    while True:
+        n_remaining = data_stop - position
+        chunk = chunk[0:n_remaining]
+        position += len(chunk)
+        for start in range(0, len(chunk), ZIP_INFLATE_BYTES):
+            piece_stop = start + ZIP_INFLATE_BYTES
+            piece = chunk[start:piece_stop]
+            content += decompressor.decompress(piece) if decompressor is not None else piece
+            if stop is not None and stop(content):
+                return bytes(content)
+        if position >= data_stop or len(chunk) == 0:
+            break
+        chunk, _ = fetch_range(url, position, min(position + ZIP_CHUNK_BYTES, data_stop))
+
+    return bytes(content)
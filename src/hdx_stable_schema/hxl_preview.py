@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import itertools
+
+from typing import BinaryIO, Optional
+
+import hxl
+import requests
+
+from hdx_stable_schema.metadata_processor import get_last_complete_check
+from hdx_stable_schema.utilities import REQUEST_SCHEDULER
+
+HXL_PREVIEW_ROWS = 1000
+
+
+def get_hxl_preview_from_hdx(
+    resource_metadata: dict, sheet_name: Optional[str] = None, n_rows: int = HXL_PREVIEW_ROWS
+) -> tuple[dict, str]:
+    download_url = resource_metadata["download_url"]
+    preview = {}
+    error_message = "Success"
+    # libhxl makes its own request, so it waits its turn in the download lane but 429 responses
+    # are not retried
+    if download_url.startswith(("http://", "https://")):
+        REQUEST_SCHEDULER.lanes["download"].wait_for_turn()
+    try:
+        preview = get_hxl_preview(
+            download_url, n_rows=n_rows, sheet_index=sheet_index(resource_metadata, sheet_name)
+        )
+    except hxl.input.HXLTagsNotFoundException:
+        error_message = f"No HXL hashtag row found for URL {download_url}"
+    except (hxl.HXLException, requests.exceptions.RequestException):
+        error_message = f"Resource could not be read by libhxl for URL {download_url}"
+
+    return preview, error_message
+
+
+def get_hxl_preview(
+    source: str | BinaryIO, n_rows: int = HXL_PREVIEW_ROWS, sheet_index: Optional[int] = None
+) -> dict:
+    # libhxl reads the input lazily, so for CSV only the bytes up to the last previewed row are
+    # fetched. Excel workbooks are necessarily loaded whole by the underlying reader
+    hxl_source = hxl.data(source, hxl.InputOptions(allow_local=True, sheet_index=sheet_index))
+    headers = [x.header for x in hxl_source.columns]
+    hxl_headers = [x.display_tag for x in hxl_source.columns]
+    keys = row_keys(headers, hxl_headers)
+
+    rows = []
+    for row in itertools.islice(hxl_source, n_rows):
+        values = list(row.values) + [""] * (len(keys) - len(row.values))
+        rows.append(dict(zip(keys, values)))
+
+    return {"headers": headers, "hxl_headers": hxl_headers, "rows": rows}
+
+
+def row_keys(headers: list[Optional[str]], hxl_headers: list[str]) -> list[str]:
+    # Rows are keyed like the pandas previews, falling back to the hashtag for columns without a
+    # text header and de-duplicating repeated names
+    keys = []
+    n_seen = {}
+    for i, (header, hxl_header) in enumerate(zip(headers, hxl_headers)):
+        key = header or hxl_header or f"Unnamed: {i}"
+        keys.append(key if key not in n_seen else f"{key}.{n_seen[key]}")
+        n_seen[key] = n_seen.get(key, 0) + 1
+    return keys
+
+
+def sheet_index(resource_metadata: dict, sheet_name: Optional[str]) -> Optional[int]:
+    if sheet_name is None:
+        return None
+    check, error_message = get_last_complete_check(resource_metadata, "fs_check_info")
+    if error_message != "Success":
+        return None
+    for i, sheet in enumerate(check["hxl_proxy_response"]["sheets"]):
+        if sheet["name"] == sheet_name:
+            return i
+    return None
+
+
+def add_hxl_labels_to_schema(schema: dict, hxl_preview: dict) -> dict:
+    # The recorded check can be stale or miss the header row, the data itself is authoritative
+    if len(hxl_preview["hxl_headers"]) != len(schema["headers"]):
+        return schema
+    schema["hxl_headers"] = hxl_preview["hxl_headers"]
+    schema["headers"] = [
+        x if x is not None else y for x, y in zip(schema["headers"], hxl_preview["headers"])
+    ]
+    return schema
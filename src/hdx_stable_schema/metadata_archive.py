@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import gzip
+import json
+
+from pathlib import Path
+from typing import Iterator, Optional
+
+# An archive is a series of gzip members, each holding up to ARCHIVE_BLOCK_SIZE package_show
+# results as NDJSON. Concatenated gzip members are a valid gzip file so the archive can still be
+# read with zcat, while the sidecar index gives the offset and length of each member so one
+# dataset can be read by decompressing just its block
+ARCHIVE_BLOCK_SIZE = 64
+ARCHIVE_INDEX_SUFFIX = ".index.json"
+ARCHIVE_INDEX_VERSION = 1
+
+
+def archive_index_path(archive_path: str | Path) -> Path:
+    archive_path = Path(archive_path)
+    return archive_path.with_name(archive_path.name + ARCHIVE_INDEX_SUFFIX)
+
+
+class MetadataArchiveWriter:
+    """Writes package_show results to a block compressed NDJSON archive and its offset index
+
+    With append=True new snapshots are added after those already in the archive, so the same
+    dataset can be archived again whenever its metadata_modified moves on.
+    """
+
+    def __init__(
+        self, archive_path: str | Path, block_size: int = ARCHIVE_BLOCK_SIZE, append: bool = False
+    ):
+        self.archive_path = Path(archive_path)
+        self.block_size = block_size
+        self.entries = []
+        if append and self.archive_path.exists():
+            self.entries = read_archive_index(self.archive_path)["entries"]
+        self.archive_path.parent.mkdir(parents=True, exist_ok=True)
+        self.archive_file = open(self.archive_path, "ab" if append else "wb")
+        self.pending_lines = []
+        self.pending_entries = []
+
+    def add(self, metadata: dict):
+        result = metadata["result"]
+        self.pending_lines.append(json.dumps(result, separators=(",", ":")).encode("utf-8"))
+        self.pending_entries.append(
+            {
+                "name": result["name"],
+                "id": result.get("id", ""),
+                "metadata_modified": result.get("metadata_modified", ""),
+            }
+        )
+        if len(self.pending_lines) == self.block_size:
+            self.write_block()
+
+    def write_block(self):
+        if len(self.pending_lines) == 0:
+            return
+        block = gzip.compress(b"\n".join(self.pending_lines) + b"\n", mtime=0)
+        offset = self.archive_file.tell()
+        self.archive_file.write(block)
+        for line, entry in enumerate(self.pending_entries):
+            entry.update({"offset": offset, "length": len(block), "line": line})
+            self.entries.append(entry)
+        self.pending_lines = []
+        self.pending_entries = []
+
+    def close(self):
+        self.write_block()
+        self.archive_file.close()
+        with open(archive_index_path(self.archive_path), "w", encoding="utf-8") as index_file:
+            json.dump(
+                {
+                    "version": ARCHIVE_INDEX_VERSION,
+                    "block_size": self.block_size,
+                    "entries": self.entries,
+                },
+                index_file,
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class MetadataArchive:
+    """Random access and streaming reads of an archive written by MetadataArchiveWriter"""
+
+    def __init__(self, archive_path: str | Path):
+        self.archive_path = Path(archive_path)
+        self.entries = read_archive_index(self.archive_path)["entries"]
+        # The latest snapshot of each dataset, by name and by id
+        self.latest: dict[str, dict] = {}
+        for entry in self.entries:
+            for key in [entry["name"], entry["id"]]:
+                if key == "":
+                    continue
+                if key not in self.latest or (
+                    entry["metadata_modified"] >= self.latest[key]["metadata_modified"]
+                ):
+                    self.latest[key] = entry
+        # Consecutive reads often fall in the same block
+        self.cached_block: tuple[int, list[bytes]] = (-1, [])
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, dataset_name: str) -> bool:
+        return dataset_name in self.latest
+
+    def dataset_names(self) -> list[str]:
+        return sorted({x["name"] for x in self.entries})
+
+    def find(self, dataset_name: str, metadata_modified: Optional[str] = None) -> Optional[dict]:
+        if metadata_modified is None:
+            return self.latest.get(dataset_name)
+        for entry in self.entries:
+            if dataset_name in (entry["name"], entry["id"]) and (
+                entry["metadata_modified"] == metadata_modified
+            ):
+                return entry
+        return None
+
+    def read(self, dataset_name: str, metadata_modified: Optional[str] = None) -> dict:
+        entry = self.find(dataset_name, metadata_modified=metadata_modified)
+        if entry is None:
+            raise KeyError(f"Dataset '{dataset_name}' not found in {self.archive_path}")
+
+        if self.cached_block[0] != entry["offset"]:
+            self.cached_block = (
+                entry["offset"],
+                self.read_block_lines(entry["offset"], entry["length"]),
+            )
+
+        return {"result": json.loads(self.cached_block[1][entry["line"]])}
+
+    def blocks(self) -> list[tuple[int, int]]:
+        # (offset, length) of each block, in archive order
+        return sorted({(x["offset"], x["length"]) for x in self.entries})
+
+    def read_block(self, offset: int, length: int) -> Iterator[dict]:
+        for line in self.read_block_lines(offset, length):
+            yield {"result": json.loads(line)}
+
+    def read_block_lines(self, offset: int, length: int) -> list[bytes]:
+        with open(self.archive_path, "rb") as archive_file:
+            archive_file.seek(offset)
+            block = archive_file.read(length)
+        return gzip.decompress(block).splitlines()
+
+    def __iter__(self) -> Iterator[dict]:
+        # gzip reads the members in turn so only one line is held at a time
+        with gzip.open(self.archive_path, "rb") as archive_file:
+            for line in archive_file:
+                yield {"result": json.loads(line)}
+
+
+def read_archive_index(archive_path: str | Path) -> dict:
+    with open(archive_index_path(archive_path), encoding="utf-8") as index_file:
+        archive_index = json.load(index_file)
+    if archive_index.get("version") != ARCHIVE_INDEX_VERSION:
+        raise ValueError(f"Unsupported archive index version for {archive_path}")
+    return archive_index
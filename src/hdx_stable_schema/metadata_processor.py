@@ -1,18 +1,31 @@
 #!/usr/bin/env python
 # encoding: utf-8
 
+import copy
 import json
-from random import randrange
-
-import requests
+import sys
+import time
+from random import Random
+from typing import Iterator, Optional
 
 from pathlib import Path
 
-from hxl.input import hash_row
-
-from hdx_stable_schema.utilities import print_table_from_list_of_dicts
+from hdx_stable_schema.metadata_archive import MetadataArchive, ARCHIVE_INDEX_SUFFIX
+from hdx_stable_schema.records import Check, Resource, Schema, Sheet, intern_headers
+from hdx_stable_schema.utilities import print_table_from_list_of_dicts, hash_row, REQUEST_SCHEDULER
 
 CKAN_API_ROOT_URL = "https://data.humdata.org/api/action/"
+LUCKY_DIP_FQ = "res_format:(CSV and XLS and XLSX and GeoJSON)"
+# CKAN caps rows per package_search request at 1000
+MAX_SEARCH_ROWS = 1000
+# Offsets closer together than this are fetched in one window, the wasted rows cost less
+# than an extra round trip
+MAX_SAMPLE_GAP = 25
+
+DATASET_COUNT_CACHE: dict[str, int] = {}
+# package_show responses keyed on dataset name, with the time they were fetched
+METADATA_CACHE: dict[str, tuple[float, dict]] = {}
+METADATA_CACHE_TTL = 300
 
 SHAPE_INFO_DATA_TYPE_LOOKUP = {
     "character varying": "string",
@@ -45,93 +58,205 @@ def read_metadata_from_file(file_path: str | Path) -> dict:
     return metadata_dict
 
 
+def read_metadata_from_archive(
+    archive_path: str | Path, dataset_name: str, metadata_modified: Optional[str] = None
+) -> dict:
+    metadata_dict = MetadataArchive(archive_path).read(
+        dataset_name, metadata_modified=metadata_modified
+    )
+    reformat_metadata_keys(metadata_dict)
+
+    return metadata_dict
+
+
+def read_metadata_from_directory(directory_path: str | Path) -> Iterator[dict]:
+    for file_path in metadata_file_paths(directory_path):
+        yield from read_datasets_from_file(file_path)
+
+    # Archives are streamed a dataset at a time
+    for archive_path in metadata_archive_paths(directory_path):
+        for dataset_metadata in MetadataArchive(archive_path):
+            reformat_metadata_keys(dataset_metadata)
+            yield dataset_metadata
+
+
+def metadata_file_paths(directory_path: str | Path) -> list[Path]:
+    return [
+        x
+        for x in sorted(Path(directory_path).glob("*.json"))
+        if not x.name.endswith(ARCHIVE_INDEX_SUFFIX)
+    ]
+
+
+def metadata_archive_paths(directory_path: str | Path) -> list[Path]:
+    return sorted(Path(directory_path).glob("*.ndjson.gz"))
+
+
+def read_datasets_from_file(file_path: str | Path) -> Iterator[dict]:
+    with open(file_path, encoding="utf-8") as metadata_file:
+        metadata_dict = json.load(metadata_file)
+    if not isinstance(metadata_dict, dict) or "result" not in metadata_dict:
+        # Not a package_show or package_search response, e.g. a saved summary
+        return
+
+    # Unlike read_metadata_from_file we accept package_search responses with many datasets
+    for result in metadata_dict["result"].get("results", [metadata_dict["result"]]):
+        dataset_metadata = {"result": result}
+        reformat_metadata_keys(dataset_metadata)
+        yield dataset_metadata
+
+
 def reformat_metadata_keys(metadata_dict):
     for resource in metadata_dict["result"]["resources"]:
-        if "fs_check_info" in resource.keys():
+        if isinstance(resource.get("fs_check_info"), str):
             resource["fs_check_info"] = json.loads(resource["fs_check_info"])
-        if "shape_info" in resource.keys():
+        if isinstance(resource.get("shape_info"), str):
             resource["shape_info"] = json.loads(resource["shape_info"])
 
 
 def read_metadata_from_hdx(dataset_name: str) -> dict:
+    if dataset_name in METADATA_CACHE:
+        fetched_at, metadata_dict = METADATA_CACHE[dataset_name]
+        if time.monotonic() - fetched_at < METADATA_CACHE_TTL:
+            return copy.deepcopy(metadata_dict)
+
     query_url = f"{CKAN_API_ROOT_URL}package_show"
     params = {"id": dataset_name}
-    response = requests.get(query_url, params=params, timeout=20)
+    response = REQUEST_SCHEDULER.get("metadata", query_url, params=params, timeout=20)
 
     response.raise_for_status()
 
     metadata_dict = response.json()
     reformat_metadata_keys(metadata_dict)
+    now = time.monotonic()
+    for expired_name in [k for k, v in METADATA_CACHE.items() if now - v[0] >= METADATA_CACHE_TTL]:
+        del METADATA_CACHE[expired_name]
+    METADATA_CACHE[dataset_name] = (now, copy.deepcopy(metadata_dict))
     return metadata_dict
 
 
-def search_by_lucky_dip() -> dict:
-    # log.info('Lucky dip query')
-    # Call package search to get a number of datasets (we could hard code this) - filter to
+def search_datasets(
+    fq: str,
+    rows: int = MAX_SEARCH_ROWS,
+    start: int = 0,
+    sort: Optional[str] = None,
+    post: bool = False,
+) -> list[dict]:
+    # A long fq, such as a list of dataset names, is sent as a JSON POST body since a GET query
+    # string that long is refused by the server
     query_url = f"{CKAN_API_ROOT_URL}package_search"
-    count_params = {"fq": "res_format:(CSV and XLS and XLSX and GeoJSON)"}
-    response = requests.get(query_url, params=count_params, timeout=20)
+    params = {"fq": fq, "start": start, "rows": rows}
+    if sort is not None:
+        params["sort"] = sort
+    if post:
+        response = REQUEST_SCHEDULER.post("metadata", query_url, json=params, timeout=20)
+    else:
+        response = REQUEST_SCHEDULER.get("metadata", query_url, params=params, timeout=20)
 
     response.raise_for_status()
-    n_datasets = response.json()["result"]["count"]
-
-    # Now do a 2nd query with a random start, using the first to get the range of possible offsets
-    # Make a random offset in the range 0, n datasets
-    random_start = randrange(0, n_datasets)
-    # query with offset (start) = random, limit (rows) = 1
-    random_offset_params = {
-        "fq": "res_format:(CSV and XLS and XLSX and GeoJSON)",
-        "start": random_start,
-        "rows": 1,
-    }
-    response = requests.get(query_url, params=random_offset_params, timeout=20)
 
-    response.raise_for_status()
+    # Each result is wrapped to look like a package_show response
+    datasets = []
+    for result in response.json()["result"]["results"]:
+        metadata_dict = {"result": result}
+        reformat_metadata_keys(metadata_dict)
+        datasets.append(metadata_dict)
 
-    metadata_dict = response.json()
-    # We do this little trick to make a package_search response for 1 dataset look
-    # like a package_show response
-    metadata_dict["result"] = metadata_dict["result"]["results"][0]
-    reformat_metadata_keys(metadata_dict)
+    return datasets
 
-    return metadata_dict
+
+def iter_search_datasets(fq: str, page_rows: int = MAX_SEARCH_ROWS) -> Iterator[dict]:
+    # Every dataset matching fq, a page of search results at a time
+    start = 0
+    while True:
+        page = search_datasets(fq, rows=page_rows, start=start, sort="id asc")
+        yield from page
+        if len(page) < page_rows:
+            break
+        start += page_rows
+
+
+def search_by_lucky_dip() -> dict:
+    datasets, _ = sample_datasets(1)
+    return datasets[0]
+
+
+def count_datasets(fq: str) -> int:
+    if fq not in DATASET_COUNT_CACHE:
+        query_url = f"{CKAN_API_ROOT_URL}package_search"
+        response = REQUEST_SCHEDULER.get(
+            "metadata", query_url, params={"fq": fq, "rows": 0}, timeout=20
+        )
+
+        response.raise_for_status()
+        DATASET_COUNT_CACHE[fq] = response.json()["result"]["count"]
+
+    return DATASET_COUNT_CACHE[fq]
+
+
+def sample_datasets(
+    n_samples: int,
+    fq: str = LUCKY_DIP_FQ,
+    seed: Optional[int] = None,
+    max_rows: int = MAX_SEARCH_ROWS,
+    max_gap: int = MAX_SAMPLE_GAP,
+) -> tuple[list[dict], int]:
+    # Returns up to n_samples distinct random datasets and the number of API requests made
+    random = Random(seed)
+    n_requests = 0 if fq in DATASET_COUNT_CACHE else 1
+    n_datasets = count_datasets(fq)
+    n_samples = min(n_samples, n_datasets)
+
+    datasets = []
+    seen_ids = set()
+    used_offsets = set()
+    # Paging is only stable if the catalogue does not change between requests, so we may come
+    # up short after deduplication and need to draw again
+    for _ in range(3):
+        n_wanted = n_samples - len(datasets)
+        if n_wanted == 0:
+            break
+        candidates = [x for x in range(n_datasets) if x not in used_offsets]
+        offsets = random.sample(candidates, min(n_wanted, len(candidates)))
+        used_offsets.update(offsets)
+        for start, rows, window_offsets in plan_sample_windows(offsets, max_rows, max_gap):
+            window = search_datasets(fq, rows=rows, start=start, sort="id asc")
+            n_requests += 1
+            for offset in window_offsets:
+                if offset - start >= len(window):
+                    continue
+                metadata_dict = window[offset - start]
+                if metadata_dict["result"]["id"] not in seen_ids:
+                    seen_ids.add(metadata_dict["result"]["id"])
+                    datasets.append(metadata_dict)
+
+    return datasets, n_requests
+
+
+def plan_sample_windows(
+    offsets: list[int], max_rows: int = MAX_SEARCH_ROWS, max_gap: int = MAX_SAMPLE_GAP
+) -> list[tuple[int, int, list[int]]]:
+    # Coalesce sorted offsets into (start, rows, offsets) package_search windows
+    windows = []
+    for offset in sorted(set(offsets)):
+        if len(windows) != 0:
+            start, _, window_offsets = windows[-1]
+            if offset - window_offsets[-1] <= max_gap and offset - start < max_rows:
+                window_offsets.append(offset)
+                windows[-1] = (start, offset - start + 1, window_offsets)
+                continue
+        windows.append((offset, 1, [offset]))
+
+    return windows
 
 
 def summarise_resource(metadata: dict) -> dict:
     resource_summary = {}
     error_message = "Neither fs_check_info nor shape_info found"
-    for resource in metadata["result"]["resources"]:
-        resource_summary[resource["name"]] = {}
-        resource_summary[resource["name"]]["format"] = resource["format"]
-        if "download_url" in resource.keys():
-            resource_summary[resource["name"]]["filename"] = resource["download_url"].split("/")[-1]
-        else:
-            resource_summary[resource["name"]]["filename"] = ""
-        resource_summary[resource["name"]]["in_quarantine"] = resource.get("in_quarantine", False)
-
-        resource_summary[resource["name"]]["sheets"] = []
-
-        if "fs_check_info" in resource.keys():
-            check, error_message = get_last_complete_check(resource, "fs_check_info")
-            if error_message == "Success":
-                # print(json.dumps(check, indent=4), flush=True)
-                for sheet in check["hxl_proxy_response"]["sheets"]:
-                    sheet_name = sheet["name"]
-                    nrows = sheet["nrows"]
-                    ncols = sheet["ncols"]
-                    resource_summary[resource["name"]]["sheets"].append(
-                        f"{sheet_name} (n_columns:{ncols} x n_rows:{nrows})"
-                    )
-        elif "shape_info" in resource.keys():
-            check, error_message = get_last_complete_check(resource, "shape_info")
-            if error_message == "Success":
-                sheet_name = "__DEFAULT__"
-                ncols = len(check["layer_fields"])
-                nrows = "N/A"
-                resource_summary[resource["name"]]["sheets"].append(
-                    f"{sheet_name} (n_columns:{ncols} x n_rows:{nrows})"
-                )
-                resource_summary[resource["name"]]["bounding_box"] = check["bounding_box"]
+    for resource in resource_records(metadata):
+        resource_summary[resource.name] = resource.as_dict()
+        if resource.metadata_key is not None:
+            error_message = resource.error_message
 
     if error_message != "Success":
         print(error_message, flush=True)
@@ -199,46 +324,102 @@ def summarise_resource_changes(metadata: dict) -> dict:
 
 def summarise_schema(metadata: dict) -> dict:
     schemas = {}
+    resources = resource_records(metadata)
     error_message = "Neither fs_check_info nor shape_info found"
+    for resource in resources:
+        if resource.metadata_key is not None:
+            error_message = resource.error_message
+        if error_message != "Success":
+            print(error_message, flush=True)
+
+    for header_hash, schema in schema_records(resources).items():
+        schemas[header_hash] = schema.as_dict()
+
+    return schemas
+
+
+def resource_records(metadata: dict) -> list[Resource]:
+    resources = []
     for resource in metadata["result"]["resources"]:
+        metadata_key = None
+        last_check = None
+        error_message = "Neither fs_check_info nor shape_info found"
         if "fs_check_info" in resource.keys():
-            check, error_message = get_last_complete_check(resource, "fs_check_info")
-
-            if error_message == "Success":
-                for sheet in check["hxl_proxy_response"]["sheets"]:
-                    header_hash = sheet["header_hash"]
-                    if header_hash not in schemas:
-                        schemas[header_hash] = {}
-                        schemas[header_hash]["sheet"] = sheet["name"]
-                        schemas[header_hash]["shared_with"] = [resource["name"]]
-                        schemas[header_hash]["headers"] = sheet["headers"]
-                        schemas[header_hash]["hxl_headers"] = sheet["hxl_headers"]
-                        schemas[header_hash]["data_types"] = [""] * len(sheet["headers"])
-                    else:
-                        schemas[header_hash]["shared_with"].append(resource["name"])
+            metadata_key = "fs_check_info"
         elif "shape_info" in resource.keys():
-            # print(json.dumps(resource["shape_info"][-1], indent=4), flush=True)
-            check, error_message = get_last_complete_check(resource, "shape_info")
+            metadata_key = "shape_info"
 
-            # print(json.dumps(check, indent=4), flush=True)
+        if metadata_key is not None:
+            check, error_message = get_last_complete_check(resource, metadata_key)
             if error_message == "Success":
-                headers = [x["field_name"] for x in check["layer_fields"]]
-                data_types = [
-                    SHAPE_INFO_DATA_TYPE_LOOKUP[x["data_type"]] for x in check["layer_fields"]
-                ]
-                header_hash = hash_row(headers)
-                if header_hash not in schemas:
-                    schemas[header_hash] = {}
-                    schemas[header_hash]["sheet"] = "__DEFAULT__"
-                    schemas[header_hash]["shared_with"] = [resource["name"]]
-                    schemas[header_hash]["headers"] = headers
-                    schemas[header_hash]["hxl_headers"] = [""] * len(headers)
-                    schemas[header_hash]["data_types"] = data_types
-                else:
-                    schemas[header_hash]["shared_with"].append(resource["name"])
+                last_check = check_record(check, metadata_key)
+
+        resources.append(
+            Resource(
+                name=sys.intern(resource["name"]),
+                format=sys.intern(resource["format"]),
+                filename=resource.get("download_url", "").split("/")[-1],
+                in_quarantine=resource.get("in_quarantine", False),
+                metadata_key=metadata_key,
+                last_check=last_check,
+                error_message=error_message,
+            )
+        )
 
-        if error_message != "Success":
-            print(error_message, flush=True)
+    return resources
+
+
+def check_record(check: dict, metadata_key: str) -> Check:
+    if metadata_key == "shape_info":
+        headers = intern_headers([x["field_name"] for x in check["layer_fields"]])
+        sheet = Sheet(
+            name="__DEFAULT__",
+            n_rows=None,
+            n_columns=len(headers),
+            header_hash=hash_row(headers),
+            headers=headers,
+            hxl_headers=intern_headers([""] * len(headers)),
+            data_types=intern_headers(
+                [SHAPE_INFO_DATA_TYPE_LOOKUP[x["data_type"]] for x in check["layer_fields"]]
+            ),
+        )
+        return Check(
+            timestamp=check["timestamp"], sheets=(sheet,), bounding_box=check["bounding_box"]
+        )
+
+    sheets = []
+    for sheet in check["hxl_proxy_response"]["sheets"]:
+        sheets.append(
+            Sheet(
+                name=sys.intern(sheet["name"]),
+                n_rows=sheet["nrows"],
+                n_columns=sheet["ncols"],
+                header_hash=sheet["header_hash"],
+                headers=intern_headers(sheet["headers"]),
+                hxl_headers=intern_headers(sheet["hxl_headers"]),
+                data_types=intern_headers([""] * len(sheet["headers"])),
+            )
+        )
+    return Check(timestamp=check["timestamp"], sheets=tuple(sheets))
+
+
+def schema_records(resources: list[Resource]) -> dict[str, Schema]:
+    schemas = {}
+    for resource in resources:
+        if resource.last_check is None:
+            continue
+        for sheet in resource.last_check.sheets:
+            if sheet.header_hash not in schemas:
+                schemas[sheet.header_hash] = Schema(
+                    header_hash=sheet.header_hash,
+                    sheet=sheet.name,
+                    headers=sheet.headers,
+                    hxl_headers=sheet.hxl_headers,
+                    data_types=sheet.data_types,
+                    shared_with=[resource.name],
+                )
+            else:
+                schemas[sheet.header_hash].shared_with.append(resource.name)
 
     return schemas
 
@@ -273,6 +454,21 @@ def get_last_complete_check(resource_metadata: dict, metadata_key: str) -> tuple
     return check, error_message
 
 
+def content_fingerprint(resource_metadata: dict) -> Optional[str]:
+    # Resources whose last file structure check recorded the same file size, sheets, header hashes
+    # and shapes (such as a yearly re-upload of an unchanged file) are taken to hold the same
+    # content. Without a size and a complete check there is no fingerprint
+    if resource_metadata.get("hash"):
+        return hash_row(["hash", resource_metadata["hash"]])
+    check, error_message = get_last_complete_check(resource_metadata, "fs_check_info")
+    if error_message != "Success" or not resource_metadata.get("size"):
+        return None
+    parts = [resource_metadata["format"].upper(), resource_metadata["size"]]
+    for sheet in check["hxl_proxy_response"]["sheets"]:
+        parts.extend([sheet["name"], sheet["header_hash"], sheet["nrows"], sheet["ncols"]])
+    return hash_row(parts)
+
+
 def print_schema(schema: dict) -> list[dict]:
     row_template = {"Column": "", "Type": "", "Label": "", "Description": ""}
     rows = []
@@ -284,8 +480,15 @@ def print_schema(schema: dict) -> list[dict]:
         row = row_template.copy()
         row["Column"] = schema["headers"][i]
         row["Type"] = schema["data_types"][i]
+        if schema.get("date_formats") and schema["date_formats"][i]:
+            row["Type"] = f"{row['Type']} ({schema['date_formats'][i]})"
         row["Label"] = schema["hxl_headers"][i]
+        if "statistics" in schema:
+            row.update(schema["statistics"][i])
         rows.append(row)
 
-    print_table_from_list_of_dicts(rows)
+    if "statistics" in schema:
+        print_table_from_list_of_dicts(rows, truncate_width=40, max_total_width=250)
+    else:
+        print_table_from_list_of_dicts(rows)
     return rows
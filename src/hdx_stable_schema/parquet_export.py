@@ -0,0 +1,357 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import datetime
+import re
+import zlib
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterable, Optional
+
+import pyarrow
+import pyarrow.ipc
+import pyarrow.parquet
+import requests
+
+from hdx_stable_schema.header_probe import (
+    csv_first_rows,
+    hashtag_row_index,
+    header_row,
+    xlsx_first_rows,
+    PROBE_FORMATS,
+    PROBE_WORKERS,
+)
+from hdx_stable_schema.metadata_processor import (
+    content_fingerprint,
+    get_last_complete_check,
+    resource_records,
+)
+from hdx_stable_schema.utilities import hash_row
+
+# Rows are buffered per table and written as a row group once this many have built up, so memory
+# use does not grow with the size of the catalogue
+EXPORT_BATCH_ROWS = 50000
+EXPORT_FORMATS = {"parquet": ".parquet", "arrow": ".arrow"}
+
+TEXT = pyarrow.string()
+TIMESTAMP = pyarrow.timestamp("us")
+TABLE_SCHEMAS = {
+    "resources": pyarrow.schema(
+        [
+            ("dataset", TEXT),
+            ("organization", TEXT),
+            ("resource", TEXT),
+            ("resource_id", TEXT),
+            ("format", TEXT),
+            ("filename", TEXT),
+            ("in_quarantine", pyarrow.bool_()),
+            ("metadata_key", TEXT),
+            ("n_checks", pyarrow.int32()),
+            ("last_check", TIMESTAMP),
+            ("error_message", TEXT),
+        ]
+    ),
+    "sheets": pyarrow.schema(
+        [
+            ("dataset", TEXT),
+            ("resource", TEXT),
+            ("format", TEXT),
+            ("sheet", TEXT),
+            ("n_rows", pyarrow.int64()),
+            ("n_columns", pyarrow.int32()),
+            ("header_hash", TEXT),
+            ("last_check", TIMESTAMP),
+        ]
+    ),
+    "columns": pyarrow.schema(
+        [
+            ("dataset", TEXT),
+            ("resource", TEXT),
+            ("format", TEXT),
+            ("sheet", TEXT),
+            ("header_hash", TEXT),
+            ("position", pyarrow.int32()),
+            ("name", TEXT),
+            ("data_type", TEXT),
+            ("hxl_tag", TEXT),
+        ]
+    ),
+    "checks": pyarrow.schema(
+        [
+            ("dataset", TEXT),
+            ("resource", TEXT),
+            ("format", TEXT),
+            ("metadata_key", TEXT),
+            ("timestamp", TIMESTAMP),
+            ("message", TEXT),
+            ("event_type", TEXT),
+            ("sheet", TEXT),
+            ("field", TEXT),
+        ]
+    ),
+    "previews": pyarrow.schema(
+        [
+            ("dataset", TEXT),
+            ("resource", TEXT),
+            ("format", TEXT),
+            ("sheet", TEXT),
+            ("row", pyarrow.int32()),
+            ("column", TEXT),
+            ("value", TEXT),
+        ]
+    ),
+}
+# Each table is partitioned hive style on this column, e.g. columns/format=CSV/part-0.parquet.
+# A hive reader takes the column's value from the directory name, so the value written in the
+# rows is normalised in the same way, GeoJSON is written as GEOJSON
+PARTITION_COLUMN = "format"
+
+
+class TableWriter:
+    """Buffers rows for one table and writes them in batches to one file per partition
+
+    Each partition file is held open for the whole export and gains a row group (or an IPC
+    record batch) with each flush.
+    """
+
+    def __init__(
+        self,
+        output_directory: str | Path,
+        name: str,
+        file_format: str = "parquet",
+        batch_rows: int = EXPORT_BATCH_ROWS,
+    ):
+        self.directory = Path(output_directory) / name
+        self.schema = TABLE_SCHEMAS[name]
+        self.file_format = file_format
+        self.batch_rows = batch_rows
+        self.rows: list[dict] = []
+        self.writers = {}
+        self.n_rows = 0
+
+    def add(self, row: dict):
+        row[PARTITION_COLUMN] = partition_value(row[PARTITION_COLUMN])
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_rows:
+            self.flush()
+
+    def flush(self):
+        partitions: dict[str, list[dict]] = {}
+        for row in self.rows:
+            partitions.setdefault(row[PARTITION_COLUMN], []).append(row)
+        for value, rows in partitions.items():
+            self.writer(value).write_table(pyarrow.Table.from_pylist(rows, schema=self.schema))
+        self.n_rows += len(self.rows)
+        self.rows = []
+
+    def writer(self, value: str):
+        if value not in self.writers:
+            partition_directory = self.directory / f"{PARTITION_COLUMN}={value}"
+            partition_directory.mkdir(parents=True, exist_ok=True)
+            file_path = partition_directory / f"part-0{EXPORT_FORMATS[self.file_format]}"
+            if self.file_format == "parquet":
+                self.writers[value] = pyarrow.parquet.ParquetWriter(file_path, self.schema)
+            else:
+                self.writers[value] = pyarrow.ipc.new_file(file_path, self.schema)
+        return self.writers[value]
+
+    def close(self):
+        self.flush()
+        for writer in self.writers.values():
+            writer.close()
+
+
+def export_tables(
+    datasets: Iterable[dict],
+    output_directory: str | Path,
+    file_format: str = "parquet",
+    batch_rows: int = EXPORT_BATCH_ROWS,
+    preview_rows: int = 0,
+    n_workers: int = PROBE_WORKERS,
+) -> tuple[int, dict[str, int]]:
+    # Returns the number of datasets exported and the number of rows written to each table.
+    # Previews are the first preview_rows rows of each CSV and XLSX resource, read with the same
+    # partial fetches as the header probe
+    writers = {x: TableWriter(output_directory, x, file_format, batch_rows) for x in TABLE_SCHEMAS}
+    n_datasets = 0
+    with ThreadPoolExecutor(max_workers=n_workers) as pool:
+        for metadata in datasets:
+            n_datasets += 1
+            for table_name, row in dataset_rows(metadata):
+                writers[table_name].add(row)
+            if preview_rows > 0:
+                for row in preview_table_rows(metadata, preview_rows, pool):
+                    writers["previews"].add(row)
+
+    for writer in writers.values():
+        writer.close()
+    return n_datasets, {k: v.n_rows for k, v in writers.items()}
+
+
+def dataset_rows(metadata: dict) -> Iterable[tuple[str, dict]]:
+    dataset_name = metadata["result"]["name"]
+    organization = (metadata["result"].get("organization") or {}).get("name", "")
+    for resource_metadata, resource in zip(
+        metadata["result"]["resources"], resource_records(metadata)
+    ):
+        last_check = resource.last_check
+        checks = resource_metadata.get(resource.metadata_key, []) if resource.metadata_key else []
+        yield "resources", {
+            "dataset": dataset_name,
+            "organization": organization,
+            "resource": resource.name,
+            "resource_id": resource_metadata.get("id", ""),
+            "format": resource.format,
+            "filename": resource.filename,
+            "in_quarantine": resource.in_quarantine,
+            "metadata_key": resource.metadata_key,
+            "n_checks": len(checks),
+            "last_check": parse_timestamp(last_check.timestamp if last_check else None),
+            "error_message": resource.error_message,
+        }
+
+        common = {"dataset": dataset_name, "resource": resource.name, "format": resource.format}
+        for sheet in last_check.sheets if last_check is not None else ():
+            yield "sheets", common | {
+                "sheet": sheet.name,
+                "n_rows": sheet.n_rows,
+                "n_columns": sheet.n_columns,
+                "header_hash": sheet.header_hash,
+                "last_check": parse_timestamp(last_check.timestamp),
+            }
+            hxl_headers = sheet.hxl_headers or ()
+            for position, name in enumerate(sheet.headers or ()):
+                yield "columns", common | {
+                    "sheet": sheet.name,
+                    "header_hash": sheet.header_hash,
+                    "position": position,
+                    "name": name,
+                    "data_type": sheet.data_types[position] or None,
+                    "hxl_tag": (hxl_headers[position] or None)
+                    if position < len(hxl_headers)
+                    else None,
+                }
+
+        for event in check_events(checks, resource.metadata_key):
+            yield "checks", common | event
+
+
+def check_events(checks: list, metadata_key: Optional[str]) -> Iterable[dict]:
+    # One row for each change reported by a check, or a single row with no event_type for a
+    # check which found no changes. Shape checks are compared with the previous successful one,
+    # as in summarise_resource_changes
+    previous_fields_hash, previous_bounding_box = None, None
+    for check in checks:
+        if not isinstance(check, dict):
+            continue
+        row = {
+            "metadata_key": metadata_key,
+            "timestamp": parse_timestamp(check.get("timestamp")),
+            "message": check.get("message"),
+            "event_type": None,
+            "sheet": None,
+            "field": None,
+        }
+        events = []
+        if metadata_key == "fs_check_info":
+            for change in check.get("sheet_changes") or []:
+                fields = [x["field"] for x in change.get("changed_fields", [])] or [None]
+                for field in fields:
+                    events.append(
+                        {
+                            "event_type": change["event_type"],
+                            "sheet": change["name"],
+                            "field": field,
+                        }
+                    )
+        elif check.get("message") == "Import successful":
+            fields_hash = hash_row([x["field_name"] for x in check["layer_fields"]])
+            bounding_box = check["bounding_box"]
+            if previous_fields_hash not in (None, fields_hash):
+                events.append({"event_type": "layer-fields-changed", "sheet": "__DEFAULT__"})
+            if previous_fields_hash is not None and bounding_box != previous_bounding_box:
+                events.append({"event_type": "bounding-box-changed", "sheet": "__DEFAULT__"})
+            previous_fields_hash, previous_bounding_box = fields_hash, bounding_box
+
+        for event in events or [{}]:
+            yield row | event
+
+
+def preview_table_rows(
+    metadata: dict, preview_rows: int, pool: ThreadPoolExecutor
+) -> Iterable[dict]:
+    dataset_name = metadata["result"]["name"]
+    resources = [
+        x
+        for x in metadata["result"]["resources"]
+        if x["format"].lower() in PROBE_FORMATS and x.get("download_url")
+    ]
+    # Resources holding the same file are sampled once
+    keys = [content_fingerprint(x) or x["download_url"] for x in resources]
+    unique_resources = {}
+    for key, resource in zip(keys, resources):
+        unique_resources.setdefault(key, resource)
+    samples = dict(
+        zip(
+            unique_resources,
+            pool.map(lambda x: preview_sample(x, preview_rows), unique_resources.values()),
+        )
+    )
+    for resource, key in zip(resources, keys):
+        sheet_name, headers, rows = samples[key]
+        for i, row in enumerate(rows):
+            for column, value in zip(headers, row):
+                yield {
+                    "dataset": dataset_name,
+                    "resource": resource["name"],
+                    "format": resource["format"],
+                    "sheet": sheet_name,
+                    "row": i,
+                    "column": None if column is None else str(column),
+                    "value": None if value is None else str(value),
+                }
+
+
+def preview_sample(resource_metadata: dict, preview_rows: int) -> tuple[str, list, list[list]]:
+    # (sheet, headers, rows) for the first sheet, or no rows if the file cannot be read
+    download_url = resource_metadata["download_url"]
+    sheet_name = "__DEFAULT__"
+    check, error_message = get_last_complete_check(resource_metadata, "fs_check_info")
+    if error_message == "Success":
+        sheet_name = check["hxl_proxy_response"]["sheets"][0]["name"]
+    try:
+        if resource_metadata["format"].lower() == "xlsx":
+            rows = xlsx_first_rows(download_url, n_rows=preview_rows + 2)
+        else:
+            rows, error_message = csv_first_rows(download_url, n_rows=preview_rows + 2)
+            if error_message != "Success":
+                return sheet_name, [], []
+    except (requests.exceptions.RequestException, ValueError, zlib.error, OSError):
+        return sheet_name, [], []
+
+    headers = header_row(rows)
+    if headers is None:
+        return sheet_name, [], []
+    i = hashtag_row_index(rows)
+    start = 1 if i is None else i + 1
+    stop = start + preview_rows
+    return sheet_name, headers, rows[start:stop]
+
+
+def partition_value(value: Optional[str]) -> str:
+    # Hive partition directories need values which are safe as file names
+    value = re.sub(r"[^A-Za-z0-9_.-]+", "_", (value or "").upper()).strip("_")
+    return value or "UNKNOWN"
+
+
+def parse_timestamp(value: Optional[str]) -> Optional[datetime.datetime]:
+    if not value:
+        return None
+    try:
+        timestamp = datetime.datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return timestamp
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import sys
+
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+# Identical header lists are common across resources, datasets and organizations, so each
+# distinct list is held once as a tuple of interned strings. Only the most recently seen lists
+# are kept for sharing, a long-lived process (see daemon.py) would otherwise keep every list it
+# had ever read
+HEADER_TUPLES: OrderedDict[tuple, tuple] = OrderedDict()
+HEADER_TUPLES_MAX_ENTRIES = 16384
+
+
+def intern_headers(headers: Optional[list]) -> Optional[tuple]:
+    if headers is None:
+        return None
+    key = tuple(sys.intern(x) if isinstance(x, str) else x for x in headers)
+    header_tuple = HEADER_TUPLES.setdefault(key, key)
+    HEADER_TUPLES.move_to_end(key)
+    while len(HEADER_TUPLES) > HEADER_TUPLES_MAX_ENTRIES:
+        HEADER_TUPLES.popitem(last=False)
+    return header_tuple
+
+
+@dataclass(slots=True)
+class Sheet:
+    name: str
+    n_rows: Optional[int]
+    n_columns: int
+    header_hash: Optional[str]
+    headers: tuple
+    hxl_headers: Optional[tuple]
+    data_types: tuple
+
+    def summary(self) -> str:
+        n_rows = "N/A" if self.n_rows is None else self.n_rows
+        return f"{self.name} (n_columns:{self.n_columns} x n_rows:{n_rows})"
+
+
+@dataclass(slots=True)
+class Check:
+    timestamp: str
+    sheets: tuple[Sheet, ...]
+    bounding_box: Optional[str] = None
+
+
+@dataclass(slots=True)
+class Resource:
+    # Only the last complete check is kept, the check history stays in the CKAN metadata
+    name: str
+    format: str
+    filename: str
+    in_quarantine: bool
+    metadata_key: Optional[str]
+    last_check: Optional[Check]
+    error_message: str
+
+    def as_dict(self) -> dict:
+        # In the format of a summarise_resource entry
+        resource_summary = {
+            "format": self.format,
+            "filename": self.filename,
+            "in_quarantine": self.in_quarantine,
+            "sheets": [],
+        }
+        if self.last_check is not None:
+            resource_summary["sheets"] = [x.summary() for x in self.last_check.sheets]
+            if self.metadata_key == "shape_info":
+                resource_summary["bounding_box"] = self.last_check.bounding_box
+        return resource_summary
+
+
+@dataclass(slots=True)
+class Schema:
+    header_hash: Optional[str]
+    sheet: str
+    headers: tuple
+    hxl_headers: Optional[tuple]
+    data_types: tuple
+    shared_with: list[str]
+
+    def as_dict(self) -> dict:
+        # In the format of a summarise_schema value, with fresh lists since callers annotate it
+        return {
+            "sheet": self.sheet,
+            "shared_with": list(self.shared_with),
+            "headers": list(self.headers),
+            "hxl_headers": None if self.hxl_headers is None else list(self.hxl_headers),
+            "data_types": list(self.data_types),
+        }
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import os
+import threading
+import time
+
+from concurrent.futures import Future
+from typing import Callable, Hashable, Optional
+
+import requests
+
+MAX_RETRIES = 4
+BACKOFF_SECONDS = 1.0
+MAX_BACKOFF_SECONDS = 60.0
+# After a 429 a lane runs at half speed, recovering by this fraction of its configured rate with
+# each successful request
+MIN_RATE_FACTOR = 1 / 16
+RECOVERY_STEP = 0.05
+
+
+class TokenBucket:
+    """A token bucket which lets callers go into debt rather than polling for tokens
+
+    reserve() takes the tokens at once and returns how long the caller should wait for the
+    bucket to refill, so concurrent callers queue up in the order they arrived.
+    """
+
+    def __init__(self, rate: Optional[float], capacity: Optional[float] = None):
+        self.rate = rate
+        if capacity is None:
+            capacity = max(rate, 1.0) if rate is not None else 0.0
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, n_tokens: float, rate_factor: float = 1.0) -> float:
+        if self.rate is None:
+            return 0.0
+        with self.lock:
+            now = time.monotonic()
+            rate = self.rate * rate_factor
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * rate)
+            self.updated = now
+            self.tokens -= n_tokens
+            return max(0.0, -self.tokens / rate)
+
+
+class Lane:
+    def __init__(
+        self,
+        name: str,
+        requests_per_second: Optional[float],
+        bytes_per_second: Optional[float] = None,
+    ):
+        self.name = name
+        self.requests = TokenBucket(requests_per_second)
+        self.bytes = TokenBucket(bytes_per_second)
+        self.rate_factor = 1.0
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.n_requests = 0
+        self.n_throttled = 0
+        self.n_bytes = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def wait_for_turn(self) -> float:
+        with self.lock:
+            self.queue_depth += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+            rate_factor = self.rate_factor
+            blocked_for = self.blocked_until - time.monotonic()
+
+        # Bytes already downloaded in this lane are paid for before the next request starts
+        wait = max(
+            self.requests.reserve(1, rate_factor), self.bytes.reserve(0, rate_factor), blocked_for
+        )
+        if wait > 0:
+            time.sleep(wait)
+        wait = max(wait, 0.0)
+
+        with self.lock:
+            self.queue_depth -= 1
+            self.n_requests += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+        return wait
+
+    def record_bytes(self, n_bytes: int):
+        with self.lock:
+            self.n_bytes += n_bytes
+            rate_factor = self.rate_factor
+        self.bytes.reserve(n_bytes, rate_factor)
+
+    def throttle(self, retry_after: float):
+        with self.lock:
+            self.n_throttled += 1
+            self.rate_factor = max(MIN_RATE_FACTOR, self.rate_factor / 2)
+            self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+
+    def recover(self):
+        with self.lock:
+            self.rate_factor = min(1.0, self.rate_factor + RECOVERY_STEP)
+
+    def metrics(self) -> dict:
+        with self.lock:
+            return {
+                "queue_depth": self.queue_depth,
+                "max_queue_depth": self.max_queue_depth,
+                "requests": self.n_requests,
+                "throttled": self.n_throttled,
+                "bytes": self.n_bytes,
+                "total_wait_seconds": round(self.total_wait, 3),
+                "max_wait_seconds": round(self.max_wait, 3),
+                "mean_wait_seconds": round(self.total_wait / max(self.n_requests, 1), 3),
+                "rate_factor": round(self.rate_factor, 3),
+            }
+
+
+class RequestScheduler:
+    """Rate limits GET and POST requests made through a shared session, by lane
+
+    Metadata calls and bulk downloads have separate lanes so a long preview download does not
+    hold up package_show and package_search. A 429 response halves the lane's rate and blocks it
+    for the Retry-After period before the request is retried.
+    """
+
+    def __init__(
+        self, session: requests.Session, lanes: dict[str, Lane], max_retries: int = MAX_RETRIES
+    ):
+        self.session = session
+        self.lanes = lanes
+        self.max_retries = max_retries
+
+    def get(self, lane_name: str, url: str, **kwargs) -> requests.Response:
+        return self.send(lane_name, "get", url, **kwargs)
+
+    def post(self, lane_name: str, url: str, **kwargs) -> requests.Response:
+        return self.send(lane_name, "post", url, **kwargs)
+
+    def send(self, lane_name: str, method: str, url: str, **kwargs) -> requests.Response:
+        lane = self.lanes[lane_name]
+        for attempt in range(self.max_retries + 1):
+            lane.wait_for_turn()
+            response = getattr(self.session, method)(url, **kwargs)
+            if response.status_code != 429:
+                lane.recover()
+                break
+            if attempt < self.max_retries:
+                lane.throttle(retry_after_seconds(response, attempt))
+                response.close()
+
+        # Streamed responses are counted by the caller as they are read
+        if lane.bytes.rate is not None and not kwargs.get("stream", False):
+            lane.record_bytes(len(response.content))
+        return response
+
+    def record_bytes(self, lane_name: str, n_bytes: int):
+        self.lanes[lane_name].record_bytes(n_bytes)
+
+    def metrics(self) -> dict[str, dict]:
+        return {k: v.metrics() for k, v in self.lanes.items()}
+
+
+class InFlightRequests:
+    """Lets concurrent callers asking for the same thing share one transfer
+
+    The first caller for a key runs the function. Callers arriving with the same key before it
+    finishes wait for it and get the same result, or the same exception.
+    """
+
+    def __init__(self):
+        self.calls: dict[Hashable, Future] = {}
+        self.lock = threading.Lock()
+        self.n_calls = 0
+        self.n_shared = 0
+
+    def run(self, key: Hashable, function: Callable, *args, **kwargs):
+        with self.lock:
+            future = self.calls.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = Future()
+                self.calls[key] = future
+                self.n_calls += 1
+            else:
+                self.n_shared += 1
+        if not is_leader:
+            return future.result()
+
+        try:
+            result = function(*args, **kwargs)
+        except BaseException as exception_:
+            future.set_exception(exception_)
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+        future.set_result(result)
+        return result
+
+    def metrics(self) -> dict:
+        with self.lock:
+            return {"in_flight": len(self.calls), "calls": self.n_calls, "shared": self.n_shared}
+
+
+def retry_after_seconds(response: requests.Response, attempt: int) -> float:
+    retry_after = response.headers.get("Retry-After", "")
+    if retry_after.isdigit():
+        return min(float(retry_after), MAX_BACKOFF_SECONDS)
+    return min(BACKOFF_SECONDS * 2**attempt, MAX_BACKOFF_SECONDS)
+
+
+def lane_from_environment(
+    name: str, requests_per_second: Optional[float], bytes_per_second: Optional[float] = None
+) -> Lane:
+    # e.g. HDX_SCHEMA_DOWNLOAD_BYTES_PER_SECOND=1000000, 0 removes a limit
+    for suffix in ["REQUESTS_PER_SECOND", "BYTES_PER_SECOND"]:
+        value = os.environ.get(f"HDX_SCHEMA_{name.upper()}_{suffix}")
+        if value is None:
+            continue
+        limit = float(value) if float(value) > 0 else None
+        if suffix == "REQUESTS_PER_SECOND":
+            requests_per_second = limit
+        else:
+            bytes_per_second = limit
+    return Lane(name, requests_per_second, bytes_per_second)
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import hashlib
+import re
+
+from random import Random
+from typing import Iterable, Optional
+
+from hdx_stable_schema.metadata_processor import resource_records, schema_records
+from hdx_stable_schema.records import Schema
+
+MERSENNE_PRIME = (1 << 61) - 1
+N_PERMUTATIONS = 128
+SIMILARITY_THRESHOLD = 0.5
+# The index's bands are chosen so a pair at the similarity threshold becomes a candidate at
+# least this often, pairs above it more often still
+LSH_MIN_RECALL = 0.85
+
+
+def normalise_header(header: Optional[str]) -> str:
+    if header is None:
+        return ""
+    return re.sub(r"[^0-9a-z]+", "_", header.lower()).strip("_")
+
+
+def normalise_hxl_header(hxl_header: Optional[str]) -> str:
+    # HXL attributes are unordered so #meta +id and #meta+id are the same tag
+    if hxl_header is None:
+        return ""
+    parts = [x for x in re.split(r"\s*\+\s*", hxl_header.strip().lower()) if x != ""]
+    if len(parts) == 0:
+        return ""
+    return "+".join([parts[0]] + sorted(parts[1:]))
+
+
+def schema_tokens(schema: dict | Schema) -> set[str]:
+    if isinstance(schema, Schema):
+        headers, hxl_headers = schema.headers, schema.hxl_headers
+    else:
+        headers, hxl_headers = schema["headers"], schema.get("hxl_headers")
+    tokens = {f"h:{normalise_header(x)}" for x in headers}
+    if hxl_headers is not None:
+        tokens.update(f"x:{normalise_hxl_header(x)}" for x in hxl_headers)
+    tokens.discard("h:")
+    tokens.discard("x:")
+    return tokens
+
+
+class MinHasher:
+    def __init__(self, n_permutations: int = N_PERMUTATIONS, seed: int = 1):
+        random = Random(seed)
+        self.permutations = [
+            (random.randrange(1, MERSENNE_PRIME), random.randrange(0, MERSENNE_PRIME))
+            for _ in range(n_permutations)
+        ]
+
+    def signature(self, tokens: Iterable[str]) -> tuple[int, ...]:
+        # blake2b rather than hash() so signatures are stable across processes
+        token_hashes = [
+            int.from_bytes(hashlib.blake2b(x.encode("utf-8"), digest_size=8).digest(), "big")
+            for x in tokens
+        ]
+        return tuple(
+            min(((a * x + b) % MERSENNE_PRIME for x in token_hashes), default=MERSENNE_PRIME)
+            for a, b in self.permutations
+        )
+
+
+def estimate_similarity(signature_a: tuple[int, ...], signature_b: tuple[int, ...]) -> float:
+    n_matches = sum(1 for a, b in zip(signature_a, signature_b) if a == b)
+    return n_matches / len(signature_a)
+
+
+class SchemaIndex:
+    """A locality-sensitive hashing index over MinHash signatures of schema headers
+
+    Signatures are split into n_bands bands of n_rows_per_band rows, schemas sharing any band
+    land in the same bucket and become candidates, so a query only touches its own buckets rather
+    than every schema in the index. The bands are sized for threshold, queries with a lower
+    threshold miss more of the pairs between the two.
+    """
+
+    def __init__(
+        self, threshold: float = SIMILARITY_THRESHOLD, n_permutations: int = N_PERMUTATIONS
+    ):
+        self.n_bands, self.n_rows_per_band = lsh_parameters(threshold, n_permutations)
+        self.minhasher = MinHasher(n_permutations=n_permutations)
+        self.buckets: dict[tuple, list[str]] = {}
+        self.signatures: dict[str, tuple[int, ...]] = {}
+        self.entries: dict[str, dict] = {}
+
+    def band_keys(self, signature: tuple[int, ...]) -> list[tuple]:
+        keys = []
+        for band in range(self.n_bands):
+            start = band * self.n_rows_per_band
+            stop = start + self.n_rows_per_band
+            keys.append((band, signature[start:stop]))
+        return keys
+
+    def add(self, key: str, schema: dict | Schema, entry: Optional[dict] = None) -> bool:
+        tokens = schema_tokens(schema)
+        if len(tokens) == 0 or key in self.signatures:
+            return False
+        signature = self.minhasher.signature(tokens)
+        self.signatures[key] = signature
+        self.entries[key] = entry if entry is not None else {}
+        for band_key in self.band_keys(signature):
+            self.buckets.setdefault(band_key, []).append(key)
+        return True
+
+    def candidates(self, signature: tuple[int, ...]) -> set[str]:
+        candidates = set()
+        for band_key in self.band_keys(signature):
+            candidates.update(self.buckets.get(band_key, []))
+        return candidates
+
+    def query(
+        self, schema: dict | Schema, threshold: float = SIMILARITY_THRESHOLD
+    ) -> list[tuple[str, float]]:
+        tokens = schema_tokens(schema)
+        if len(tokens) == 0:
+            return []
+        signature = self.minhasher.signature(tokens)
+        return self.query_signature(signature, threshold=threshold)
+
+    def query_signature(
+        self, signature: tuple[int, ...], threshold: float = SIMILARITY_THRESHOLD
+    ) -> list[tuple[str, float]]:
+        matches = []
+        for key in self.candidates(signature):
+            similarity = estimate_similarity(signature, self.signatures[key])
+            if similarity >= threshold:
+                matches.append((key, similarity))
+
+        return sorted(matches, key=lambda x: (-x[1], x[0]))
+
+
+def lsh_parameters(threshold: float, n_permutations: int = N_PERMUTATIONS) -> tuple[int, int]:
+    # (n_bands, n_rows_per_band). Bands of more rows give fewer false candidates but miss more
+    # pairs near the threshold, so the widest bands which still meet LSH_MIN_RECALL are used
+    n_bands, n_rows_per_band = n_permutations, 1
+    for n_rows in range(2, n_permutations + 1):
+        if n_permutations % n_rows != 0:
+            continue
+        if candidate_probability(threshold, n_permutations // n_rows, n_rows) < LSH_MIN_RECALL:
+            break
+        n_bands, n_rows_per_band = n_permutations // n_rows, n_rows
+    return n_bands, n_rows_per_band
+
+
+def candidate_probability(similarity: float, n_bands: int, n_rows_per_band: int) -> float:
+    # The chance that two signatures with this Jaccard similarity share at least one band
+    return 1 - (1 - similarity**n_rows_per_band) ** n_bands
+
+
+def build_schema_index(
+    metadata_list: Iterable[dict], threshold: float = SIMILARITY_THRESHOLD
+) -> SchemaIndex:
+    schema_index = SchemaIndex(threshold=threshold)
+    for metadata in metadata_list:
+        dataset_name = metadata["result"]["name"]
+        for header_hash, schema in schema_records(resource_records(metadata)).items():
+            schema_index.add(
+                f"{dataset_name}/{header_hash}",
+                schema,
+                entry={
+                    "dataset_name": dataset_name,
+                    "header_hash": header_hash,
+                    "sheet": schema.sheet,
+                    "shared_with": schema.shared_with,
+                },
+            )
+    return schema_index
+
+
+def group_similar_schemas(
+    schemas: dict, threshold: float = SIMILARITY_THRESHOLD
+) -> dict[str, list[tuple[str, float]]]:
+    schema_index = SchemaIndex(threshold=threshold)
+    for header_hash, schema in schemas.items():
+        schema_index.add(str(header_hash), schema)
+
+    similar_schemas = {}
+    for key, signature in schema_index.signatures.items():
+        similar_schemas[key] = [
+            x for x in schema_index.query_signature(signature, threshold=threshold) if x[0] != key
+        ]
+    return similar_schemas
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import datetime
+
+from typing import Optional
+
+from hdx_stable_schema.utilities import hash_row
+
+# Changes to these fields in a sheet-changed event alter the schema, nrows alone does not
+SCHEMA_CHANGE_FIELDS = {"header_hash", "hxl_header_hash", "ncols"}
+GROUPINGS = ["all", "format", "organization"]
+AGGREGATE_KEYS = [
+    "n_resources",
+    "n_stable",
+    "n_checks",
+    "n_changes",
+    "change_interval_seconds",
+    "n_change_intervals",
+]
+
+
+def new_stability_state() -> dict:
+    # JSON serialisable, resources holds what has been folded in for each resource and groups the
+    # materialized aggregates by format and organization, all of which are integer sums so they
+    # can be updated by subtracting a resource's old contribution and adding its new one
+    return {"resources": {}, "groups": {x: {} for x in GROUPINGS}}
+
+
+def update_stability(stability: dict, metadata: dict) -> int:
+    # Folds in the checks newer than those already seen and returns how many there were
+    dataset_name = metadata["result"]["name"]
+    organization = (metadata["result"].get("organization") or {}).get("name", "")
+    n_new_checks = 0
+    for resource in metadata["result"]["resources"]:
+        key = resource.get("id") or f"{dataset_name}/{resource['name']}"
+        state = stability["resources"].get(key)
+        if state is None:
+            state = new_resource_state(dataset_name, resource["name"])
+        old_groups = group_keys(state)
+        old_contribution = contribution(state)
+
+        n_resource_checks = fold_checks(state, resource)
+        state["format"] = resource["format"].upper()
+        state["organization"] = organization
+        if n_resource_checks == 0 and (old_contribution is None or group_keys(state) == old_groups):
+            continue
+        n_new_checks += n_resource_checks
+
+        if old_contribution is not None:
+            apply_contribution(stability["groups"], old_groups, old_contribution, -1)
+        apply_contribution(stability["groups"], group_keys(state), contribution(state), 1)
+        stability["resources"][key] = state
+
+    return n_new_checks
+
+
+def new_resource_state(dataset_name: str, resource_name: str) -> dict:
+    return {
+        "dataset": dataset_name,
+        "resource": resource_name,
+        "format": "",
+        "organization": "",
+        "n_checks": 0,
+        "n_changes": 0,
+        "last_check": None,
+        "first_change": None,
+        "last_change": None,
+        "shape_header_hash": None,
+    }
+
+
+def fold_checks(state: dict, resource: dict) -> int:
+    n_checks = 0
+    if "fs_check_info" in resource.keys():
+        for check in resource["fs_check_info"]:
+            if check["message"] != "File structure check completed":
+                continue
+            if state["last_check"] is not None and check["timestamp"] <= state["last_check"]:
+                continue
+            n_checks += 1
+            record_check(state, check["timestamp"], is_schema_change(check["sheet_changes"]))
+    elif "shape_info" in resource.keys():
+        for check in resource["shape_info"]:
+            if check["message"] != "Import successful":
+                continue
+            if state["last_check"] is not None and check["timestamp"] <= state["last_check"]:
+                continue
+            n_checks += 1
+            header_hash = hash_row([x["field_name"] for x in check["layer_fields"]])
+            is_change = state["shape_header_hash"] not in (None, header_hash)
+            state["shape_header_hash"] = header_hash
+            record_check(state, check["timestamp"], is_change)
+
+    return n_checks
+
+
+def record_check(state: dict, timestamp: str, is_change: bool):
+    state["n_checks"] += 1
+    state["last_check"] = timestamp
+    if is_change:
+        state["n_changes"] += 1
+        if state["first_change"] is None:
+            state["first_change"] = timestamp
+        state["last_change"] = timestamp
+
+
+def is_schema_change(sheet_changes: list[dict]) -> bool:
+    for change in sheet_changes:
+        if change["event_type"] != "spreadsheet-sheet-changed":
+            return True
+        if any(x["field"] in SCHEMA_CHANGE_FIELDS for x in change.get("changed_fields", [])):
+            return True
+    return False
+
+
+def contribution(state: dict) -> Optional[dict]:
+    if state["n_checks"] == 0:
+        return None
+    change_interval_seconds = 0
+    if state["n_changes"] >= 2:
+        change_interval_seconds = seconds_between(state["first_change"], state["last_change"])
+    return {
+        "n_resources": 1,
+        "n_stable": 1 if state["n_changes"] == 0 else 0,
+        "n_checks": state["n_checks"],
+        "n_changes": state["n_changes"],
+        "change_interval_seconds": change_interval_seconds,
+        "n_change_intervals": max(state["n_changes"] - 1, 0),
+    }
+
+
+def group_keys(state: dict) -> dict[str, str]:
+    return {"all": "all", "format": state["format"], "organization": state["organization"]}
+
+
+def apply_contribution(groups: dict, keys: dict[str, str], resource_contribution, sign: int):
+    if resource_contribution is None:
+        return
+    for grouping, key in keys.items():
+        aggregate = groups[grouping].setdefault(key, {x: 0 for x in AGGREGATE_KEYS})
+        for name in AGGREGATE_KEYS:
+            aggregate[name] += sign * resource_contribution[name]
+        if aggregate["n_resources"] == 0:
+            del groups[grouping][key]
+
+
+def stability_metrics(aggregate: dict) -> dict:
+    n_resources = max(aggregate["n_resources"], 1)
+    mean_days_between_changes = None
+    if aggregate["n_change_intervals"] != 0:
+        mean_days_between_changes = (
+            aggregate["change_interval_seconds"] / aggregate["n_change_intervals"] / 86400
+        )
+    return {
+        "resources": aggregate["n_resources"],
+        "stable_share": aggregate["n_stable"] / n_resources,
+        "changes_per_resource": aggregate["n_changes"] / n_resources,
+        "changes_per_check": aggregate["n_changes"] / max(aggregate["n_checks"], 1),
+        "mean_days_between_changes": mean_days_between_changes,
+    }
+
+
+def stability_rows(stability: dict, grouping: str) -> list[dict]:
+    rows = []
+    groups = stability["groups"][grouping]
+    for key in sorted(groups, key=lambda x: -groups[x]["n_resources"]):
+        metrics = stability_metrics(groups[key])
+        mean_days = metrics["mean_days_between_changes"]
+        rows.append(
+            {
+                grouping.capitalize(): key,
+                "Resources": str(metrics["resources"]),
+                "Stable": f"{100 * metrics['stable_share']:.1f}%",
+                "Changes/resource": f"{metrics['changes_per_resource']:.2f}",
+                "Changes/check": f"{metrics['changes_per_check']:.3f}",
+                "Days between changes": "N/A" if mean_days is None else f"{mean_days:.1f}",
+            }
+        )
+    return rows
+
+
+def seconds_between(start: str, end: str) -> int:
+    delta = datetime.datetime.fromisoformat(end) - datetime.datetime.fromisoformat(start)
+    return int(delta.total_seconds())
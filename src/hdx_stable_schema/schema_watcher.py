@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+from typing import Optional
+
+from hdx_stable_schema.metadata_processor import (
+    search_datasets,
+    resource_records,
+    schema_records,
+    get_last_complete_check,
+    MAX_SEARCH_ROWS,
+)
+
+WATCH_INTERVAL = 300
+
+
+def new_watch_state() -> dict:
+    # JSON serialisable so a watch can be resumed from a file
+    return {"since": None, "datasets": {}}
+
+
+def watch_query(dataset_names: list[str], since: Optional[str] = None) -> str:
+    # Dataset ids and names are both accepted in the watch list
+    quoted_names = " OR ".join(f'"{x}"' for x in dataset_names)
+    fq = f"(id:({quoted_names}) OR name:({quoted_names}))"
+    if since is not None:
+        # CKAN records metadata_modified as naive UTC with microseconds, Solr wants a Z suffix.
+        # Truncating to the second makes the range inclusive of the last dataset we saw, which
+        # is skipped if its metadata_modified has not moved on
+        fq += f" AND metadata_modified:[{since[0:19]}Z TO *]"
+    return fq
+
+
+def poll_watched_datasets(dataset_names: list[str], watch_state: dict) -> tuple[list[dict], int]:
+    # Returns the change events since the last poll and the number of package_search requests,
+    # which is one unless more than MAX_SEARCH_ROWS watched datasets changed at once. The query
+    # names every watched dataset so it is POSTed, however long the watch list
+    fq = watch_query(dataset_names, since=watch_state["since"])
+    changed_datasets = []
+    n_requests = 0
+    while n_requests * MAX_SEARCH_ROWS < len(dataset_names):
+        page = search_datasets(
+            fq, rows=MAX_SEARCH_ROWS, start=n_requests * MAX_SEARCH_ROWS, sort="id asc", post=True
+        )
+        n_requests += 1
+        changed_datasets.extend(page)
+        if len(page) < MAX_SEARCH_ROWS:
+            break
+
+    events = []
+    watched = set(dataset_names)
+    for metadata in changed_datasets:
+        result = metadata["result"]
+        key = result["id"] if result["id"] in watched else result["name"]
+        previous = watch_state["datasets"].get(key)
+        if previous is not None and previous["metadata_modified"] == result["metadata_modified"]:
+            continue
+
+        snapshot = snapshot_dataset(metadata)
+        # The first sighting of a dataset is the baseline, it is not reported
+        if previous is not None:
+            events.extend(header_hash_events(previous, snapshot))
+            events.extend(sheet_change_events(previous, metadata))
+        watch_state["datasets"][key] = snapshot
+        if watch_state["since"] is None or result["metadata_modified"] > watch_state["since"]:
+            watch_state["since"] = result["metadata_modified"]
+
+    return events, n_requests
+
+
+def snapshot_dataset(metadata: dict) -> dict:
+    header_hashes = {}
+    for header_hash, schema in schema_records(resource_records(metadata)).items():
+        for resource_name in schema.shared_with:
+            header_hashes.setdefault(resource_name, {})[schema.sheet] = str(header_hash)
+
+    checked_at = {}
+    for resource in metadata["result"]["resources"]:
+        check, error_message = get_last_complete_check(resource, "fs_check_info")
+        if error_message == "Success":
+            checked_at[resource["name"]] = check["timestamp"]
+
+    return {
+        "name": metadata["result"]["name"],
+        "metadata_modified": metadata["result"]["metadata_modified"],
+        "header_hashes": header_hashes,
+        "checked_at": checked_at,
+    }
+
+
+def header_hash_events(previous: dict, current: dict) -> list[dict]:
+    events = []
+    resource_names = list(previous["header_hashes"])
+    resource_names.extend(x for x in current["header_hashes"] if x not in previous["header_hashes"])
+    for resource_name in resource_names:
+        old_sheets = previous["header_hashes"].get(resource_name, {})
+        new_sheets = current["header_hashes"].get(resource_name, {})
+        sheet_names = list(old_sheets) + [x for x in new_sheets if x not in old_sheets]
+        for sheet_name in sheet_names:
+            old_hash = old_sheets.get(sheet_name)
+            new_hash = new_sheets.get(sheet_name)
+            if old_hash == new_hash:
+                continue
+            if old_hash is None:
+                event, detail = "header_hash added", new_hash
+            elif new_hash is None:
+                event, detail = "header_hash removed", old_hash
+            else:
+                event, detail = "header_hash changed", f"{old_hash} -> {new_hash}"
+            events.append(make_event(current["name"], resource_name, sheet_name, event, detail))
+
+    return events
+
+
+def sheet_change_events(previous: dict, metadata: dict) -> list[dict]:
+    # Only resources with an earlier check are reported, a new resource is covered by the
+    # header_hash events
+    events = []
+    for resource in metadata["result"]["resources"]:
+        last_checked_at = previous["checked_at"].get(resource["name"])
+        if last_checked_at is None:
+            continue
+        for check in resource["fs_check_info"]:
+            if check["message"] != "File structure check completed":
+                continue
+            if check["timestamp"] <= last_checked_at:
+                continue
+            for change in check["sheet_changes"]:
+                detail = ", ".join(
+                    f"{x['field']}: {x['old_display_value']} -> {x['new_display_value']}"
+                    for x in change.get("changed_fields", [])
+                )
+                events.append(
+                    make_event(
+                        metadata["result"]["name"],
+                        resource["name"],
+                        change["name"],
+                        change["event_type"],
+                        detail,
+                    )
+                )
+
+    return events
+
+
+def make_event(dataset_name: str, resource_name: str, sheet: str, event: str, detail: str) -> dict:
+    return {
+        "Dataset": dataset_name,
+        "Resource": resource_name,
+        "Sheet": sheet,
+        "Event": event,
+        "Detail": detail,
+    }
@@ -1,17 +1,68 @@
 #!/usr/bin/env python
 # encoding: utf-8
 
+import contextlib
 import datetime
+import hashlib
+import io
 import math
 import dataclasses
+import re
 import sys
 
+from collections import OrderedDict
 from pathlib import Path
-from typing import Optional
+from typing import Iterator, Optional
 
 import click
 import requests
 
+from hdx_stable_schema.request_scheduler import (
+    InFlightRequests,
+    RequestScheduler,
+    lane_from_environment,
+)
+
+# A single session keeps connections to data.humdata.org alive between requests, which matters
+# most when the process is long-lived (see daemon.py)
+HTTP_SESSION = requests.Session()
+
+# HDX does not publish rate limits so these are deliberately modest, they can be changed with
+# HDX_SCHEMA_METADATA_REQUESTS_PER_SECOND, HDX_SCHEMA_DOWNLOAD_BYTES_PER_SECOND and so on
+METADATA_REQUESTS_PER_SECOND = 5.0
+DOWNLOAD_REQUESTS_PER_SECOND = 2.0
+DOWNLOAD_BYTES_PER_SECOND = None
+REQUEST_SCHEDULER = RequestScheduler(
+    HTTP_SESSION,
+    {
+        "metadata": lane_from_environment("metadata", METADATA_REQUESTS_PER_SECOND),
+        "download": lane_from_environment(
+            "download", DOWNLOAD_REQUESTS_PER_SECOND, DOWNLOAD_BYTES_PER_SECOND
+        ),
+    },
+)
+
+# Resources in a dataset often point at the same file, concurrent fetches of it share one transfer
+IN_FLIGHT_DOWNLOADS = InFlightRequests()
+
+# Whole downloads are only kept by the daemon (see daemon.py), where a later command may ask for
+# the same file. One-shot commands stream what they can and keep nothing
+CACHE_DOWNLOADS = False
+DOWNLOAD_CACHE: OrderedDict[str, bytes] = OrderedDict()
+DOWNLOAD_CACHE_MAX_BYTES = 256 * 1024 * 1024
+STREAM_CHUNK_BYTES = 65536
+# The first bytes of recently sniffed files, with a flag saying if that is the whole file, so a
+# following full download only needs to fetch the remainder
+PREFIX_CACHE: OrderedDict[str, tuple[bytes, bool]] = OrderedDict()
+PREFIX_CACHE_MAX_ENTRIES = 64
+PREFIX_CACHE_MAX_BYTES = 16 * 1024 * 1024
+# Downloads to file print their name and a progress bar unless run in the background
+SHOW_DOWNLOAD_PROGRESS = True
+
+WHITESPACE_PATTERN = re.compile(r"\s+", re.MULTILINE)
+MEMORY_SIZE_PATTERN = re.compile(r"^(\d+(?:\.\d+)?)\s*([KMG]?)I?B?$", re.IGNORECASE)
+MEMORY_SIZE_UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3}
+
 
 # This is borrowed from:
 # https://github.com/OCHA-DAP/hdx-cli-toolkit/blob/main/src/hdx_cli_toolkit/utilities.py
@@ -156,6 +207,22 @@ def print_dictionary(dictionary: dict, truncate_width: int = 100):
 # Basis borrowed from
 # https://stackoverflow.com/a/15645088/19172
 def download_from_url(url: str, filename: Optional[str] = None) -> tuple[Path, str]:
+    return IN_FLIGHT_DOWNLOADS.run(("file", url, filename), transfer_to_file, url, filename)
+
+
+@contextlib.contextmanager
+def quiet_downloads() -> Iterator[None]:
+    # pylint: disable=global-statement
+    global SHOW_DOWNLOAD_PROGRESS
+    show_download_progress = SHOW_DOWNLOAD_PROGRESS
+    SHOW_DOWNLOAD_PROGRESS = False
+    try:
+        yield
+    finally:
+        SHOW_DOWNLOAD_PROGRESS = show_download_progress
+
+
+def transfer_to_file(url: str, filename: Optional[str] = None) -> tuple[Path, str]:
     download_directory = Path(__file__).parent / "downloads"
     Path(download_directory).mkdir(parents=True, exist_ok=True)
     error_message = "Success"
@@ -166,22 +233,240 @@ def download_from_url(url: str, filename: Optional[str] = None) -> tuple[Path, s
 
     try:
         with open(download_file_path, "wb") as output_file:
-            print(f"Downloading {filename}", flush=True)
-            response = requests.get(url, stream=True)
+            if SHOW_DOWNLOAD_PROGRESS:
+                print(f"Downloading {filename}", flush=True)
+            response = REQUEST_SCHEDULER.get("download", url, stream=True, timeout=60)
             total_length = response.headers.get("content-length")
-
-            if total_length is None:  # no content length header
-                output_file.write(response.content)
-            else:
-                dl = 0
-                total_length = int(total_length)
-                for data in response.iter_content(chunk_size=4096):
-                    dl += len(data)
-                    output_file.write(data)
-                    done = int(50 * dl / total_length)
+            # The file is always written as it arrives, only the progress bar is optional
+            show_progress = total_length is not None and SHOW_DOWNLOAD_PROGRESS
+
+            dl = 0
+            for data in response.iter_content(chunk_size=STREAM_CHUNK_BYTES):
+                dl += len(data)
+                output_file.write(data)
+                if show_progress:
+                    done = int(50 * dl / int(total_length))
                     sys.stdout.write("\r[%s%s]" % ("=" * done, " " * (50 - done)))
                     sys.stdout.flush()
+            REQUEST_SCHEDULER.record_bytes("download", dl)
     except OSError:
         error_message = f"{download_file_path} is not a valid file path"
 
     return download_file_path, error_message
+
+
+def fetch_bytes(url: str) -> bytes:
+    return IN_FLIGHT_DOWNLOADS.run(("bytes", url), transfer_bytes, url)
+
+
+def transfer_bytes(url: str) -> bytes:
+    if url in DOWNLOAD_CACHE:
+        DOWNLOAD_CACHE.move_to_end(url)
+        return DOWNLOAD_CACHE[url]
+
+    prefix, is_complete = PREFIX_CACHE.pop(url, (b"", False))
+    if is_complete:
+        content = prefix
+    elif len(prefix) != 0:
+        response = REQUEST_SCHEDULER.get(
+            "download", url, headers={"Range": f"bytes={len(prefix)}-"}, timeout=60
+        )
+        response.raise_for_status()
+        # A server which ignores Range sends the whole file with a 200
+        content = prefix + response.content if response.status_code == 206 else response.content
+    else:
+        response = REQUEST_SCHEDULER.get("download", url, timeout=60)
+        response.raise_for_status()
+        content = response.content
+
+    if CACHE_DOWNLOADS and len(content) <= DOWNLOAD_CACHE_MAX_BYTES:
+        DOWNLOAD_CACHE[url] = content
+        while download_cache_size() > DOWNLOAD_CACHE_MAX_BYTES:
+            DOWNLOAD_CACHE.popitem(last=False)
+
+    return content
+
+
+class ResponseStream(io.RawIOBase):
+    """A readable file over a streamed response, so readers such as pandas.read_csv hold only
+    the chunk in hand rather than the whole body. Bytes are counted against the lane as they arrive.
+    A prefix already held is served ahead of the response
+    """
+
+    def __init__(
+        self, response: requests.Response, lane_name: str = "download", prefix: bytes = b""
+    ):
+        super().__init__()
+        self.response = response
+        self.lane_name = lane_name
+        self.chunks = response.iter_content(chunk_size=STREAM_CHUNK_BYTES)
+        self.chunk = prefix
+        self.offset = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while self.offset == len(self.chunk):
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                return 0
+            REQUEST_SCHEDULER.record_bytes(self.lane_name, len(chunk))
+            self.chunk, self.offset = chunk, 0
+        n_bytes = min(len(buffer), len(self.chunk) - self.offset)
+        start = self.offset
+        stop = start + n_bytes
+        buffer[0:n_bytes] = self.chunk[start:stop]
+        self.offset = stop
+        return n_bytes
+
+    def close(self):
+        self.response.close()
+        super().close()
+
+
+def open_url_stream(url: str) -> io.BufferedReader | io.BytesIO:
+    # A file-like view of a download, read as it arrives. Bodies already held are reused, and the
+    # daemon fetches the whole body so it can be cached for later commands
+    if CACHE_DOWNLOADS or url in DOWNLOAD_CACHE:
+        return io.BytesIO(fetch_bytes(url))
+    prefix, is_complete = PREFIX_CACHE.get(url, (b"", False))
+    if is_complete:
+        return io.BytesIO(prefix)
+    if len(prefix) == 0:
+        response = REQUEST_SCHEDULER.get("download", url, stream=True, timeout=60)
+    else:
+        response = REQUEST_SCHEDULER.get(
+            "download", url, headers={"Range": f"bytes={len(prefix)}-"}, stream=True, timeout=60
+        )
+    response.raise_for_status()
+    # A server which ignores Range sends the whole file with a 200
+    if response.status_code != 206:
+        prefix = b""
+    return io.BufferedReader(ResponseStream(response, prefix=prefix))
+
+
+def fetch_prefix(url: str, n_bytes: int, cache: bool = True) -> tuple[bytes, bool]:
+    # Returns up to n_bytes from the start of a URL or local file, and whether that is all of it.
+    # With cache=False the prefix is not kept, for reads sized to a memory budget
+    return IN_FLIGHT_DOWNLOADS.run(("prefix", url, n_bytes), transfer_prefix, url, n_bytes, cache)
+
+
+def transfer_prefix(url: str, n_bytes: int, cache: bool = True) -> tuple[bytes, bool]:
+    if not url.startswith(("http://", "https://")):
+        with open(url, "rb") as local_file:
+            prefix = local_file.read(n_bytes + 1)
+        return prefix[0:n_bytes], len(prefix) <= n_bytes
+
+    if url in DOWNLOAD_CACHE:
+        return DOWNLOAD_CACHE[url][0:n_bytes], len(DOWNLOAD_CACHE[url]) <= n_bytes
+    if url in PREFIX_CACHE and len(PREFIX_CACHE[url][0]) >= n_bytes:
+        prefix, is_complete = PREFIX_CACHE[url]
+        return prefix[0:n_bytes], is_complete and len(prefix) <= n_bytes
+
+    response = REQUEST_SCHEDULER.get(
+        "download", url, headers={"Range": f"bytes=0-{n_bytes - 1}"}, stream=True, timeout=60
+    )
+    response.raise_for_status()
+    # Joined once at the end, adding each chunk to a bytes object copies everything so far
+    chunks = []
+    n_received = 0
+    for chunk in response.iter_content(chunk_size=16384):
+        chunks.append(chunk)
+        n_received += len(chunk)
+        if n_received > n_bytes:
+            break
+    response.close()
+    prefix = b"".join(chunks)
+    REQUEST_SCHEDULER.record_bytes("download", len(prefix))
+
+    if response.status_code == 206:
+        content_range = response.headers.get("Content-Range", "")
+        total_length = content_range.rpartition("/")[2]
+        is_complete = total_length.isdigit() and int(total_length) <= n_bytes
+    else:
+        is_complete = len(prefix) <= n_bytes
+    prefix = prefix[0:n_bytes]
+
+    if cache and len(prefix) <= PREFIX_CACHE_MAX_BYTES:
+        PREFIX_CACHE[url] = (prefix, is_complete)
+        while len(PREFIX_CACHE) > PREFIX_CACHE_MAX_ENTRIES or (
+            prefix_cache_size() > PREFIX_CACHE_MAX_BYTES
+        ):
+            PREFIX_CACHE.popitem(last=False)
+
+    return prefix, is_complete
+
+
+def fetch_range(url: str, start: int, stop: Optional[int] = None) -> tuple[bytes, int]:
+    # Returns bytes start:stop of a URL and the total length of the file. A negative start with
+    # no stop is a suffix, e.g. the last 1000 bytes with start=-1000
+    return IN_FLIGHT_DOWNLOADS.run(("range", url, start, stop), transfer_range, url, start, stop)
+
+
+def transfer_range(url: str, start: int, stop: Optional[int] = None) -> tuple[bytes, int]:
+    if not url.startswith(("http://", "https://")):
+        with open(url, "rb") as local_file:
+            total_length = local_file.seek(0, 2)
+            local_file.seek(max(start, -total_length), 0 if start >= 0 else 2)
+            n_bytes = -1 if stop is None else stop - local_file.tell()
+            return local_file.read(n_bytes), total_length
+
+    if url in DOWNLOAD_CACHE:
+        content = DOWNLOAD_CACHE[url]
+        return content[start:stop], len(content)
+
+    if stop is None:
+        byte_range = f"bytes={start}" if start < 0 else f"bytes={start}-"
+    else:
+        byte_range = f"bytes={start}-{stop - 1}"
+    response = REQUEST_SCHEDULER.get("download", url, headers={"Range": byte_range}, timeout=60)
+    response.raise_for_status()
+    if response.status_code != 206:
+        # The server ignored the Range header and sent the whole file
+        return response.content[start:stop], len(response.content)
+
+    total_length = response.headers.get("Content-Range", "").rpartition("/")[2]
+    if not total_length.isdigit():
+        raise ValueError(f"Content-Range with no total length from {url}")
+    return response.content, int(total_length)
+
+
+def fetch_size(url: str) -> int:
+    # The length of a URL or local file, from a one byte Range request for remote files
+    if not url.startswith(("http://", "https://")):
+        return Path(url).stat().st_size
+    _, total_length = fetch_range(url, 0, 1)
+    return total_length
+
+
+def download_cache_size() -> int:
+    return sum(len(x) for x in DOWNLOAD_CACHE.values())
+
+
+def prefix_cache_size() -> int:
+    return sum(len(x[0]) for x in PREFIX_CACHE.values())
+
+
+def parse_memory_size(value: str) -> int:
+    # e.g. 512M, 2G, 64KB or a plain number of bytes
+    match = MEMORY_SIZE_PATTERN.match(value.strip())
+    if match is None:
+        raise ValueError(f"Could not read '{value}' as a memory size, use e.g. 512M or 2G")
+    return int(float(match.group(1)) * MEMORY_SIZE_UNITS[match.group(2).upper()])
+
+
+# hash_row and normalise_space are vendored from libhxl (hxl.input and hxl.datatypes) so that
+# the metadata-only commands can compute header hashes without importing hxl
+def hash_row(row: list) -> str:
+    md5 = hashlib.md5()
+    for value in row:
+        md5.update(normalise_space(value).encode("utf-8"))
+    return md5.hexdigest()
+
+
+def normalise_space(value) -> str:
+    if value is None or value == "" or str(value).isspace():
+        return ""
+    value = str(value).strip().replace("\n", " ")
+    return WHITESPACE_PATTERN.sub(" ", value)
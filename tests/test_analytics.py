@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+from collections import Counter
+from pathlib import Path
+
+import pytest
+
+from hdx_stable_schema.analytics import (
+    Report,
+    load_report,
+    run_analytics,
+    column_count_label,
+    quarter,
+    REPORTS,
+)
+from hdx_stable_schema.metadata_archive import MetadataArchiveWriter
+from hdx_stable_schema.metadata_processor import read_metadata_from_directory
+
+FIXTURES_DIRECTORY = Path(__file__).parent / "fixtures"
+
+
+class OrganizationsReport(Report):
+    name = "organizations"
+    title = "Datasets by organization"
+
+    def count(self, metadata: dict, counter: Counter):
+        counter[metadata["result"]["organization"]["name"]] += 1
+
+
+def test_run_analytics_in_parallel():
+    reports = list(REPORTS.values())
+
+    n_datasets, serial_totals = run_analytics(FIXTURES_DIRECTORY, reports, n_workers=1)
+    assert n_datasets == 13
+    assert serial_totals["formats"]["CSV"] == 46
+    assert sum(serial_totals["column_counts"].values()) == 28
+    assert serial_totals["schema_changes"][("2024-Q3", "XLSX", "resources")] == 3
+
+    n_datasets, parallel_totals = run_analytics(
+        FIXTURES_DIRECTORY, reports, n_workers=2, shard_size=1
+    )
+    assert n_datasets == 13
+    assert parallel_totals == serial_totals
+
+
+def test_run_analytics_over_archive_blocks(tmp_path):
+    archive_path = tmp_path / "hdx.ndjson.gz"
+    with MetadataArchiveWriter(archive_path, block_size=2) as writer:
+        for metadata in read_metadata_from_directory(FIXTURES_DIRECTORY):
+            writer.add(metadata)
+
+    report = load_report("test_analytics:OrganizationsReport")
+    n_datasets, totals = run_analytics(archive_path, [report], n_workers=2, shard_size=2)
+
+    assert n_datasets == 13
+    assert sum(totals["organizations"].values()) == 13
+    assert report.rows(totals["organizations"])[0]["Key"] != ""
+
+
+def test_report_without_count_is_rejected():
+    class UncountedReport(Report):
+        name = "uncounted"
+
+    with pytest.raises(TypeError):
+        UncountedReport()
+
+
+def test_labels():
+    assert [column_count_label(i) for i in range(4)] == ["0-1", "2", "3-5", "6-10"]
+    assert column_count_label(7) == ">100"
+    assert quarter("2024-07-22") == "2024-Q3"
+    assert quarter("2024-12-31") == "2024-Q4"
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+from collections import OrderedDict
+from pathlib import Path
+
+import pandas
+
+import hdx_stable_schema.utilities
+
+from hdx_stable_schema.column_profiler import (
+    HyperLogLog,
+    FrequentValues,
+    profile_resource,
+    add_statistics_to_schema,
+)
+from hdx_stable_schema.data_preview import iter_dataframe_chunks_from_hdx
+from hdx_stable_schema.metadata_processor import read_metadata_from_file
+from hdx_stable_schema.request_scheduler import Lane
+
+HEALTHSITES_FILE_PATH = Path(__file__).parent / "fixtures" / "2024-12-09-gibraltar-healthsites.json"
+SAMPLE_HXL_FILE_PATH = (
+    Path(__file__).parent / "fixtures" / "2024-12-09-gibraltar-healthsites-sample-hxl.csv"
+)
+
+METADATA = read_metadata_from_file(HEALTHSITES_FILE_PATH)
+SAMPLE_HXL_RESOURCE_METADATA = {
+    **METADATA["result"]["resources"][0],
+    "download_url": str(SAMPLE_HXL_FILE_PATH),
+}
+
+
+def test_hyperloglog_estimate():
+    hyperloglog = HyperLogLog()
+    for start in range(0, 100000, 10000):
+        hyperloglog.update(pandas.Series(range(start, start + 10000)))
+    # Re-adding values should not change the estimate
+    hyperloglog.update(pandas.Series(range(0, 10000)))
+
+    assert abs(hyperloglog.estimate() - 100000) < 3000
+
+
+def test_hyperloglog_merge():
+    left = HyperLogLog()
+    right = HyperLogLog()
+    left.update(pandas.Series(range(0, 600)))
+    right.update(pandas.Series(range(400, 1000)))
+    left.merge(right)
+
+    assert abs(left.estimate() - 1000) < 30
+
+
+def test_frequent_values_bounded():
+    frequent = FrequentValues(capacity=5)
+    for _ in range(10):
+        frequent.update(pandas.Series(["common"] * 50 + [f"rare-{i}" for i in range(100)]))
+
+    assert len(frequent.counts) <= 5
+    assert frequent.top(1)[0][0] == "common"
+
+
+def test_profile_resource():
+    profiles, error_message = profile_resource(SAMPLE_HXL_RESOURCE_METADATA, chunksize=2)
+
+    assert error_message == "Success"
+    assert list(profiles.keys())[0:3] == ["X", "Y", "osm_id"]
+    assert profiles["osm_id"].as_statistics() == {
+        "Nulls": "0",
+        "Distinct": "~4",
+        "Min": "2465538131",
+        "Max": "10956361305",
+        "Top values": "10956361305, 2465538131, 4815040917",
+    }
+    assert profiles["operator"].n_nulls == 3
+    assert profiles["osm_type"].frequent.top(1) == [("node", 3)]
+
+
+def test_add_statistics_to_schema():
+    profiles, _ = profile_resource(SAMPLE_HXL_RESOURCE_METADATA)
+    schema = {"headers": list(profiles.keys())}
+    add_statistics_to_schema(schema, profiles)
+
+    assert len(schema["statistics"]) == len(profiles)
+    assert schema["statistics"][3]["Top values"].startswith("node")
+
+    mismatched_schema = {"headers": ["a"]}
+    add_statistics_to_schema(mismatched_schema, profiles)
+    assert "statistics" not in mismatched_schema
+
+
+class FakeStreamedResponse:
+    def __init__(self, body, status_code, headers, bytes_served):
+        self.body = body
+        self.status_code = status_code
+        self.headers = headers
+        self.bytes_served = bytes_served
+
+    @property
+    def content(self):
+        self.bytes_served.append(len(self.body))
+        return self.body
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size=1):
+        for start in range(0, len(self.body), chunk_size):
+            stop = start + chunk_size
+            self.bytes_served.append(len(self.body[start:stop]))
+            yield self.body[start:stop]
+
+    def close(self):
+        pass
+
+
+def test_iter_dataframe_chunks_streams_remote_csv(monkeypatch):
+    file_content = b"id,name,value\n" + b"".join(
+        f"{i},Name {i},{i * 0.5}\n".encode("utf-8") for i in range(300000)
+    )
+    bytes_served = []
+
+    def fake_get(url, headers=None, stream=False, timeout=None):
+        if headers is not None and "Range" in headers:
+            first, _, last = headers["Range"].removeprefix("bytes=").partition("-")
+            if last == "":
+                # The remainder after the sniffed prefix
+                start = int(first)
+                return FakeStreamedResponse(file_content[start:], 206, {}, bytes_served)
+            stop = int(last) + 1
+            return FakeStreamedResponse(
+                file_content[0:stop],
+                206,
+                {"Content-Range": f"bytes 0-{stop - 1}/{len(file_content)}"},
+                [],
+            )
+        return FakeStreamedResponse(file_content, 200, {}, bytes_served)
+
+    monkeypatch.setattr(hdx_stable_schema.utilities.HTTP_SESSION, "get", fake_get)
+    monkeypatch.setattr(hdx_stable_schema.utilities, "DOWNLOAD_CACHE", OrderedDict())
+    monkeypatch.setattr(hdx_stable_schema.utilities, "PREFIX_CACHE", OrderedDict())
+    monkeypatch.setattr(hdx_stable_schema.utilities, "CACHE_DOWNLOADS", False)
+    monkeypatch.setitem(
+        hdx_stable_schema.utilities.REQUEST_SCHEDULER.lanes, "download", Lane("download", None)
+    )
+    resource_metadata = {
+        "name": "large.csv",
+        "format": "CSV",
+        "download_url": "https://data.humdata.org/large.csv",
+    }
+
+    chunks = iter_dataframe_chunks_from_hdx(resource_metadata, None, chunksize=1000)
+    first_chunk = next(chunks)
+
+    assert len(first_chunk) == 1000
+    # The first chunk arrives long before the whole file has been read
+    assert sum(bytes_served) < len(file_content) / 4
+    assert sum(len(x) for x in chunks) == 299000
+    assert len(hdx_stable_schema.utilities.DOWNLOAD_CACHE) == 0
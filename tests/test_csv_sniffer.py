@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import codecs
+
+from hdx_stable_schema.csv_sniffer import sniff_csv
+
+SAMPLE_TEXT = "country,admin1,population\nMali,Kayes,2500000\nMali,Sikasso,3100000\n"
+
+
+def test_sniff_csv_defaults():
+    dialect = sniff_csv(SAMPLE_TEXT.encode("utf-8"), is_complete=True)
+
+    assert dialect == {
+        "encoding": "utf-8",
+        "bom": False,
+        "delimiter": ",",
+        "quotechar": '"',
+        "header_row": 0,
+    }
+
+
+def test_sniff_csv_byte_order_marks():
+    assert sniff_csv(codecs.BOM_UTF8 + SAMPLE_TEXT.encode("utf-8"))["encoding"] == "utf-8-sig"
+
+    dialect = sniff_csv(SAMPLE_TEXT.encode("utf-16"), is_complete=True)
+    assert dialect["encoding"] == "utf-16"
+    assert dialect["bom"]
+    assert dialect["delimiter"] == ","
+
+
+def test_sniff_csv_cp1252_semicolons_and_preamble():
+    text = (
+        "Données humanitaires;;\n"
+        "Source: OCHA;;\n"
+        "pays;région;population\n"
+        "Côte d'Ivoire;Abidjan;6321017\n"
+        "Sénégal;Dakar;4042225\n"
+        '"Mali; Nord";Gao;"656,263"\n'
+    )
+    dialect = sniff_csv(text.encode("cp1252"), is_complete=True)
+
+    assert dialect["encoding"] == "cp1252"
+    assert dialect["delimiter"] == ";"
+    assert dialect["quotechar"] == '"'
+    assert dialect["header_row"] == 2
+
+
+def test_sniff_csv_sparse_header():
+    text = "id,,,\n1,Mali,Kayes,2500000\n2,Mali,Gao,600000\n"
+
+    assert sniff_csv(text.encode("utf-8"), is_complete=True)["header_row"] == 0
+
+
+def test_sniff_csv_never_picks_hashtag_row():
+    text = (
+        "country,,\n" "#country,#adm1+name,#population\n" "Mali,Kayes,2500000\n" "Mali,Gao,600000\n"
+    )
+
+    assert sniff_csv(text.encode("utf-8"), is_complete=True)["header_row"] == 0
+
+
+def test_sniff_csv_truncated_prefix():
+    prefix = ("name,city\n" + "Zoé,Genève\n" * 10).encode("utf-8")
+    # Cut the prefix part way through the two byte è
+    cut = prefix.rindex("è".encode("utf-8")) + 1
+    prefix = prefix[0:cut]
+
+    dialect = sniff_csv(prefix, is_complete=False)
+
+    assert dialect["encoding"] == "utf-8"
+    assert dialect["header_row"] == 0
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import json
+import socket
+import threading
+import urllib.error
+import urllib.request
+
+from pathlib import Path
+
+import hdx_stable_schema.cli
+import hdx_stable_schema.daemon
+import hdx_stable_schema.utilities
+
+from hdx_stable_schema.daemon import (
+    daemon_token_path,
+    make_daemon_server,
+    forward_to_daemon,
+    get_daemon_status,
+    read_daemon_token,
+    DAEMON_TOKEN_HEADER,
+    LOCAL_OPENER,
+)
+from hdx_stable_schema.metadata_processor import read_metadata_from_file
+
+HEALTHSITES_FILE_PATH = Path(__file__).parent / "fixtures" / "2024-12-09-gibraltar-healthsites.json"
+
+
+def unused_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def test_forward_to_daemon_without_daemon():
+    assert forward_to_daemon(["show_schema"], port=unused_port()) is None
+
+
+def post_to_daemon(port: int, body: bytes, headers: dict) -> tuple[int, dict]:
+    request = urllib.request.Request(
+        f"http://127.0.0.1:{port}/run", data=body, headers=headers, method="POST"
+    )
+    try:
+        with LOCAL_OPENER.open(request) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as error:
+        return error.code, json.loads(error.read())
+
+
+def start_daemon(monkeypatch, tmp_path):
+    monkeypatch.setattr(hdx_stable_schema.daemon, "DAEMON_TOKEN_DIRECTORY", tmp_path)
+    # make_daemon_server turns on the download cache for the whole process
+    monkeypatch.setattr(hdx_stable_schema.utilities, "CACHE_DOWNLOADS", False)
+    server = make_daemon_server(port=0)
+    # The client and server share this process, so let the client forward
+    monkeypatch.setattr(hdx_stable_schema.daemon, "RUNNING_IN_DAEMON", False)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def test_daemon_runs_commands(monkeypatch, tmp_path):
+    monkeypatch.setattr(
+        hdx_stable_schema.cli,
+        "read_metadata_from_hdx",
+        lambda dataset_name: read_metadata_from_file(HEALTHSITES_FILE_PATH),
+    )
+    server = start_daemon(monkeypatch, tmp_path)
+    port = server.server_address[1]
+    try:
+        output, exit_code = forward_to_daemon(
+            ["show_schema", "--dataset_name", "gibraltar-healthsites"], port=port
+        )
+
+        assert exit_code == 0
+        assert "Gibraltar Healthsites" in output
+        assert "Found 5 common schemas" in output
+
+        status = get_daemon_status(port=port)
+        assert status["requests_served"] == 1
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert not daemon_token_path(port).exists()
+
+
+def test_daemon_rejects_unsafe_requests(monkeypatch, tmp_path):
+    server = start_daemon(monkeypatch, tmp_path)
+    port = server.server_address[1]
+    token = read_daemon_token(port)
+    json_headers = {"Content-Type": "application/json", DAEMON_TOKEN_HEADER: token}
+    show_schema = json.dumps({"args": ["show_schema"]}).encode("utf-8")
+    try:
+        assert (daemon_token_path(port).stat().st_mode & 0o777) == 0o600
+        # A page posting text/plain to localhost needs no preflight
+        status_code, _ = post_to_daemon(
+            port, show_schema, {"Content-Type": "text/plain", DAEMON_TOKEN_HEADER: token}
+        )
+        assert status_code == 415
+        status_code, _ = post_to_daemon(port, show_schema, {"Content-Type": "application/json"})
+        assert status_code == 403
+        status_code, _ = post_to_daemon(
+            port, show_schema, {**json_headers, DAEMON_TOKEN_HEADER: "guess"}
+        )
+        assert status_code == 403
+        status_code, payload = post_to_daemon(
+            port,
+            json.dumps({"args": ["sample_datasets", "--output_path=/tmp/x"]}).encode("utf-8"),
+            json_headers,
+        )
+        assert status_code == 403
+        assert "show_schema" in payload["error"]
+        for body in [b"not json", b"[]", json.dumps({"args": "show_schema"}).encode("utf-8")]:
+            status_code, payload = post_to_daemon(port, body, json_headers)
+            assert status_code == 400
+            assert payload["error"].startswith("Malformed request")
+        assert get_daemon_status(port=port)["requests_served"] == 0
+        assert forward_to_daemon(["sample_datasets"], port=port) is None
+    finally:
+        server.shutdown()
+        server.server_close()
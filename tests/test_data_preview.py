@@ -1,14 +1,37 @@
 #!/usr/bin/env python
 # encoding: utf-8
 
+import tracemalloc
+import zipfile
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
 from pathlib import Path
 
+import geopandas
+import openpyxl
+import pandas
+import shapely
+
+import hdx_stable_schema.data_preview
+import hdx_stable_schema.utilities
+
 from hdx_stable_schema.data_preview import (
     get_data_from_hdx,
+    get_dataframe_from_hdx,
     field_types_from_rows,
+    field_types_from_dataframe,
+    field_type_from_column,
+    date_formats_from_dataframe,
     print_data_preview,
+    read_geo_within_budget,
+    load_dataframe_from_local_path,
+    get_preview_from_hdx,
+    BUDGET_CHUNKS,
 )
+from hdx_stable_schema.column_profiler import profile_resource
 from hdx_stable_schema.metadata_processor import read_metadata_from_file
+from hdx_stable_schema.request_scheduler import Lane
 
 HEALTHSITES_FILE_PATH = (
     Path(__file__).parent
@@ -21,6 +44,14 @@ HEALTHSITES_FILE_PATH = (
 METADATA = read_metadata_from_file(HEALTHSITES_FILE_PATH)
 RESOURCE_METADATA = METADATA["result"]["resources"][-1]
 
+SAMPLE_HXL_FILE_PATH = (
+    Path(__file__).parent / "fixtures" / "2024-12-09-gibraltar-healthsites-sample-hxl.csv"
+)
+SAMPLE_HXL_RESOURCE_METADATA = {
+    **METADATA["result"]["resources"][0],
+    "download_url": str(SAMPLE_HXL_FILE_PATH),
+}
+
 ROWS, ERROR_MESSAGE = get_data_from_hdx(RESOURCE_METADATA, sheet_name=None)
 
 
@@ -168,3 +199,385 @@ def test_print_data_preview():
         "changeset_timestamp": 23,
         "uuid": 33,
     }
+
+
+def test_get_data_from_hdx_hxlated_local_file():
+    rows, error_message = get_data_from_hdx(SAMPLE_HXL_RESOURCE_METADATA, None)
+
+    assert error_message == "Success"
+    assert len(rows) == 4
+    assert rows[0]["osm_id"] == "10956361305"
+    assert rows[0]["operator"] == "nan"
+
+
+def test_get_dataframe_from_hdx_keeps_native_dtypes():
+    dataframe, error_message = get_dataframe_from_hdx(SAMPLE_HXL_RESOURCE_METADATA, None)
+
+    assert error_message == "Success"
+    assert len(dataframe) == 4
+    assert dataframe["X"].dtype == "float64"
+    assert dataframe["osm_id"].dtype == "int64"
+    assert dataframe["name"].dtype == "object"
+
+
+def test_field_types_from_dataframe():
+    dataframe, _ = get_dataframe_from_hdx(SAMPLE_HXL_RESOURCE_METADATA, None)
+    field_types = field_types_from_dataframe(dataframe)
+
+    assert field_types == {
+        "X": "float",
+        "Y": "float",
+        "osm_id": "integer",
+        "osm_type": "string",
+        "completeness": "float",
+        "name": "string",
+        "operator": "string",
+        "changeset_id": "integer",
+        "changeset_timestamp": "string",
+    }
+
+
+def test_field_type_from_column_dates():
+    assert field_type_from_column(["2024-01-05", "2024-02-11", ""]) == "date"
+    assert field_type_from_column(["05/01/2024", "25/12/2024", "Unknown"]) == "date"
+    assert field_type_from_column(["2024-01-05T10:00:00Z", "2024-02-11 08:30"]) == "datetime"
+    assert field_type_from_column(["Gibraltar", "2024-01-05", "Spain"]) == "string"
+    assert field_type_from_column(["1", "2.5"]) == "float"
+
+
+def test_date_formats_from_dataframe():
+    dataframe = pandas.DataFrame(
+        {
+            "Report Date": [45000, 45031],
+            "period": ["2024-01", "2024-02"],
+            "reported": ["25/12/2024", "01/02/2024"],
+            "population": [45000, 45031],
+        }
+    )
+    field_types = field_types_from_dataframe(dataframe)
+    date_formats = date_formats_from_dataframe(dataframe, field_types)
+
+    assert field_types == {
+        "Report Date": "date",
+        "period": "date",
+        "reported": "date",
+        "population": "integer",
+    }
+    assert date_formats == {
+        "Report Date": "Excel serial",
+        "period": "%Y-%m",
+        "reported": "%d/%m/%Y",
+    }
+
+
+def test_field_type_from_column_memoises_only_short_values():
+    memoised_literal_type = hdx_stable_schema.data_preview.memoised_literal_type
+    memoised_literal_type.cache_clear()
+    column = ["12", "7", "12"] + [f"Note {i}: " + "free text " * 20 for i in range(100)]
+
+    assert field_type_from_column(column) == "string"
+    assert memoised_literal_type.cache_info().currsize == 2
+
+
+def test_field_types_from_dataframe_mixed_date_named_columns():
+    # Date named object columns holding numbers and text are not compared with the serial range
+    dataframe = pandas.DataFrame(
+        {
+            "period": ["2020", "2021", "unknown"],
+            "date": [45000, 45001, "x"],
+        }
+    )
+    field_types = field_types_from_dataframe(dataframe)
+
+    assert field_types == {"period": "integer", "date": "integer"}
+    assert date_formats_from_dataframe(dataframe, field_types) == {}
+
+
+def test_get_dataframe_from_hdx_sniffs_csv_dialect(tmp_path):
+    csv_file_path = tmp_path / "cp1252-semicolons.csv"
+    csv_file_path.write_bytes(
+        (
+            "Données humanitaires;;\n"
+            "pays;région;population\n"
+            "Côte d'Ivoire;Abidjan;6321017\n"
+            "Sénégal;Dakar;4042225\n"
+        ).encode("cp1252")
+    )
+    resource_metadata = {
+        "name": "cp1252-semicolons",
+        "format": "CSV",
+        "download_url": str(csv_file_path),
+    }
+
+    dataframe, error_message = get_dataframe_from_hdx(resource_metadata, None)
+
+    assert error_message == "Success"
+    assert list(dataframe.columns) == ["pays", "région", "population"]
+    assert dataframe["pays"].tolist() == ["Côte d'Ivoire", "Sénégal"]
+    assert dataframe["population"].dtype == "int64"
+
+
+def peak_memory(function, *args, **kwargs):
+    # A first call outside the trace keeps lazy imports and caches out of the measurement
+    function(*args, **kwargs)
+    tracemalloc.start()
+    try:
+        result = function(*args, **kwargs)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, peak
+
+
+def test_get_data_from_hdx_csv_within_memory_budget(tmp_path):
+    csv_file_path = tmp_path / "large.csv"
+    with open(csv_file_path, "w", encoding="utf-8") as csv_file:
+        csv_file.write("id,name,value,notes\n")
+        for i in range(100000):
+            csv_file.write(f"{i},Name {i},{i * 0.5},lorem ipsum dolor sit amet consectetur\n")
+    resource_metadata = {"name": "large.csv", "format": "CSV", "download_url": str(csv_file_path)}
+    max_memory = 1024 * 1024
+
+    (rows, error_message), peak = peak_memory(
+        get_data_from_hdx, resource_metadata, None, max_memory=max_memory
+    )
+
+    assert error_message == "Success"
+    assert peak < max_memory
+    assert 100 < len(rows) < 100000
+    assert rows[0] == {"id": "0", "name": "Name 0", "value": "0.0", "notes": rows[1]["notes"]}
+
+    dataframe, _ = get_dataframe_from_hdx(resource_metadata, None, max_memory=max_memory)
+    assert dataframe.attrs["memory_budget"]["truncated"]
+    assert dataframe.attrs["memory_budget"]["rows"] == len(dataframe)
+
+
+class FakeStreamedResponse:
+    def __init__(self, content, status_code, headers):
+        self.content = content
+        self.status_code = status_code
+        self.headers = headers
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size=1):
+        for start in range(0, len(self.content), chunk_size):
+            stop = start + chunk_size
+            yield self.content[start:stop]
+
+    def close(self):
+        pass
+
+
+def test_sequential_previews_and_profile_within_memory_budget(monkeypatch):
+    file_content = b"id,name,value,notes\n" + b"".join(
+        f"{i},Name {i},{i * 0.5},lorem ipsum dolor sit amet consectetur\n".encode("utf-8")
+        for i in range(100000)
+    )
+
+    def fake_get(url, headers=None, stream=False, timeout=None):
+        if headers is not None and "Range" in headers:
+            stop = int(headers["Range"].rpartition("-")[2]) + 1
+            return FakeStreamedResponse(
+                file_content[0:stop],
+                206,
+                {"Content-Range": f"bytes 0-{stop - 1}/{len(file_content)}"},
+            )
+        return FakeStreamedResponse(file_content, 200, {})
+
+    monkeypatch.setattr(hdx_stable_schema.utilities.HTTP_SESSION, "get", fake_get)
+    monkeypatch.setattr(hdx_stable_schema.utilities, "DOWNLOAD_CACHE", OrderedDict())
+    monkeypatch.setattr(hdx_stable_schema.utilities, "PREFIX_CACHE", OrderedDict())
+    monkeypatch.setattr(hdx_stable_schema.utilities, "CACHE_DOWNLOADS", False)
+    monkeypatch.setattr(hdx_stable_schema.data_preview, "PREVIEW_CACHE", OrderedDict())
+    monkeypatch.setitem(
+        hdx_stable_schema.utilities.REQUEST_SCHEDULER.lanes, "download", Lane("download", None)
+    )
+    # pandas' CSV parser tokenises its whole input buffer whatever the chunk size, a fixed cost
+    # of a few hundred KB which the budget has to be large enough to absorb
+    max_memory = 4 * 1024 * 1024
+    resources = [
+        {"name": f"{i}.csv", "format": "CSV", "download_url": f"https://data.humdata.org/{i}.csv"}
+        for i in range(8)
+    ]
+    # Keeps lazy imports out of the measurement
+    get_preview_from_hdx(resources[0], max_memory=max_memory)
+
+    tracemalloc.start()
+    try:
+        for resource_metadata in resources[1:]:
+            dataframe, _, error_message = get_preview_from_hdx(
+                resource_metadata, max_memory=max_memory
+            )
+            assert error_message == "Success"
+            assert dataframe.attrs["memory_budget"]["truncated"]
+            # As preview_resource --max_memory --profile does
+            chunksize = max(dataframe.attrs["memory_budget"]["row_limit"] // BUDGET_CHUNKS, 1)
+            del dataframe
+        profiles, error_message = profile_resource(
+            resources[0], chunksize=chunksize, max_memory=max_memory
+        )
+        resident, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert error_message == "Success"
+    assert profiles["id"].n_values == 100000
+    assert peak < max_memory
+    # Nothing sized to the budget is left behind by the previews
+    assert resident < max_memory / 4
+    assert hdx_stable_schema.utilities.prefix_cache_size() < max_memory / 4
+    assert len(hdx_stable_schema.data_preview.PREVIEW_CACHE) == 0
+
+    _, error_message = profile_resource({**resources[0], "format": "XLSX"}, max_memory=max_memory)
+    assert error_message.startswith("Profiling skipped")
+
+
+def test_get_data_from_hdx_xlsx_within_memory_budget(tmp_path):
+    xlsx_file_path = tmp_path / "large.xlsx"
+    workbook = openpyxl.Workbook(write_only=True)
+    worksheet = workbook.create_sheet("Regions")
+    worksheet.append(["id", "region", "population"])
+    worksheet.append(["#meta+id", "#adm1+name", "#population"])
+    for i in range(60000):
+        worksheet.append([i, f"Region {i}", i * 10])
+    workbook.save(xlsx_file_path)
+    resource_metadata = {
+        "name": "large.xlsx",
+        "format": "XLSX",
+        "download_url": str(xlsx_file_path),
+    }
+    # Smaller than the workbook, so only the start of the sheet is decompressed
+    max_memory = 1024 * 1024
+
+    (rows, error_message), peak = peak_memory(
+        get_data_from_hdx, resource_metadata, None, max_memory=max_memory
+    )
+
+    assert error_message == "Success"
+    assert peak < max_memory
+    assert 10 < len(rows) < 60000
+    assert rows[0] == {"id": "#meta+id", "region": "#adm1+name", "population": "#population"}
+    assert rows[1] == {"id": "0", "region": "Region 0", "population": "0"}
+
+
+def test_read_geo_within_budget_skips_geometry(tmp_path):
+    geojson_file_path = tmp_path / "large.geojson"
+    polygons = [
+        shapely.Polygon([(i + j * 0.001, j * 0.001) for j in range(500)]) for i in range(500)
+    ]
+    geopandas.GeoDataFrame({"id": range(500)}, geometry=polygons, crs=4326).to_file(
+        geojson_file_path
+    )
+    max_memory = 128 * 1024
+
+    dataframe, peak = peak_memory(
+        read_geo_within_budget, str(geojson_file_path), "GeoJSON", max_memory
+    )
+
+    assert peak < max_memory
+    assert dataframe.attrs["memory_budget"]["geometry_skipped"]
+    assert "geometry" not in dataframe.columns
+    assert len(dataframe) == 500
+
+    dataframe = read_geo_within_budget(str(geojson_file_path), "GeoJSON", 64 * 1024 * 1024)
+    assert not dataframe.attrs["memory_budget"]["geometry_skipped"]
+    assert "geometry" in dataframe.columns
+
+
+def test_load_dataframe_from_zipped_shapefile(monkeypatch, tmp_path):
+    shapefile_directory = tmp_path / "shapefile"
+    shapefile_directory.mkdir()
+    geopandas.GeoDataFrame(
+        {"id": [1, 2]}, geometry=[shapely.Point(0, 0), shapely.Point(1, 1)], crs=4326
+    ).to_file(shapefile_directory / "points.shp")
+    zip_file_path = tmp_path / "points.zip"
+    with zipfile.ZipFile(zip_file_path, "w") as zip_file:
+        for member_path in shapefile_directory.iterdir():
+            zip_file.write(member_path, member_path.name)
+    empty_zip_file_path = tmp_path / "readme.zip"
+    with zipfile.ZipFile(empty_zip_file_path, "w") as zip_file:
+        zip_file.writestr("readme.txt", "No shapefile here")
+
+    dataframe, error_message = load_dataframe_from_local_path(str(zip_file_path), "SHP")
+    assert error_message == "Success"
+    assert len(dataframe) == 2
+
+    dataframe, error_message = load_dataframe_from_local_path(str(empty_zip_file_path), "SHP")
+    assert dataframe is None
+    assert error_message == "No SHP file found in zip"
+
+    # Downloaded, with and without a memory budget
+    zip_content = zip_file_path.read_bytes()
+    monkeypatch.setattr(
+        hdx_stable_schema.utilities.HTTP_SESSION,
+        "get",
+        lambda url, **kwargs: FakeStreamedResponse(zip_content, 200, {}),
+    )
+    monkeypatch.setitem(
+        hdx_stable_schema.utilities.REQUEST_SCHEDULER.lanes, "download", Lane("download", None)
+    )
+    resource_metadata = {
+        "name": "points.zip",
+        "format": "SHP",
+        "download_url": "https://data.humdata.org/points.zip",
+    }
+    for max_memory in [None, 64 * 1024 * 1024]:
+        dataframe, error_message = get_dataframe_from_hdx(
+            resource_metadata, None, max_memory=max_memory
+        )
+        assert error_message == "Success"
+        assert len(dataframe) == 2
+
+
+def test_get_preview_from_hdx_shared_by_fingerprint(monkeypatch):
+    monkeypatch.setattr(hdx_stable_schema.data_preview, "PREVIEW_CACHE", OrderedDict())
+    # A re-upload with the same size and recorded sheets, its own file is never read
+    reupload_resource_metadata = {
+        **SAMPLE_HXL_RESOURCE_METADATA,
+        "name": "gibraltar-healthsites-2025",
+        "download_url": str(SAMPLE_HXL_FILE_PATH.with_name("does-not-exist.csv")),
+    }
+
+    dataframe, field_types, error_message = get_preview_from_hdx(SAMPLE_HXL_RESOURCE_METADATA)
+    shared_dataframe, shared_field_types, shared_error_message = get_preview_from_hdx(
+        reupload_resource_metadata
+    )
+
+    assert error_message == shared_error_message == "Success"
+    assert shared_dataframe is dataframe
+    assert shared_field_types is field_types
+    assert field_types["osm_id"] == "integer"
+
+    _, _, error_message = get_preview_from_hdx({**reupload_resource_metadata, "size": 1})
+    assert error_message.startswith("Resource not found")
+
+
+def test_get_preview_from_hdx_from_threads(monkeypatch, tmp_path):
+    # Enough distinct files, against a small enough cache, that threads insert and evict at once
+    monkeypatch.setattr(hdx_stable_schema.data_preview, "PREVIEW_CACHE", OrderedDict())
+    monkeypatch.setattr(hdx_stable_schema.data_preview, "PREVIEW_CACHE_MAX_BYTES", 16 * 1024)
+    resources = []
+    for i in range(64):
+        csv_file_path = tmp_path / f"resource-{i}.csv"
+        csv_file_path.write_text("a,b\n" + f"{i},x\n" * 100, encoding="utf-8")
+        resources.append(
+            {"name": csv_file_path.name, "format": "CSV", "download_url": str(csv_file_path)}
+        )
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        previews = list(pool.map(get_preview_from_hdx, resources * 4))
+
+    assert [x[2] for x in previews] == ["Success"] * len(previews)
+    assert [x[0]["a"].iloc[0] for x in previews] == list(range(64)) * 4
+    cache = hdx_stable_schema.data_preview.PREVIEW_CACHE
+    assert 0 < sum(x[3] for x in cache.values()) <= 16 * 1024
+
+    # A cached preview is not handed out while another thread holds the cache
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        with hdx_stable_schema.data_preview.PREVIEW_CACHE_LOCK:
+            future = pool.submit(get_preview_from_hdx, resources[-1])
+            is_waiting = len(wait([future], timeout=0.2).not_done) == 1
+        assert is_waiting
+        assert future.result()[2] == "Success"
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+from hdx_stable_schema.date_detection import (
+    date_formats_of,
+    memoised_date_formats_of,
+    detect_date_format,
+    is_excel_serial_column,
+)
+
+
+def test_date_formats_of():
+    assert date_formats_of("2024-03-11") == ("%Y-%m-%d",)
+    assert date_formats_of("2024-03-11T08:30:12+00:00") == ("ISO 8601",)
+    assert date_formats_of("2024-03") == ("%Y-%m",)
+    assert date_formats_of("03/11/2024") == ("%d/%m/%Y", "%m/%d/%Y")
+    assert date_formats_of("25/12/2024") == ("%d/%m/%Y",)
+    assert date_formats_of("2024-02-30") == ()
+    assert date_formats_of("Midtown Clinic") == ()
+    assert date_formats_of("") == ()
+
+
+def test_detect_date_format():
+    assert detect_date_format(["01/02/2024", "12/25/2024", "11/30/2024", "n/a"]) == (
+        "%m/%d/%Y",
+        3,
+    )
+    # Day first wins when every value fits both orders
+    assert detect_date_format(["01/02/2024", "03/04/2024"]) == ("%d/%m/%Y", 2)
+    assert detect_date_format(["Gibraltar", "2024-01", "2024-02"]) == ("%Y-%m", 2)
+    assert detect_date_format(["Gibraltar", "Spain"]) == (None, 0)
+    assert detect_date_format([]) == (None, 0)
+
+
+def test_detect_date_format_uses_memo():
+    memoised_date_formats_of.cache_clear()
+    detect_date_format(["2024-01-05"] * 1000)
+
+    assert memoised_date_formats_of.cache_info().misses == 1
+
+    # Long values are checked without being kept
+    detect_date_format(["2024 " + "free text " * 100] * 10 + ["Midtown Clinic"])
+    assert memoised_date_formats_of.cache_info().currsize == 1
+
+
+def test_is_excel_serial_column():
+    assert is_excel_serial_column("Report Date", 45000, 45365)
+    assert not is_excel_serial_column("Report Date", 1, 45365)
+    assert not is_excel_serial_column("population", 45000, 45365)
+    assert not is_excel_serial_column(0, 45000, 45365)
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import io
+
+from collections import OrderedDict
+
+import openpyxl
+
+import hdx_stable_schema.utilities
+
+from hdx_stable_schema.header_probe import header_row, probe_dataset_headers, probe_resources
+from hdx_stable_schema.request_scheduler import Lane
+from hdx_stable_schema.utilities import hash_row
+
+HEADERS = ["country", "admin1 & region", "population"]
+HXL_HEADERS = ["#country", "#adm1+name", "#population"]
+
+
+class FakeRangeResponse:
+    def __init__(self, content, status_code, headers):
+        self.content = content
+        self.status_code = status_code
+        self.headers = headers
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size=1):
+        for start in range(0, len(self.content), chunk_size):
+            stop = start + chunk_size
+            yield self.content[start:stop]
+
+    def close(self):
+        pass
+
+
+def fake_range_server(files, bytes_served):
+    def get(url, headers=None, stream=False, timeout=None):
+        file_content = files[url]
+        first, _, last = headers["Range"].removeprefix("bytes=").partition("-")
+        if first == "":
+            start, stop = max(len(file_content) - int(last), 0), len(file_content)
+        else:
+            start = int(first)
+            stop = min(int(last) + 1 if last != "" else len(file_content), len(file_content))
+        bytes_served[url] = bytes_served.get(url, 0) + stop - start
+        return FakeRangeResponse(
+            file_content[start:stop],
+            206,
+            {"Content-Range": f"bytes {start}-{stop - 1}/{len(file_content)}"},
+        )
+
+    return get
+
+
+def resource_metadata(name: str, resource_format: str, headers: list[str]) -> dict:
+    sheet = {"name": "__DEFAULT__", "header_hash": hash_row(headers), "headers": headers}
+    return {
+        "name": name,
+        "format": resource_format,
+        "download_url": f"https://data.humdata.org/{name}",
+        "fs_check_info": [
+            {
+                "message": "File structure check completed",
+                "timestamp": "2024-11-25T13:34:51.526275",
+                "hxl_proxy_response": {"sheets": [sheet]},
+            }
+        ],
+    }
+
+
+def make_xlsx(n_rows: int) -> bytes:
+    workbook = openpyxl.Workbook()
+    worksheet = workbook.active
+    worksheet.append(HEADERS)
+    worksheet.append(HXL_HEADERS)
+    for i in range(n_rows):
+        worksheet.append(["Mali", f"Region {i}", i])
+    workbook.create_sheet("Notes").append(["Not probed"])
+    output = io.BytesIO()
+    workbook.save(output)
+    return output.getvalue()
+
+
+def test_probe_dataset_headers(monkeypatch):
+    renamed_headers = ["country", "admin1", "population"]
+    csv_content = (",".join(renamed_headers) + "\r\n" + "Mali,Kayes,2500000\r\n" * 20000).encode()
+    files = {
+        "https://data.humdata.org/regions.xlsx": make_xlsx(20000),
+        "https://data.humdata.org/regions.csv": csv_content,
+    }
+    bytes_served = {}
+    monkeypatch.setattr(
+        hdx_stable_schema.utilities.HTTP_SESSION, "get", fake_range_server(files, bytes_served)
+    )
+    monkeypatch.setattr(hdx_stable_schema.utilities, "DOWNLOAD_CACHE", OrderedDict())
+    monkeypatch.setattr(hdx_stable_schema.utilities, "PREFIX_CACHE", OrderedDict())
+    monkeypatch.setitem(
+        hdx_stable_schema.utilities.REQUEST_SCHEDULER.lanes, "download", Lane("download", None)
+    )
+    metadata = {
+        "result": {
+            "resources": [
+                resource_metadata("regions.xlsx", "XLSX", HEADERS),
+                resource_metadata("regions.csv", "CSV", HEADERS),
+                {"name": "regions.geojson", "format": "GeoJSON", "shape_info": []},
+            ]
+        }
+    }
+
+    results = probe_dataset_headers(metadata, n_workers=2)
+
+    assert [x["resource"] for x in results] == ["regions.xlsx", "regions.csv"]
+    assert results[0]["status"] == "match"
+    assert results[1]["status"] == "changed"
+    assert results[1]["detail"] == "added: ['admin1'], removed: ['admin1 & region']"
+    for url, file_content in files.items():
+        assert bytes_served[url] < len(file_content) / 4
+
+
+def test_probe_unreadable_resources(monkeypatch):
+    # A response cut off inside the zip end record, and a check which recorded no sheets
+    files = {"https://data.humdata.org/truncated.xlsx": b"PK\x05\x06\x00\x00"}
+    monkeypatch.setattr(
+        hdx_stable_schema.utilities.HTTP_SESSION, "get", fake_range_server(files, {})
+    )
+    monkeypatch.setattr(hdx_stable_schema.utilities, "PREFIX_CACHE", OrderedDict())
+    monkeypatch.setitem(
+        hdx_stable_schema.utilities.REQUEST_SCHEDULER.lanes, "download", Lane("download", None)
+    )
+    no_sheets = resource_metadata("no-sheets.csv", "CSV", HEADERS)
+    no_sheets["fs_check_info"][0]["hxl_proxy_response"]["sheets"] = []
+
+    results = probe_resources(
+        [resource_metadata("truncated.xlsx", "XLSX", HEADERS), no_sheets], n_workers=2
+    )
+
+    assert [x["status"] for x in results] == ["error", "error"]
+    assert results[0]["detail"].startswith("Could not read the header of")
+    assert results[1]["detail"] == "No sheets recorded in the file structure check"
+
+
+def test_header_row():
+    assert header_row([HEADERS, HXL_HEADERS, ["Mali", "Kayes", "1"]]) == HEADERS
+    assert header_row([HXL_HEADERS, ["Mali", "Kayes", "1"]]) == ["", "", ""]
+    assert header_row([HEADERS, ["#not a tag", "", ""]]) == HEADERS
+    assert header_row([]) is None
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import io
+
+from pathlib import Path
+
+from hdx_stable_schema.hxl_preview import (
+    get_hxl_preview,
+    get_hxl_preview_from_hdx,
+    row_keys,
+    add_hxl_labels_to_schema,
+)
+
+SAMPLE_FILE_PATH = (
+    Path(__file__).parent / "fixtures" / "2024-12-09-gibraltar-healthsites-sample-hxl.csv"
+)
+
+
+class CountingBytesIO(io.BytesIO):
+    # libhxl closes its input when done, so the position is recorded as it is read
+    bytes_read = 0
+
+    def read(self, size=-1):
+        data = super().read(size)
+        self.bytes_read += len(data)
+        return data
+
+    def read1(self, size=-1):
+        data = super().read1(size)
+        self.bytes_read += len(data)
+        return data
+
+    def readinto(self, buffer):
+        n_bytes = super().readinto(buffer)
+        self.bytes_read += n_bytes
+        return n_bytes
+
+
+def test_get_hxl_preview():
+    preview = get_hxl_preview(str(SAMPLE_FILE_PATH))
+
+    assert preview["headers"][0:3] == ["X", "Y", "osm_id"]
+    assert preview["hxl_headers"][0:3] == ["#geo+lon", "#geo+lat", "#meta+id"]
+    assert len(preview["rows"]) == 4
+    assert preview["rows"][0]["name"] == "Midtown Clinic"
+
+
+def test_get_hxl_preview_reads_lazily():
+    header = b"name,population\r\n#adm1+name,#population\r\n"
+    data = header + b"Kayes,2500000\r\n" * 500000
+    source = CountingBytesIO(data)
+
+    preview = get_hxl_preview(source, n_rows=10)
+
+    assert len(preview["rows"]) == 10
+    assert source.bytes_read < len(data) / 100
+
+
+def test_get_hxl_preview_from_hdx_without_hashtags(tmp_path):
+    file_path = tmp_path / "no-hashtags.csv"
+    file_path.write_text("name,population\nKayes,2500000\n", encoding="utf-8")
+
+    preview, error_message = get_hxl_preview_from_hdx({"download_url": str(file_path)})
+
+    assert preview == {}
+    assert error_message.startswith("No HXL hashtag row found")
+
+
+def test_row_keys():
+    keys = row_keys(["name", None, "name", ""], ["#adm1", "#population", "#adm1", ""])
+
+    assert keys == ["name", "#population", "name.1", "Unnamed: 3"]
+
+
+def test_add_hxl_labels_to_schema():
+    preview = {"headers": ["name", "population"], "hxl_headers": ["#adm1+name", "#population"]}
+
+    schema = add_hxl_labels_to_schema({"headers": ["name", None]}, preview)
+    assert schema["headers"] == ["name", "population"]
+    assert schema["hxl_headers"] == ["#adm1+name", "#population"]
+
+    schema = add_hxl_labels_to_schema({"headers": ["name"]}, preview)
+    assert "hxl_headers" not in schema
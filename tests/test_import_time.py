@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import subprocess
+import sys
+
+# The cumulative import time of the CLI for a metadata-only command, in microseconds. Currently
+# around 0.15s, dominated by requests. Importing pandas and geopandas takes it to about 0.75s
+IMPORT_TIME_BUDGET_US = 500000
+
+HEAVY_MODULES = ["pandas", "geopandas", "fiona", "numpy", "hxl"]
+
+
+def measure_imports(code: str) -> dict[str, int]:
+    completed_process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    cumulative_times = {}
+    for line in completed_process.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module_name = line.removeprefix("import time:").split("|")
+        cumulative_times[module_name.strip()] = int(cumulative)
+    return cumulative_times
+
+
+def test_show_schema_import_time():
+    cumulative_times = measure_imports(
+        "from hdx_stable_schema.cli import hdx_schema; "
+        "hdx_schema(['show_schema', '--help'], standalone_mode=False)"
+    )
+
+    assert not [x for x in HEAVY_MODULES if x in cumulative_times]
+    assert cumulative_times["hdx_stable_schema.cli"] < IMPORT_TIME_BUDGET_US
+
+
+def test_daemon_warms_heavy_imports(tmp_path):
+    cumulative_times = measure_imports(
+        "import pathlib; import hdx_stable_schema.daemon as daemon; "
+        f"daemon.DAEMON_TOKEN_DIRECTORY = pathlib.Path({str(tmp_path)!r}); "
+        "daemon.make_daemon_server(port=0).server_close()"
+    )
+
+    # fiona is only loaded by geopandas when pyogrio is missing
+    assert all(x in cumulative_times for x in ["pandas", "geopandas", "numpy", "hxl"])
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import copy
+import gzip
+
+from pathlib import Path
+
+from hdx_stable_schema.metadata_archive import (
+    MetadataArchive,
+    MetadataArchiveWriter,
+    read_archive_index,
+)
+from hdx_stable_schema.metadata_processor import (
+    read_metadata_from_archive,
+    read_metadata_from_directory,
+    read_metadata_from_file,
+)
+
+FIXTURES_DIRECTORY = Path(__file__).parent / "fixtures"
+HEALTHSITES_FILE_PATH = FIXTURES_DIRECTORY / "2024-12-09-gibraltar-healthsites.json"
+
+
+def write_fixtures_archive(archive_path: Path) -> list[dict]:
+    datasets = list(read_metadata_from_directory(FIXTURES_DIRECTORY))
+    with MetadataArchiveWriter(archive_path, block_size=4) as writer:
+        for metadata in datasets:
+            writer.add(metadata)
+    return datasets
+
+
+def test_archive_random_access(tmp_path):
+    archive_path = tmp_path / "archive" / "hdx.ndjson.gz"
+    datasets = write_fixtures_archive(archive_path)
+
+    archive_index = read_archive_index(archive_path)
+    assert len(archive_index["entries"]) == len(datasets)
+    assert len({x["offset"] for x in archive_index["entries"]}) == (len(datasets) + 3) // 4
+
+    metadata = read_metadata_from_archive(archive_path, "gibraltar-healthsites")
+    assert metadata["result"] == read_metadata_from_file(HEALTHSITES_FILE_PATH)["result"]
+
+    # A block can be read on its own since each one is a complete gzip member
+    entry = MetadataArchive(archive_path).find("gibraltar-healthsites")
+    with open(archive_path, "rb") as archive_file:
+        archive_file.seek(entry["offset"])
+        block = gzip.decompress(archive_file.read(entry["length"]))
+    assert b'"name":"gibraltar-healthsites"' in block.splitlines()[entry["line"]]
+
+
+def test_archive_streaming(tmp_path):
+    archive_path = tmp_path / "hdx.ndjson.gz"
+    datasets = write_fixtures_archive(archive_path)
+
+    archive = MetadataArchive(archive_path)
+    assert [x["result"]["name"] for x in archive] == [x["result"]["name"] for x in datasets]
+    assert "climada-litpop-dataset" in archive
+
+    # Archives are picked up alongside loose files in a metadata directory
+    dataset_names = [x["result"]["name"] for x in read_metadata_from_directory(tmp_path)]
+    assert dataset_names == [x["result"]["name"] for x in datasets]
+
+
+def test_archive_append_snapshots(tmp_path):
+    archive_path = tmp_path / "hdx.ndjson.gz"
+    write_fixtures_archive(archive_path)
+
+    metadata = read_metadata_from_file(HEALTHSITES_FILE_PATH)
+    original_modified = metadata["result"]["metadata_modified"]
+    newer = copy.deepcopy(metadata)
+    newer["result"]["metadata_modified"] = "2025-01-01T00:00:00.000000"
+    newer["result"]["title"] = "Gibraltar Healthsites (updated)"
+    with MetadataArchiveWriter(archive_path, append=True) as writer:
+        writer.add(newer)
+
+    archive = MetadataArchive(archive_path)
+    assert archive.read("gibraltar-healthsites")["result"]["title"].endswith("(updated)")
+    assert archive.read(metadata["result"]["id"])["result"] == newer["result"]
+    older = archive.read("gibraltar-healthsites", metadata_modified=original_modified)
+    assert older["result"]["title"] == metadata["result"]["title"]
+    assert len(list(archive)) == len(archive)
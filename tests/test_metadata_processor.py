@@ -5,11 +5,20 @@ import json
 
 from pathlib import Path
 
+import hdx_stable_schema.metadata_processor
+import hdx_stable_schema.utilities
+
 from hdx_stable_schema.metadata_processor import (
     read_metadata_from_file,
+    read_metadata_from_directory,
     summarise_schema,
     summarise_resource,
+    sample_datasets,
+    iter_search_datasets,
+    plan_sample_windows,
+    content_fingerprint,
 )
+from hdx_stable_schema.request_scheduler import Lane
 
 HEALTHSITES_FILE_PATH = (
     Path(__file__).parent
@@ -49,3 +58,101 @@ def test_summarise_resources():
         expected_resource_summary = json.load(resource_file)
 
     assert expected_resource_summary == resource_summary
+
+
+def test_read_metadata_from_directory():
+    dataset_names = [
+        x["result"]["name"]
+        for x in read_metadata_from_directory(Path(__file__).parent / "fixtures")
+    ]
+
+    assert "gibraltar-healthsites" in dataset_names
+    assert "climada-litpop-dataset" in dataset_names
+
+
+class FakePackageSearchResponse:
+    status_code = 200
+
+    def __init__(self, payload):
+        self.payload = payload
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.payload
+
+
+def fake_package_search(requests_made, n_datasets=500):
+    catalogue = [
+        {"id": f"{i:04d}", "name": f"dataset-{i}", "resources": []} for i in range(n_datasets)
+    ]
+
+    def get(url, params=None, timeout=None):
+        requests_made.append(params)
+        start = params.get("start", 0)
+        stop = start + params["rows"]
+        results = catalogue[start:stop]
+        return FakePackageSearchResponse({"result": {"count": n_datasets, "results": results}})
+
+    return get
+
+
+def test_plan_sample_windows():
+    windows = plan_sample_windows([90, 3, 10, 500, 12, 3], max_rows=50, max_gap=10)
+
+    assert windows == [(3, 10, [3, 10, 12]), (90, 1, [90]), (500, 1, [500])]
+
+
+def test_sample_datasets(monkeypatch):
+    requests_made = []
+    monkeypatch.setattr(
+        hdx_stable_schema.utilities.HTTP_SESSION, "get", fake_package_search(requests_made)
+    )
+    monkeypatch.setitem(
+        hdx_stable_schema.utilities.REQUEST_SCHEDULER.lanes, "metadata", Lane("metadata", None)
+    )
+    monkeypatch.setattr(hdx_stable_schema.metadata_processor, "DATASET_COUNT_CACHE", {})
+
+    datasets, n_requests = sample_datasets(100, seed=42)
+
+    assert len(datasets) == 100
+    assert len({x["result"]["id"] for x in datasets}) == 100
+    assert n_requests == len(requests_made)
+    assert n_requests < 50
+
+    # The dataset count is cached so a second sample skips the count request
+    _, n_requests = sample_datasets(1, seed=1)
+    assert n_requests == 1
+
+
+def test_iter_search_datasets_pages_past_search_limit(monkeypatch):
+    requests_made = []
+    monkeypatch.setattr(
+        hdx_stable_schema.utilities.HTTP_SESSION,
+        "get",
+        fake_package_search(requests_made, n_datasets=2500),
+    )
+    monkeypatch.setitem(
+        hdx_stable_schema.utilities.REQUEST_SCHEDULER.lanes, "metadata", Lane("metadata", None)
+    )
+
+    datasets = list(iter_search_datasets("organization:example"))
+
+    assert len({x["result"]["id"] for x in datasets}) == len(datasets) == 2500
+    assert len(requests_made) == 3
+
+
+def test_content_fingerprint():
+    resource = METADATA["result"]["resources"][0]
+    reupload = {**resource, "name": "reupload", "download_url": "https://example.org/2025.csv"}
+    resized = {**resource, "size": resource["size"] + 1}
+
+    assert content_fingerprint(resource) is not None
+    assert content_fingerprint(reupload) == content_fingerprint(resource)
+    assert content_fingerprint(resized) != content_fingerprint(resource)
+    assert content_fingerprint({**resource, "size": None}) is None
+    assert content_fingerprint(METADATA["result"]["resources"][1]) is None
+    assert content_fingerprint({**resource, "hash": "abc"}) == content_fingerprint(
+        {**resized, "hash": "abc"}
+    )
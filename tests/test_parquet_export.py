@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+from pathlib import Path
+
+import pyarrow.dataset
+import pyarrow.parquet
+
+from hdx_stable_schema.metadata_processor import read_metadata_from_directory
+from hdx_stable_schema.parquet_export import export_tables, partition_value
+
+FIXTURES_DIRECTORY = Path(__file__).parent / "fixtures"
+PREVIEW_FILE_PATH = FIXTURES_DIRECTORY / "2024-12-09-gibraltar-healthsites-sample-hxl.csv"
+
+
+def read_table(output_directory: Path, name: str, file_format: str = "parquet", **kwargs):
+    table = pyarrow.dataset.dataset(
+        output_directory / name, format=file_format, partitioning="hive"
+    )
+    return table.to_table(**kwargs)
+
+
+def test_export_tables_in_batches(tmp_path):
+    datasets = list(read_metadata_from_directory(FIXTURES_DIRECTORY))
+    n_datasets, n_rows = export_tables(datasets, tmp_path, batch_rows=7)
+
+    assert n_datasets == 13
+    assert n_rows["resources"] == sum(len(x["result"]["resources"]) for x in datasets)
+    assert n_rows["previews"] == 0
+    for name, n_table_rows in n_rows.items():
+        if n_table_rows != 0:
+            assert read_table(tmp_path, name).num_rows == n_table_rows
+
+    # Batches are written as row groups, so a reader can skip them and the unused columns
+    metadata = pyarrow.parquet.read_metadata(tmp_path / "columns" / "format=CSV" / "part-0.parquet")
+    assert metadata.num_row_groups > 1
+    columns = read_table(
+        tmp_path,
+        "columns",
+        columns=["name", "hxl_tag"],
+        filter=pyarrow.dataset.field("format") == "CSV",
+    )
+    assert columns.column_names == ["name", "hxl_tag"]
+    assert {"name": "country_name", "hxl_tag": "#country"} in columns.to_pylist()
+
+    checks = read_table(tmp_path, "checks").to_pylist()
+    assert {x["event_type"] for x in checks} == {None, "spreadsheet-sheet-changed"}
+
+    # The value in the rows is the one in the directory name, so filters on it agree
+    for name in ["resources", "sheets", "columns", "checks"]:
+        formats = {x.name.partition("=")[2] for x in (tmp_path / name).iterdir()}
+        table = pyarrow.dataset.dataset(tmp_path / name, format="parquet")
+        assert set(table.to_table(columns=["format"])["format"].to_pylist()) == formats
+    assert "GEOJSON" in formats
+    resources = read_table(
+        tmp_path, "resources", filter=pyarrow.dataset.field("format") == "GEOJSON"
+    )
+    assert resources.num_rows == sum(
+        1
+        for x in datasets
+        for resource in x["result"]["resources"]
+        if resource["format"].upper() == "GEOJSON"
+    )
+
+
+def test_export_tables_with_previews(tmp_path):
+    resource = {
+        "name": "gibraltar-healthsites.csv",
+        "format": "CSV",
+        "download_url": str(PREVIEW_FILE_PATH),
+    }
+    metadata = {"result": {"name": "gibraltar-healthsites", "resources": [resource]}}
+    _, n_rows = export_tables([metadata], tmp_path, file_format="arrow", preview_rows=3)
+
+    previews = read_table(tmp_path, "previews", file_format="arrow").to_pylist()
+    assert n_rows["previews"] == len(previews)
+    assert {x["row"] for x in previews} == {0, 1, 2}
+    assert previews[0]["column"] == "X"
+    assert previews[0]["value"] == "-5.35572243464645"
+
+
+def test_partition_value():
+    assert partition_value("CSV") == "CSV"
+    assert partition_value("zipped shapefile") == "ZIPPED_SHAPEFILE"
+    assert partition_value("") == "UNKNOWN"
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import contextlib
+import gc
+import io
+import tracemalloc
+
+from collections import OrderedDict
+from pathlib import Path
+
+import hdx_stable_schema.records
+
+from hdx_stable_schema.records import intern_headers
+from hdx_stable_schema.metadata_processor import (
+    read_metadata_from_directory,
+    read_metadata_from_file,
+    resource_records,
+    schema_records,
+    summarise_resource,
+    summarise_schema,
+)
+
+FIXTURES_DIRECTORY = Path(__file__).parent / "fixtures"
+HEALTHSITES_FILE_PATH = FIXTURES_DIRECTORY / "2024-12-09-gibraltar-healthsites.json"
+
+# Copies of the fixture datasets loaded for the memory benchmark, about 65 datasets
+N_CATALOGUE_COPIES = 5
+
+
+def test_headers_are_shared():
+    resources = resource_records(read_metadata_from_file(HEALTHSITES_FILE_PATH))
+    other_resources = resource_records(read_metadata_from_file(HEALTHSITES_FILE_PATH))
+
+    for resource, other_resource in zip(resources, other_resources):
+        if resource.last_check is None:
+            continue
+        for sheet, other_sheet in zip(resource.last_check.sheets, other_resource.last_check.sheets):
+            assert sheet.headers is other_sheet.headers
+            assert not hasattr(sheet, "__dict__")
+
+
+def test_header_tuples_are_bounded(monkeypatch):
+    monkeypatch.setattr(hdx_stable_schema.records, "HEADER_TUPLES", OrderedDict())
+    monkeypatch.setattr(hdx_stable_schema.records, "HEADER_TUPLES_MAX_ENTRIES", 2)
+
+    first = intern_headers(["a", "b"])
+    second = intern_headers(["c"])
+    assert intern_headers(["a", "b"]) is first
+    intern_headers(["d"])
+
+    assert list(hdx_stable_schema.records.HEADER_TUPLES) == [("a", "b"), ("d",)]
+    assert intern_headers(["c"]) is not second
+
+
+def test_schema_records_as_dict():
+    metadata = read_metadata_from_file(HEALTHSITES_FILE_PATH)
+    schemas = schema_records(resource_records(metadata))
+
+    assert {k: v.as_dict() for k, v in schemas.items()} == summarise_schema(metadata)
+
+
+def measure_retained_memory(build) -> int:
+    gc.collect()
+    tracemalloc.start()
+    with contextlib.redirect_stdout(io.StringIO()):
+        retained = build()
+    gc.collect()
+    retained_bytes, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del retained
+    return retained_bytes
+
+
+def test_records_memory_benchmark(monkeypatch):
+    # Both sides keep only their summaries, the raw CKAN metadata is dropped after each dataset.
+    # The dicts which as_dict makes for printing are not kept, so they are not counted
+    def build_dicts():
+        return [
+            (summarise_resource(metadata), summarise_schema(metadata))
+            for _ in range(N_CATALOGUE_COPIES)
+            for metadata in read_metadata_from_directory(FIXTURES_DIRECTORY)
+        ]
+
+    def build_records():
+        retained = []
+        for _ in range(N_CATALOGUE_COPIES):
+            for metadata in read_metadata_from_directory(FIXTURES_DIRECTORY):
+                resources = resource_records(metadata)
+                retained.append((resources, schema_records(resources)))
+        return retained
+
+    monkeypatch.setattr(hdx_stable_schema.records, "HEADER_TUPLES", OrderedDict())
+    dicts_bytes = measure_retained_memory(build_dicts)
+    monkeypatch.setattr(hdx_stable_schema.records, "HEADER_TUPLES", OrderedDict())
+    records_bytes = measure_retained_memory(build_records)
+
+    # About 520KB for the dict summaries against 430KB for the records
+    assert records_bytes < dicts_bytes * 0.9
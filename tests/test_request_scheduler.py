@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from hdx_stable_schema.request_scheduler import (
+    InFlightRequests,
+    Lane,
+    RequestScheduler,
+    TokenBucket,
+)
+
+
+class FakeResponse:
+    def __init__(self, status_code, content=b"", headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers if headers is not None else {}
+
+    def close(self):
+        pass
+
+
+class FakeSession:
+    def __init__(self, responses):
+        self.responses = responses
+        self.requests_made = []
+
+    def get(self, url, **kwargs):
+        self.requests_made.append(url)
+        return self.responses.pop(0)
+
+    def post(self, url, **kwargs):
+        self.requests_made.append((url, kwargs["json"]))
+        return self.responses.pop(0)
+
+
+def test_token_bucket_reserve():
+    bucket = TokenBucket(10.0, capacity=1.0)
+
+    assert bucket.reserve(1) == 0.0
+    assert bucket.reserve(1) == pytest.approx(0.1, abs=0.01)
+    # Half speed doubles the wait for the debt already run up
+    assert bucket.reserve(0, rate_factor=0.5) == pytest.approx(0.2, abs=0.02)
+
+    assert TokenBucket(None).reserve(1000) == 0.0
+
+
+def test_scheduler_backs_off_on_429():
+    session = FakeSession(
+        [
+            FakeResponse(429, headers={"Retry-After": "0"}),
+            FakeResponse(429, headers={"Retry-After": "0"}),
+            FakeResponse(200, content=b"{}"),
+        ]
+    )
+    scheduler = RequestScheduler(session, {"metadata": Lane("metadata", None)})
+
+    response = scheduler.get("metadata", "https://data.humdata.org/api/action/package_show")
+
+    assert response.status_code == 200
+    assert len(session.requests_made) == 3
+    metrics = scheduler.metrics()["metadata"]
+    assert metrics["requests"] == 3
+    assert metrics["throttled"] == 2
+    assert metrics["rate_factor"] == 0.3
+    assert metrics["queue_depth"] == 0
+
+
+def test_scheduler_posts_in_the_same_lane():
+    session = FakeSession(
+        [FakeResponse(429, headers={"Retry-After": "0"}), FakeResponse(200, content=b"{}")]
+    )
+    scheduler = RequestScheduler(session, {"metadata": Lane("metadata", None)})
+    query_url = "https://data.humdata.org/api/action/package_search"
+
+    response = scheduler.post("metadata", query_url, json={"fq": "name:a"})
+
+    assert response.status_code == 200
+    assert session.requests_made == [(query_url, {"fq": "name:a"})] * 2
+    assert scheduler.metrics()["metadata"]["throttled"] == 1
+
+
+def test_scheduler_gives_up_after_max_retries():
+    session = FakeSession([FakeResponse(429, headers={"Retry-After": "0"}) for _ in range(3)])
+    scheduler = RequestScheduler(session, {"metadata": Lane("metadata", None)}, max_retries=2)
+
+    assert scheduler.get("metadata", "https://data.humdata.org/api").status_code == 429
+    assert len(session.requests_made) == 3
+
+
+def test_download_bytes_do_not_hold_up_metadata():
+    session = FakeSession([FakeResponse(200, content=b"x" * 10000), FakeResponse(200)])
+    scheduler = RequestScheduler(
+        session,
+        {
+            "metadata": Lane("metadata", 100.0),
+            "download": Lane("download", 100.0, bytes_per_second=1000.0),
+        },
+    )
+
+    scheduler.get("download", "https://data.humdata.org/dataset/file.csv")
+    # The download lane owes about 9 seconds for the bytes beyond its one second burst
+    assert scheduler.lanes["download"].bytes.reserve(0) > 8.0
+    assert scheduler.metrics()["download"]["bytes"] == 10000
+
+    scheduler.get("metadata", "https://data.humdata.org/api/action/package_show")
+    assert scheduler.metrics()["metadata"]["max_wait_seconds"] == 0.0
+
+
+def test_in_flight_requests_share_one_call():
+    in_flight = InFlightRequests()
+    release = threading.Event()
+    calls = []
+
+    def slow_fetch(url):
+        calls.append(url)
+        release.wait(timeout=5)
+        return url.upper()
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        futures = [pool.submit(in_flight.run, "a", slow_fetch, "a") for _ in range(4)]
+        while in_flight.metrics()["shared"] < 3:
+            time.sleep(0.01)
+        release.set()
+        results = [x.result() for x in futures]
+
+    assert results == ["A"] * 4
+    assert calls == ["a"]
+    assert in_flight.metrics() == {"in_flight": 0, "calls": 1, "shared": 3}
+
+    # Once finished the key is free again, and failures are raised to the caller
+    with pytest.raises(ZeroDivisionError):
+        in_flight.run("a", lambda: 1 / 0)
+    assert in_flight.run("a", slow_fetch, "a") == "A"
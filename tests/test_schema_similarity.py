@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+from pathlib import Path
+
+from hdx_stable_schema.metadata_processor import (
+    read_metadata_from_directory,
+    resource_records,
+    schema_records,
+    summarise_schema,
+)
+from hdx_stable_schema.schema_similarity import (
+    normalise_header,
+    normalise_hxl_header,
+    schema_tokens,
+    build_schema_index,
+    group_similar_schemas,
+    lsh_parameters,
+    SchemaIndex,
+)
+
+FIXTURES_DIRECTORY = Path(__file__).parent / "fixtures"
+CORPUS = list(read_metadata_from_directory(FIXTURES_DIRECTORY))
+HEALTHSITES_METADATA = [x for x in CORPUS if x["result"]["name"] == "gibraltar-healthsites"][0]
+HEALTHSITES_SCHEMAS = summarise_schema(HEALTHSITES_METADATA)
+CSV_HEADER_HASH = "8365f8d2a7fb4918ebad448fac69c266"
+GEOJSON_HEADER_HASH = "6c4fd90c8524be930d2a091fd389043e"
+
+
+def test_normalise_headers():
+    assert normalise_header(" Country ISO ") == "country_iso"
+    assert normalise_header(None) == ""
+    assert normalise_hxl_header("#meta +operator_type") == "#meta+operator_type"
+    assert normalise_hxl_header("#adm1+name+code") == normalise_hxl_header("#adm1 +code +name")
+
+
+def test_schema_tokens_of_records_and_dicts():
+    for header_hash, schema in schema_records(resource_records(HEALTHSITES_METADATA)).items():
+        assert schema_tokens(schema) == schema_tokens(HEALTHSITES_SCHEMAS[header_hash])
+
+
+def test_query_finds_renamed_column():
+    schema_index = build_schema_index(CORPUS)
+    schema = HEALTHSITES_SCHEMAS[CSV_HEADER_HASH]
+    renamed_schema = {**schema, "headers": schema["headers"][:-1] + ["unique_id"]}
+
+    matches = schema_index.query(renamed_schema, threshold=0.8)
+
+    assert [x[0] for x in matches] == [
+        f"gibraltar-healthsites/{CSV_HEADER_HASH}",
+        f"gibraltar-healthsites/{GEOJSON_HEADER_HASH}",
+    ]
+    assert matches[0][1] > 0.9
+
+
+def test_lsh_parameters_follow_threshold():
+    assert lsh_parameters(0.5) == (32, 4)
+    assert lsh_parameters(0.8) == (16, 8)
+
+
+def test_query_finds_pairs_just_above_threshold():
+    # Pairs sharing 11 of 20 headers have a Jaccard similarity of 0.55, a few are expected to be
+    # missed by their estimated similarity falling under 0.5 but banding should lose very few
+    schema_index = SchemaIndex(threshold=0.5)
+    queries = {}
+    for pair in range(50):
+        shared = [f"pair_{pair}_shared_{x}" for x in range(11)]
+        schema_a = {"headers": shared + [f"pair_{pair}_a_{x}" for x in range(4)]}
+        schema_b = {"headers": shared + [f"pair_{pair}_b_{x}" for x in range(5)]}
+        schema_index.add(f"pair_{pair}", schema_a)
+        queries[f"pair_{pair}"] = schema_b
+
+    n_found = sum(
+        1 for key, schema in queries.items() if key in [x[0] for x in schema_index.query(schema)]
+    )
+
+    assert n_found >= 35
+
+
+def test_empty_schemas_not_indexed():
+    schema_index = build_schema_index(CORPUS)
+
+    assert not any(x.endswith("/None") for x in schema_index.signatures)
+
+
+def test_group_similar_schemas():
+    similar_schemas = group_similar_schemas(HEALTHSITES_SCHEMAS, threshold=0.8)
+
+    assert [x[0] for x in similar_schemas[CSV_HEADER_HASH]] == [GEOJSON_HEADER_HASH]
+    assert [x[0] for x in similar_schemas[GEOJSON_HEADER_HASH]] == [CSV_HEADER_HASH]
+    assert similar_schemas["90e892cdabe6c637277ac15d6e306583"] == []
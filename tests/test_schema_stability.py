@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import copy
+
+from pathlib import Path
+
+from hdx_stable_schema.metadata_processor import read_metadata_from_directory
+from hdx_stable_schema.schema_stability import (
+    is_schema_change,
+    new_stability_state,
+    stability_metrics,
+    update_stability,
+)
+
+FIXTURES_DIRECTORY = Path(__file__).parent / "fixtures"
+
+
+def without_last_checks(metadata: dict, n_checks: int) -> dict:
+    truncated = copy.deepcopy(metadata)
+    for resource in truncated["result"]["resources"]:
+        for key in ["fs_check_info", "shape_info"]:
+            if key in resource and len(resource[key]) > n_checks:
+                stop = len(resource[key]) - n_checks
+                resource[key] = resource[key][0:stop]
+    return truncated
+
+
+def test_incremental_updates_match_full_recompute():
+    datasets = list(read_metadata_from_directory(FIXTURES_DIRECTORY))
+
+    full = new_stability_state()
+    for metadata in datasets:
+        update_stability(full, metadata)
+
+    incremental = new_stability_state()
+    for n_checks in [4, 2, 0]:
+        for metadata in datasets:
+            update_stability(incremental, without_last_checks(metadata, n_checks))
+
+    assert incremental == full
+    # Nothing new arrives when the same snapshot is seen again
+    assert sum(update_stability(incremental, x) for x in datasets) == 0
+    assert full["groups"]["format"]["CSV"]["n_resources"] == 25
+
+
+def test_is_schema_change():
+    rows_changed = {
+        "event_type": "spreadsheet-sheet-changed",
+        "changed_fields": [{"field": "nrows", "old_value": 995, "new_value": 1045}],
+    }
+    header_changed = {
+        "event_type": "spreadsheet-sheet-changed",
+        "changed_fields": [{"field": "header_hash", "old_value": "a", "new_value": "b"}],
+    }
+
+    assert not is_schema_change([])
+    assert not is_schema_change([rows_changed])
+    assert is_schema_change([rows_changed, header_changed])
+    assert is_schema_change([{"event_type": "spreadsheet-sheet-created", "name": "Sheet2"}])
+
+
+def test_mean_days_between_changes():
+    header_changed = {
+        "name": "Sheet1",
+        "event_type": "spreadsheet-sheet-changed",
+        "changed_fields": [{"field": "header_hash", "old_value": "a", "new_value": "b"}],
+    }
+    checks = [
+        {"message": "File structure check completed", "timestamp": timestamp, "sheet_changes": []}
+        for timestamp in [
+            "2024-01-01T00:00:00",
+            "2024-01-11T00:00:00",
+            "2024-01-21T00:00:00",
+            "2024-01-31T00:00:00",
+        ]
+    ]
+    for i in [1, 3]:
+        checks[i]["sheet_changes"] = [header_changed]
+    metadata = {
+        "result": {
+            "name": "test-dataset",
+            "organization": {"name": "test-organization"},
+            "resources": [{"id": "r1", "name": "r1.csv", "format": "csv", "fs_check_info": checks}],
+        }
+    }
+    stability = new_stability_state()
+
+    assert update_stability(stability, metadata) == 4
+    metrics = stability_metrics(stability["groups"]["organization"]["test-organization"])
+    assert metrics["mean_days_between_changes"] == 20.0
+    assert metrics["changes_per_check"] == 0.5
+    assert metrics["stable_share"] == 0.0
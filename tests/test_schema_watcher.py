@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import copy
+
+from pathlib import Path
+
+import hdx_stable_schema.utilities
+
+from hdx_stable_schema.metadata_processor import read_metadata_from_file
+from hdx_stable_schema.schema_watcher import (
+    new_watch_state,
+    poll_watched_datasets,
+    watch_query,
+)
+from hdx_stable_schema.request_scheduler import Lane
+
+HEALTHSITES_FILE_PATH = Path(__file__).parent / "fixtures" / "2024-12-09-gibraltar-healthsites.json"
+
+
+class FakePackageSearchResponse:
+    status_code = 200
+
+    def __init__(self, payload):
+        self.payload = payload
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.payload
+
+
+def test_watch_query():
+    assert watch_query(["a", "b"]) == '(id:("a" OR "b") OR name:("a" OR "b"))'
+    assert watch_query(["a"], since="2024-11-25T13:34:54.967762").endswith(
+        " AND metadata_modified:[2024-11-25T13:34:54Z TO *]"
+    )
+
+
+def test_poll_watched_datasets(monkeypatch):
+    original = read_metadata_from_file(HEALTHSITES_FILE_PATH)["result"]
+    modified = copy.deepcopy(original)
+    modified["metadata_modified"] = "2024-12-01T09:00:00.000000"
+    resource = modified["resources"][0]
+    check = copy.deepcopy(resource["fs_check_info"][-1])
+    check["timestamp"] = "2024-12-01T08:59:00.000000"
+    check["hxl_proxy_response"]["sheets"][0]["header_hash"] = "new-header-hash"
+    check["sheet_changes"] = [
+        {
+            "name": check["hxl_proxy_response"]["sheets"][0]["name"],
+            "event_type": "spreadsheet-sheet-changed",
+            "changed_fields": [
+                {"field": "ncols", "old_display_value": 35, "new_display_value": 36}
+            ],
+        }
+    ]
+    resource["fs_check_info"].append(check)
+
+    # Each poll answers with the datasets modified since the last one
+    responses = [[original], [original], [modified]]
+    requests_made = []
+
+    def post(url, json=None, timeout=None):
+        requests_made.append(json)
+        results = copy.deepcopy(responses[len(requests_made) - 1])
+        return FakePackageSearchResponse({"result": {"count": len(results), "results": results}})
+
+    monkeypatch.setattr(hdx_stable_schema.utilities.HTTP_SESSION, "post", post)
+
+    watched = ["gibraltar-healthsites", "another-dataset"]
+    watch_state = new_watch_state()
+
+    events, n_requests = poll_watched_datasets(watched, watch_state)
+    assert (events, n_requests) == ([], 1)
+    assert "metadata_modified" not in requests_made[0]["fq"]
+
+    events, n_requests = poll_watched_datasets(watched, watch_state)
+    assert (events, n_requests) == ([], 1)
+    assert "metadata_modified:[2024-11-25T13:34:54Z TO *]" in requests_made[1]["fq"]
+
+    events, n_requests = poll_watched_datasets(watched, watch_state)
+    assert n_requests == 1
+    assert [x["Event"] for x in events] == ["header_hash changed", "spreadsheet-sheet-changed"]
+    assert events[0]["Resource"] == resource["name"]
+    assert events[0]["Detail"].endswith("-> new-header-hash")
+    assert events[1]["Detail"] == "ncols: 35 -> 36"
+    assert watch_state["since"] == "2024-12-01T09:00:00.000000"
+
+
+def test_poll_large_watch_list_in_one_request(monkeypatch):
+    # Every watched dataset changed at once, so the results run to three pages
+    requests_made = []
+
+    def post(url, json=None, timeout=None):
+        requests_made.append(json)
+        results = [
+            {
+                "id": f"{i:04d}",
+                "name": x,
+                "metadata_modified": "2024-12-01T09:00:00.000000",
+                "resources": [],
+            }
+            for i, x in enumerate(watched)
+        ]
+        start = json["start"]
+        stop = start + json["rows"]
+        return FakePackageSearchResponse(
+            {"result": {"count": len(results), "results": results[start:stop]}}
+        )
+
+    monkeypatch.setattr(hdx_stable_schema.utilities.HTTP_SESSION, "post", post)
+    monkeypatch.setitem(
+        hdx_stable_schema.utilities.REQUEST_SCHEDULER.lanes, "metadata", Lane("metadata", None)
+    )
+    watched = [
+        f"dataset-name-of-one-hundred-characters-{i:04d}".ljust(100, "x") for i in range(2500)
+    ]
+    watch_state = new_watch_state()
+
+    events, n_requests = poll_watched_datasets(watched, watch_state)
+
+    assert events == []
+    assert n_requests == len(requests_made) == 3
+    assert [x["start"] for x in requests_made] == [0, 1000, 2000]
+    assert all(f'"{x}"' in requests_made[0]["fq"] for x in watched)
+    assert len(watch_state["datasets"]) == 2500
@@ -1,7 +1,33 @@
 #!/usr/bin/env python
 # encoding: utf-8
 
-from hdx_stable_schema.utilities import print_banner, print_table_from_list_of_dicts, print_list
+import shutil
+import threading
+import time
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from hxl.input import hash_row as hxl_hash_row
+
+import hdx_stable_schema.utilities
+
+from hdx_stable_schema.utilities import (
+    print_banner,
+    print_table_from_list_of_dicts,
+    print_list,
+    hash_row,
+    fetch_prefix,
+    fetch_bytes,
+    open_url_stream,
+    download_from_url,
+    quiet_downloads,
+    parse_memory_size,
+    IN_FLIGHT_DOWNLOADS,
+)
+from hdx_stable_schema.request_scheduler import Lane
 
 
 def test_print_banner(capfd):
@@ -42,3 +68,263 @@ def test_print_list(capfd):
     assert len(parts) == 4
     for part in parts:
         assert len(part) in [144, 32, 0]
+
+
+def test_hash_row_matches_libhxl():
+    rows = [
+        ["country_name", "admin1_name", "latitude"],
+        [None, " Country  ISO\n", "", "   ", 1.5],
+        [],
+    ]
+    for row in rows:
+        assert hash_row(row) == hxl_hash_row(row)
+
+    assert hash_row([None] * 35) == "d41d8cd98f00b204e9800998ecf8427e"
+
+
+class FakeRangeResponse:
+    def __init__(self, content, status_code, headers):
+        self.content = content
+        self.status_code = status_code
+        self.headers = headers
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size=1):
+        for start in range(0, len(self.content), chunk_size):
+            stop = start + chunk_size
+            yield self.content[start:stop]
+
+    def close(self):
+        pass
+
+
+def fake_range_server(file_content, requests_made):
+    def get(url, headers=None, stream=False, timeout=None):
+        requests_made.append(headers)
+        if headers is None or "Range" not in headers:
+            return FakeRangeResponse(file_content, 200, {})
+        first, _, last = headers["Range"].removeprefix("bytes=").partition("-")
+        last = int(last) if last != "" else len(file_content) - 1
+        start, stop = int(first), last + 1
+        return FakeRangeResponse(
+            file_content[start:stop],
+            206,
+            {"Content-Range": f"bytes {first}-{last}/{len(file_content)}"},
+        )
+
+    return get
+
+
+def test_fetch_prefix_then_remainder(monkeypatch):
+    file_content = b"a,b\n" + b"1,2\n" * 1000
+    requests_made = []
+    monkeypatch.setattr(
+        hdx_stable_schema.utilities.HTTP_SESSION,
+        "get",
+        fake_range_server(file_content, requests_made),
+    )
+    monkeypatch.setattr(hdx_stable_schema.utilities, "DOWNLOAD_CACHE", OrderedDict())
+    monkeypatch.setattr(hdx_stable_schema.utilities, "PREFIX_CACHE", OrderedDict())
+    # As in the daemon, which keeps whole downloads
+    monkeypatch.setattr(hdx_stable_schema.utilities, "CACHE_DOWNLOADS", True)
+    url = "https://data.humdata.org/test.csv"
+
+    prefix, is_complete = fetch_prefix(url, 100)
+    assert prefix == file_content[0:100]
+    assert not is_complete
+
+    assert fetch_bytes(url) == file_content
+    assert requests_made == [{"Range": "bytes=0-99"}, {"Range": "bytes=100-"}]
+
+    # Now the whole file is cached neither call goes back to the server
+    assert fetch_prefix(url, 100) == (file_content[0:100], False)
+    assert fetch_bytes(url) == file_content
+    assert len(requests_made) == 2
+
+
+def test_fetch_prefix_of_small_file(monkeypatch):
+    file_content = b"a,b\n1,2\n"
+    requests_made = []
+    monkeypatch.setattr(
+        hdx_stable_schema.utilities.HTTP_SESSION,
+        "get",
+        fake_range_server(file_content, requests_made),
+    )
+    monkeypatch.setattr(hdx_stable_schema.utilities, "DOWNLOAD_CACHE", OrderedDict())
+    monkeypatch.setattr(hdx_stable_schema.utilities, "PREFIX_CACHE", OrderedDict())
+    url = "https://data.humdata.org/small.csv"
+
+    assert fetch_prefix(url, 100) == (file_content, True)
+    assert fetch_bytes(url) == file_content
+    assert len(requests_made) == 1
+
+
+def test_fetch_large_prefix_in_linear_time(monkeypatch):
+    # Copying the prefix on every 16KB chunk took around 20s for 32MB
+    file_content = b"a,b\n" + b"1,2\n" * (8 * 1024 * 1024)
+    monkeypatch.setattr(
+        hdx_stable_schema.utilities.HTTP_SESSION,
+        "get",
+        fake_range_server(file_content, []),
+    )
+    monkeypatch.setattr(hdx_stable_schema.utilities, "PREFIX_CACHE", OrderedDict())
+    monkeypatch.setitem(
+        hdx_stable_schema.utilities.REQUEST_SCHEDULER.lanes, "download", Lane("download", None)
+    )
+    n_bytes = len(file_content) - 4
+
+    start_time = time.perf_counter()
+    prefix, is_complete = fetch_prefix("https://data.humdata.org/large.csv", n_bytes, cache=False)
+
+    assert time.perf_counter() - start_time < 2.0
+    assert prefix == file_content[0:n_bytes]
+    assert not is_complete
+
+
+def test_fetch_bytes_keeps_nothing_outside_the_daemon(monkeypatch):
+    file_content = b"a,b\n1,2\n" * 100
+    requests_made = []
+    monkeypatch.setattr(
+        hdx_stable_schema.utilities.HTTP_SESSION,
+        "get",
+        fake_range_server(file_content, requests_made),
+    )
+    monkeypatch.setattr(hdx_stable_schema.utilities, "DOWNLOAD_CACHE", OrderedDict())
+    monkeypatch.setattr(hdx_stable_schema.utilities, "PREFIX_CACHE", OrderedDict())
+    monkeypatch.setattr(hdx_stable_schema.utilities, "CACHE_DOWNLOADS", False)
+    url = "https://data.humdata.org/one-shot.csv"
+
+    assert fetch_bytes(url) == file_content
+    assert len(hdx_stable_schema.utilities.DOWNLOAD_CACHE) == 0
+
+
+def test_open_url_stream_reads_as_it_goes(monkeypatch):
+    file_content = b"a,b\n" + b"1,2\n" * 100000
+    chunks_served = []
+
+    class CountingResponse(FakeRangeResponse):
+        def iter_content(self, chunk_size=1):
+            for chunk in super().iter_content(chunk_size):
+                chunks_served.append(len(chunk))
+                yield chunk
+
+    monkeypatch.setattr(
+        hdx_stable_schema.utilities.HTTP_SESSION,
+        "get",
+        lambda url, **kwargs: CountingResponse(file_content, 200, {}),
+    )
+    monkeypatch.setattr(hdx_stable_schema.utilities, "DOWNLOAD_CACHE", OrderedDict())
+    monkeypatch.setattr(hdx_stable_schema.utilities, "PREFIX_CACHE", OrderedDict())
+    monkeypatch.setattr(hdx_stable_schema.utilities, "CACHE_DOWNLOADS", False)
+
+    with open_url_stream("https://data.humdata.org/stream.csv") as stream:
+        assert stream.readline() == b"a,b\n"
+        assert sum(chunks_served) < len(file_content) / 4
+        assert stream.read() == file_content[4:]
+    assert sum(chunks_served) == len(file_content)
+    assert len(hdx_stable_schema.utilities.DOWNLOAD_CACHE) == 0
+
+
+def test_open_url_stream_reuses_prefix(monkeypatch):
+    file_content = b"a,b\n" + b"1,2\n" * 1000
+    requests_made = []
+    monkeypatch.setattr(
+        hdx_stable_schema.utilities.HTTP_SESSION,
+        "get",
+        fake_range_server(file_content, requests_made),
+    )
+    monkeypatch.setattr(hdx_stable_schema.utilities, "DOWNLOAD_CACHE", OrderedDict())
+    monkeypatch.setattr(hdx_stable_schema.utilities, "PREFIX_CACHE", OrderedDict())
+    monkeypatch.setattr(hdx_stable_schema.utilities, "CACHE_DOWNLOADS", False)
+    url = "https://data.humdata.org/stream.csv"
+
+    fetch_prefix(url, 100)
+    with open_url_stream(url) as stream:
+        assert stream.read() == file_content
+    assert requests_made == [{"Range": "bytes=0-99"}, {"Range": "bytes=100-"}]
+
+    # A server which ignores Range sends the whole file, which is read from the start
+    monkeypatch.setattr(
+        hdx_stable_schema.utilities.HTTP_SESSION,
+        "get",
+        lambda url, **kwargs: FakeRangeResponse(file_content, 200, {}),
+    )
+    with open_url_stream(url) as stream:
+        assert stream.read() == file_content
+
+
+def test_quiet_downloads_print_nothing(monkeypatch, capsys):
+    file_content = b"{}" * 100000
+
+    class StreamOnlyResponse(FakeRangeResponse):
+        # Quiet downloads are still written a chunk at a time, never held whole
+        def __init__(self, content, status_code, headers):
+            super().__init__(b"", status_code, headers)
+            self.streamed_content = content
+
+        def iter_content(self, chunk_size=1):
+            for start in range(0, len(self.streamed_content), chunk_size):
+                stop = start + chunk_size
+                yield self.streamed_content[start:stop]
+
+    monkeypatch.setattr(
+        hdx_stable_schema.utilities.HTTP_SESSION,
+        "get",
+        lambda url, **kwargs: StreamOnlyResponse(
+            file_content, 200, {"content-length": str(len(file_content))}
+        ),
+    )
+    url = "https://data.humdata.org/quiet.geojson"
+
+    download_file_path, _ = download_from_url(url)
+    assert "Downloading quiet.geojson" in capsys.readouterr().out
+
+    with quiet_downloads():
+        download_file_path, error_message = download_from_url(url)
+    assert capsys.readouterr().out == ""
+    assert hdx_stable_schema.utilities.SHOW_DOWNLOAD_PROGRESS
+    assert error_message == "Success"
+    assert download_file_path.read_bytes() == file_content
+    shutil.rmtree(download_file_path.parent)
+
+
+def test_parse_memory_size():
+    assert parse_memory_size("512M") == 512 * 1024 * 1024
+    assert parse_memory_size("2G") == 2 * 1024**3
+    assert parse_memory_size("64KB") == 64 * 1024
+    assert parse_memory_size("1.5MiB") == 1536 * 1024
+    assert parse_memory_size("1000") == 1000
+    with pytest.raises(ValueError):
+        parse_memory_size("lots")
+
+
+def test_concurrent_fetches_share_one_transfer(monkeypatch):
+    file_content = b"a,b\n1,2\n" * 1000
+    requests_made = []
+    release = threading.Event()
+    fake_get = fake_range_server(file_content, requests_made)
+
+    def slow_get(url, **kwargs):
+        release.wait(timeout=5)
+        return fake_get(url, **kwargs)
+
+    monkeypatch.setattr(hdx_stable_schema.utilities.HTTP_SESSION, "get", slow_get)
+    monkeypatch.setattr(hdx_stable_schema.utilities, "DOWNLOAD_CACHE", OrderedDict())
+    monkeypatch.setattr(hdx_stable_schema.utilities, "PREFIX_CACHE", OrderedDict())
+    monkeypatch.setitem(
+        hdx_stable_schema.utilities.REQUEST_SCHEDULER.lanes, "download", Lane("download", None)
+    )
+    url = "https://data.humdata.org/shared.csv"
+    n_shared = IN_FLIGHT_DOWNLOADS.metrics()["shared"]
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        futures = [pool.submit(fetch_bytes, url) for _ in range(4)]
+        while IN_FLIGHT_DOWNLOADS.metrics()["shared"] < n_shared + 3:
+            time.sleep(0.01)
+        release.set()
+        results = [x.result() for x in futures]
+
+    assert results == [file_content] * 4
+    assert len(requests_made) == 1